@@ -1,10 +1,10 @@
-import json
 import logging
 import typing
 from typing import Tuple
 
 import networkx as nx
 
+from autofr.common.perf_log_utils import get_parsed_perf_log
 from autofr.common.utils import should_skip_perf_url, is_request_js_extension, \
     get_variations_of_domains, get_unique_str, is_real_fqdn, is_real_fqdn_with_path
 
@@ -50,22 +50,11 @@ def _get_parent_from_script_type(json_obj: typing.Any) -> list:
 
 
 def get_initiator_chain_log_entries(file_path: str) -> list:
-    log_entries = []
-    with open(file_path) as webrequests_file:
-        for line in webrequests_file:
-            try:
-                line_json = json.loads(line.strip())
-                message_json = json.loads(line_json["message"])
-                if "Network.requestWillBeSent" == message_json["message"]["method"]:
-                    if not should_skip_perf_url(message_json["message"]["params"]["documentURL"]):
-                        log_entries.append(message_json["message"]["params"])
-            except Exception as e:
-                logger.warning("Could not parse json of perf log %s", str(e))
-
-    log_entries = sorted(log_entries, key=lambda x: x["timestamp"])
-
-    #logger.debug("Found %d log entries", len(log_entries))
-    return log_entries
+    """
+    Network.requestWillBeSent params of the perf log sorted by timestamp.
+    The perf log is parsed once and shared with the other readers, see perf_log_utils.get_parsed_perf_log
+    """
+    return list(get_parsed_perf_log(file_path).log_entries)
 
 
 def get_initiator_chain_info(file_path: str) -> typing.Tuple[list, dict]:
@@ -256,6 +245,98 @@ def get_initiator_chain_graph_raw(file_path: str, root: str,
     return g
 
 
+def find_duplicate_nodes_by_simple_paths(g: nx.DiGraph, root: str, url_type: str) -> typing.List[list]:
+    """
+    Step (3) of get_initiator_chain_graph_by_type by going over all simple paths from the root to the leaves.
+    The number of paths can be exponential, so this is only used for graphs with cycles, see find_duplicate_nodes
+    """
+    g = g.copy()
+    rounds = []
+    while True:
+        nodes_to_remove = []
+
+        leaf_nodes = [x for x in g.nodes() if g.out_degree(x) == 0 and g.in_degree(x) >= 1]
+        for path in nx.all_simple_paths(g, source=root, target=leaf_nodes):
+            # we ignore the root and last node
+            # if an earlier node has same url_type, then set the last_node for deletion
+            if len(path) > 2:
+                last_node = path[-1]
+                last_node_url_type = g.nodes[last_node][url_type]
+                for n in path[1:-1]:
+                    if g.nodes[n][url_type] == last_node_url_type:
+                        nodes_to_remove.append(last_node)
+
+        if len(nodes_to_remove) == 0:
+            return rounds
+
+        rounds.append(list(dict.fromkeys(nodes_to_remove)))
+
+        # we don't care about reconnecting cause we are removing leaf nodes
+        for leaf in leaf_nodes:
+            g.remove_node(leaf)
+
+
+def find_duplicate_nodes(g: nx.DiGraph, root: str, url_type: str) -> typing.List[list]:
+    """
+    Step (3) of get_initiator_chain_graph_by_type: the nodes to remove, grouped by the round of leaves they were in.
+    Each round takes the current leaves (then removes them from the graph) and marks a leaf when an earlier node
+    of a path from the root to it has the same url_type. It stops at the first round that marks nothing.
+
+    Without cycles, the leaves of round k are the nodes whose longest path to a leaf has k edges,
+    and a leaf is marked when one of its ancestors that the root reaches (other than the root) has the same url_type.
+    Both are found in topological order, with the url_types of the ancestors of each node kept as a bitset,
+    so this takes O(edges * url types / 64) instead of going over every simple path.
+    Graphs with cycles that the root reaches fall back to find_duplicate_nodes_by_simple_paths.
+    """
+    if root not in g:
+        return find_duplicate_nodes_by_simple_paths(g, root, url_type)
+
+    reachable = nx.descendants(g, root)
+    reachable.add(root)
+    g_reachable = g.subgraph(reachable)
+    try:
+        topological_order = list(nx.topological_sort(g_reachable))
+    except nx.NetworkXUnfeasible:
+        logger.debug(f"Initiator chain graph of {root} has cycles, going over its simple paths")
+        return find_duplicate_nodes_by_simple_paths(g, root, url_type)
+
+    # longest path to a leaf, which is the round the node is a leaf in
+    heights = dict()
+    for n in reversed(topological_order):
+        heights[n] = 1 + max((heights[s] for s in g_reachable.successors(n)), default=-1)
+
+    url_type_bits = dict()
+    # bitset of the url_types of the ancestors of a node, dropped once all of its successors have theirs
+    ancestor_bits = dict()
+    successors_left = {n: g_reachable.out_degree(n) for n in topological_order}
+    is_duplicate = dict()
+    for n in topological_order:
+        bits = 0
+        for p in g_reachable.predecessors(n):
+            bits |= ancestor_bits[p]
+            if p != root:
+                bits |= url_type_bits.setdefault(g.nodes[p][url_type], 1 << len(url_type_bits))
+            successors_left[p] -= 1
+            if successors_left[p] == 0:
+                del ancestor_bits[p]
+        if n != root and bits:
+            value_bit = url_type_bits.get(g.nodes[n][url_type], 0)
+            is_duplicate[n] = bool(bits & value_bit)
+        if successors_left[n] > 0:
+            ancestor_bits[n] = bits
+
+    rounds = [[] for _ in range(heights[root] + 1)]
+    for n in g.nodes():
+        if is_duplicate.get(n):
+            rounds[heights[n]].append(n)
+
+    # stop at the first round without duplicates
+    for i, nodes_to_remove in enumerate(rounds):
+        if not nodes_to_remove:
+            return rounds[:i]
+    return rounds
+
+
 def get_initiator_chain_graph_by_type(url_type: str,
                                       file_path: str,
                                       root: str,
@@ -300,40 +381,10 @@ def get_initiator_chain_graph_by_type(url_type: str,
     # root -> a.com -> b.com -> a.com -> c.com , then we only keep the top most nodes
     # root -> a.com -> b.com -> c.com
     g_no_dups = g.copy()
-
-    all_unique_nodes = False
-    iteration = 0
-    while not all_unique_nodes:
-        # logger.debug("iteration %d", iteration)
-        nodes_to_remove = []
-
-        leaf_nodes = [x for x in g.nodes() if g.out_degree(x) == 0 and g.in_degree(x) >= 1]
-        for path in nx.all_simple_paths(g, source=root, target=leaf_nodes):
-            # we ignore the root and last node
-            # if an earlier node has same url_type, then set the last_node for deletion
-            if len(path) > 2:
-                last_node = path[-1]
-                last_node_url_type = g.nodes[last_node][url_type]
-                for n in path[1:-1]:
-                    # logger.debug("current n %s sld %s, looking for %s", n, g.nodes[n]["sld"], last_node)
-                    if g.nodes[n][url_type] == last_node_url_type:
-                        # logger.debug("MATCH: current n %s sld %s, looking for %s", n, g.nodes[n]["sld"], last_node)
-                        nodes_to_remove.append(last_node)
-
-        if len(nodes_to_remove) == 0:
-            all_unique_nodes = True
-        else:
-            for n in set(nodes_to_remove):
-                # remove n and connect edges
-                # logger.debug("removing node %s", n)
-                if n in g_no_dups.nodes:
-                    g_no_dups = remove_node_and_connect(g_no_dups, n)
-
-            # we don't care about reconnecting cause we are removing leaf nodes
-            for leaf in leaf_nodes:
-                g.remove_node(leaf)
-
-            iteration += 1
+    for nodes_to_remove in find_duplicate_nodes(g, root, url_type):
+        for n in nodes_to_remove:
+            # remove n and connect edges
+            g_no_dups = remove_node_and_connect(g_no_dups, n)
 
     #if output_directory and save_raw_initiator_chain:
     #    full_file_path = f"{output_directory}{os.sep}{root}_from_perf_log_simple_no_dups_{url_type}__{file_unique_suffix}.graphml"
@@ -1,8 +1,9 @@
-import copy
 import logging
+import re
 import typing
 
 from adblockparser import AdblockRules, AdblockRule
+from adblockparser.utils import split_data
 
 logger = logging.getLogger(__name__)
 
@@ -74,7 +75,7 @@ class AutoFRAdblockRules (AdblockRules):
         #if general_re and general_re.search(url):
         #    return True
 
-        rules = copy.deepcopy(curr_rules)
+        rules = list(curr_rules)
         if 'domain' in options and domain_required_rules:
             src_domain = options['domain']
             for domain in _domain_variants(src_domain):
@@ -93,3 +94,299 @@ class AutoFRAdblockRules (AdblockRules):
 
         return len(matched_rules) > 0, matched_rules
 
+
+# runs of characters that are used as keywords of rules and tokens of urls
+_TOKEN_RE = re.compile(r"[A-Za-z0-9%]+")
+
+
+def _get_rule_keywords(rule: AdblockRule) -> typing.List[str]:
+    """
+    Returns the keywords of a rule: runs of token characters that any url matched by the rule
+    must hold as a whole token. Regex rules and rules with | in the middle have no keywords.
+
+    >>> _get_rule_keywords(AdblockRule("||ads.example.com^"))
+    ['ads', 'example', 'com']
+    >>> _get_rule_keywords(AdblockRule("/banner*/img^"))
+    ['img']
+    >>> _get_rule_keywords(AdblockRule("/ads/[0-9]+/"))
+    []
+    """
+    rule_text = rule.rule_text
+    if rule_text.startswith("/") and rule_text.endswith("/"):
+        return []
+
+    start_anchored = end_anchored = False
+    if rule_text.startswith("||"):
+        start_anchored, rule_text = True, rule_text[2:]
+    elif rule_text.startswith("|"):
+        start_anchored, rule_text = True, rule_text[1:]
+    if rule_text.endswith("|"):
+        end_anchored, rule_text = True, rule_text[:-1]
+    if "|" in rule_text:
+        return []
+
+    keywords = []
+    for token_match in _TOKEN_RE.finditer(rule_text):
+        start, end = token_match.span()
+        # the token must not be next to a wildcard or an unanchored end of the rule
+        if (start > 0 and rule_text[start - 1] != "*") or (start == 0 and start_anchored):
+            if (end < len(rule_text) and rule_text[end] != "*") or (end == len(rule_text) and end_anchored):
+                keywords.append(token_match.group())
+    return keywords
+
+
+class _RuleTokenIndex:
+    """
+    Rules indexed by one of their keywords. Rules without keywords are always candidates.
+    """
+
+    def __init__(self, rules: typing.Iterable[AdblockRule] = ()):
+        self.rules: typing.List[AdblockRule] = []
+        self._rules_by_keyword: typing.Dict[str, typing.List[int]] = dict()
+        self._rules_without_keyword: typing.List[int] = []
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule: AdblockRule):
+        keywords = _get_rule_keywords(rule)
+        rule_index = len(self.rules)
+        self.rules.append(rule)
+        if keywords:
+            # pick the least used keyword (then the longest) to keep the buckets small
+            keyword = min(keywords, key=lambda k: (len(self._rules_by_keyword.get(k, [])), -len(k)))
+            self._rules_by_keyword.setdefault(keyword, []).append(rule_index)
+        else:
+            self._rules_without_keyword.append(rule_index)
+
+    def get_candidates(self, url_tokens: typing.Set[str]) -> typing.List[AdblockRule]:
+        """
+        Returns the rules that could match an url with the given tokens, in the order they were added
+        """
+        rule_indices = list(self._rules_without_keyword)
+        for token in url_tokens:
+            if token in self._rules_by_keyword:
+                rule_indices += self._rules_by_keyword[token]
+        rule_indices.sort()
+        return [self.rules[i] for i in rule_indices]
+
+    def __len__(self):
+        return len(self.rules)
+
+
+class AutoFRTokenIndexedAdblockRules(AutoFRAdblockRules):
+    """
+    Same results as AutoFRAdblockRules, but rules are indexed by keywords so that only the rules
+    that share a token with the url are tried. Meant for big lists like EasyList.
+    The combined regexes of AdblockRules are not compiled since they are not used by should_block_2.
+    """
+
+    def __init__(self, rules, supported_options=None, skip_unsupported_rules=True, rule_cls=AdblockRule):
+        if supported_options is None:
+            self.supported_options = rule_cls.BINARY_OPTIONS + ['domain']
+        else:
+            self.supported_options = supported_options
+
+        self.uses_re2 = False
+        self.rule_cls = rule_cls
+        self.skip_unsupported_rules = skip_unsupported_rules
+
+        _params = dict((opt, True) for opt in self.supported_options)
+        self.rules = [
+            r for r in (
+                r if isinstance(r, rule_cls) else rule_cls(r)
+                for r in rules
+            )
+            if (r.regex or r.options) and r.matching_supported(_params)
+        ]
+
+        advanced_rules, basic_rules = split_data(self.rules, lambda r: r.options)
+        domain_required_rules, non_domain_rules = split_data(
+            advanced_rules,
+            lambda r: (
+                'domain' in r.options
+                and any(r.options["domain"].values())
+            )
+        )
+
+        self.blacklist, self.whitelist = self._split_bw(basic_rules)
+        self.blacklist_re = self.whitelist_re = None
+        self.blacklist_with_options, self.whitelist_with_options = \
+            self._split_bw(non_domain_rules)
+        self.blacklist_require_domain, self.whitelist_require_domain = \
+            self._split_bw_domain(domain_required_rules)
+
+        self._blacklist_index = _RuleTokenIndex(self.blacklist)
+        self._whitelist_index = _RuleTokenIndex(self.whitelist)
+        self._blacklist_with_options_index = _RuleTokenIndex(self.blacklist_with_options)
+        self._whitelist_with_options_index = _RuleTokenIndex(self.whitelist_with_options)
+        self._blacklist_require_domain_index = {domain: _RuleTokenIndex(domain_rules)
+                                                for domain, domain_rules in self.blacklist_require_domain.items()}
+        self._whitelist_require_domain_index = {domain: _RuleTokenIndex(domain_rules)
+                                                for domain, domain_rules in self.whitelist_require_domain.items()}
+
+    def should_block_2(self, url, options=None) -> typing.Tuple[bool, typing.List[AdblockRule]]:
+        options = options or {}
+        url_tokens = set(_TOKEN_RE.findall(url))
+        white_listed, matched_rules = self._matches_indexed(url, url_tokens, options,
+                                                            self._whitelist_require_domain_index,
+                                                            self._whitelist_with_options_index,
+                                                            self._whitelist_index)
+        if white_listed:
+            return False, matched_rules
+
+        return self._matches_indexed(url, url_tokens, options,
+                                     self._blacklist_require_domain_index,
+                                     self._blacklist_with_options_index,
+                                     self._blacklist_index)
+
+    def _is_whitelisted(self, url, options) -> typing.Tuple[bool, typing.List[AdblockRule]]:
+        return self._matches_indexed(url, set(_TOKEN_RE.findall(url)), options,
+                                     self._whitelist_require_domain_index,
+                                     self._whitelist_with_options_index,
+                                     self._whitelist_index)
+
+    def _is_blacklisted(self, url, options) -> typing.Tuple[bool, typing.List[AdblockRule]]:
+        return self._matches_indexed(url, set(_TOKEN_RE.findall(url)), options,
+                                     self._blacklist_require_domain_index,
+                                     self._blacklist_with_options_index,
+                                     self._blacklist_index)
+
+    def _matches_indexed(self, url, url_tokens: typing.Set[str], options,
+                         domain_required_index: typing.Dict[str, _RuleTokenIndex],
+                         with_options_index: _RuleTokenIndex,
+                         basic_index: _RuleTokenIndex) -> typing.Tuple[bool, typing.List[AdblockRule]]:
+        """
+        Same as AutoFRAdblockRules._matches but only tries the candidates of each index
+        """
+        rules = basic_index.get_candidates(url_tokens)
+        if 'domain' in options and domain_required_index:
+            src_domain = options['domain']
+            for domain in _domain_variants(src_domain):
+                if domain in domain_required_index:
+                    rules.extend(domain_required_index[domain].get_candidates(url_tokens))
+
+        rules.extend(with_options_index.get_candidates(url_tokens))
+
+        if self.skip_unsupported_rules:
+            rules = [rule for rule in rules if rule.matching_supported(options)]
+
+        matched_rules = []
+        for rule in rules:
+            if rule.match_url(url, options):
+                matched_rules.append(rule)
+
+        return len(matched_rules) > 0, matched_rules
+
+
+# characters that are not separators (^) in adblock rules
+_NON_SEPARATOR_RUN_RE = re.compile(r"[\w\d_\-.%]*")
+# characters that would not be taken literally within the path of a ||domain/path rule
+_DOMAIN_ANCHOR_PATH_SPECIAL_CHARS = "^*|$#"
+# characters that end the authority part of an url
+_AUTHORITY_END_CHARS = "/?#"
+
+
+def _get_domain_anchor_rule_parts(rule: AdblockRule) -> typing.Optional[typing.Tuple[str, str]]:
+    """
+    For rules like ||domain^ or ||domain/path (see create_rule_simple), returns the domain and
+    the literal text that must follow the start of the domain within the url.
+    Returns None for any other rule.
+    """
+    if rule.is_comment or rule.is_html_rule or rule.is_exception or rule.options:
+        return None
+    rule_text = rule.rule_text
+    if not rule_text.startswith("||") or len(rule_text) <= 2:
+        return None
+    rule_text = rule_text[2:]
+    if rule_text.endswith("^") and "/" not in rule_text:
+        domain = rule_text[:-1]
+        if domain and _NON_SEPARATOR_RUN_RE.fullmatch(domain):
+            return domain, domain
+        return None
+    domain = rule_text.split("/", 1)[0]
+    if domain and "/" in rule_text and _NON_SEPARATOR_RUN_RE.fullmatch(domain) \
+            and not any(c in rule_text for c in _DOMAIN_ANCHOR_PATH_SPECIAL_CHARS):
+        return domain, rule_text
+    return None
+
+
+def is_domain_anchor_rule(rule: typing.Union[str, AdblockRule]) -> bool:
+    if not isinstance(rule, AdblockRule):
+        rule = AdblockRule(rule)
+    return _get_domain_anchor_rule_parts(rule) is not None
+
+
+def _get_domain_anchor_start_positions(url: str) -> typing.List[int]:
+    r"""
+    Positions of url where the domain of a ||domain rule can start, which mirrors the regex that
+    adblockparser uses for ||: ^(?:[^:/?#]+:)?(?://(?:[^/?#]*\.)?)?
+    """
+    positions = [0]
+    scheme_end = url.find(":")
+    if scheme_end > 0 and not any(c in url[:scheme_end] for c in _AUTHORITY_END_CHARS):
+        positions.append(scheme_end + 1)
+
+    for position in list(positions):
+        if url.startswith("//", position):
+            authority_start = position + 2
+            positions.append(authority_start)
+            for index in range(authority_start, len(url)):
+                c = url[index]
+                if c in _AUTHORITY_END_CHARS:
+                    break
+                if c == ".":
+                    positions.append(index + 1)
+    return positions
+
+
+class AutoFRDomainAnchorRules:
+    """
+    Matcher for lists that only hold ||domain^ and ||domain/path rules, which are the rules AutoFR creates.
+    Instead of trying the regex of every rule, it looks up the domain that starts at every position
+    where a ||domain rule could match. Same results as AutoFRAdblockRules.should_block_2 for these rules.
+    """
+
+    def __init__(self, rules: typing.Iterable[typing.Union[str, AdblockRule]]):
+        self.rules: typing.List[AdblockRule] = []
+        # domain to (rule index, literal text that must be at the domain's position, rule)
+        self._rules_by_domain: typing.Dict[str, typing.List[typing.Tuple[int, str, AdblockRule]]] = dict()
+        for rule in rules:
+            if not isinstance(rule, AdblockRule):
+                rule = AdblockRule(rule)
+            rule_parts = _get_domain_anchor_rule_parts(rule)
+            if rule_parts is None:
+                raise ValueError(f"Rule is not a ||domain^ or ||domain/path rule: {rule.raw_rule_text}")
+            domain, literal_text = rule_parts
+            self._rules_by_domain.setdefault(domain, []).append((len(self.rules), literal_text, rule))
+            self.rules.append(rule)
+        self.blacklist = self.rules
+        self.whitelist = []
+
+    def should_block(self, url, options=None) -> bool:
+        return self.should_block_2(url, options)[0]
+
+    def should_block_2(self, url, options=None) -> typing.Tuple[bool, typing.List[AdblockRule]]:
+        """
+        Returns whether the url was blocked and the rules that matched (in the order of the rules)
+        """
+        matched_rules = dict()
+        for position in _get_domain_anchor_start_positions(url):
+            # the domain of a matching rule must be followed by a separator or by the rest of its literal text,
+            # so it is exactly the run of non-separator characters at this position
+            domain = _NON_SEPARATOR_RUN_RE.match(url, position).group()
+            for rule_index, literal_text, rule in self._rules_by_domain.get(domain, []):
+                if rule_index not in matched_rules and url.startswith(literal_text, position):
+                    matched_rules[rule_index] = rule
+
+        return len(matched_rules) > 0, [matched_rules[i] for i in sorted(matched_rules)]
+
+
+def get_adblock_rules(rules: typing.List[str]) \
+        -> typing.Union[AutoFRTokenIndexedAdblockRules, AutoFRDomainAnchorRules]:
+    """
+    Returns the fastest matcher that supports all rules
+    """
+    adblock_rules = [AdblockRule(rule) for rule in rules]
+    if all(_get_domain_anchor_rule_parts(rule) is not None for rule in adblock_rules):
+        return AutoFRDomainAnchorRules(adblock_rules)
+    return AutoFRTokenIndexedAdblockRules(adblock_rules)
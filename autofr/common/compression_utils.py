@@ -0,0 +1,113 @@
+import glob
+import gzip
+import logging
+import os
+import shutil
+import typing
+
+logger = logging.getLogger(__name__)
+
+# gzip files start with these two bytes, readers use them instead of the file name
+GZIP_MAGIC = b"\x1f\x8b"
+COMPRESSED_FILE_EXT = ".gz"
+COMPRESS_LEVEL = 6
+
+# should perf logs, raw adgraphs and site snapshots be written compressed? Passed on to docker runs as well
+COMPRESS_OUTPUTS_ENV = "AUTOFR_COMPRESS_OUTPUTS"
+COMPRESS_OUTPUTS = os.environ.get(COMPRESS_OUTPUTS_ENV, "False") == "True"
+
+
+def is_compressed_file(file_path: str) -> bool:
+    """
+    Whether the file is gzip compressed, whatever its name is
+    """
+    try:
+        with open(file_path, "rb") as f:
+            return f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    except OSError:
+        return False
+
+
+def open_maybe_compressed(file_path: str, mode: str = "r", compresslevel: int = COMPRESS_LEVEL) -> typing.IO:
+    """
+    Opens a file that may be gzip compressed.
+    Reading detects the format from the content, writing and appending compress when the path ends with .gz.
+    Appending to a compressed file adds a gzip member, which reads back as one file.
+    """
+    if "r" in mode and "+" not in mode:
+        compressed = is_compressed_file(file_path)
+    else:
+        compressed = file_path.endswith(COMPRESSED_FILE_EXT)
+
+    if not compressed:
+        return open(file_path, mode)
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    return gzip.open(file_path, mode.replace("+", ""), compresslevel=compresslevel)
+
+
+def get_output_file_path(file_path: str, compress: bool = None) -> str:
+    """
+    Path to write file_path to, with .gz added when compressing (defaults to COMPRESS_OUTPUTS)
+    """
+    if compress is None:
+        compress = COMPRESS_OUTPUTS
+    if compress and not file_path.endswith(COMPRESSED_FILE_EXT):
+        return file_path + COMPRESSED_FILE_EXT
+    return file_path
+
+
+def remove_compressed_ext(file_path: str) -> str:
+    if file_path.endswith(COMPRESSED_FILE_EXT):
+        return file_path[:-len(COMPRESSED_FILE_EXT)]
+    return file_path
+
+
+def glob_maybe_compressed(pattern: str, recursive: bool = False) -> typing.List[str]:
+    """
+    Like glob.glob, but also finds the compressed variants of the files that pattern matches.
+    A compressed variant is left out when the uncompressed file is there too.
+    """
+    file_paths = glob.glob(pattern, recursive=recursive)
+    uncompressed_file_paths = set(file_paths)
+    for file_path in glob.glob(pattern + COMPRESSED_FILE_EXT, recursive=recursive):
+        if file_path[:-len(COMPRESSED_FILE_EXT)] not in uncompressed_file_paths:
+            file_paths.append(file_path)
+    return file_paths
+
+
+def compress_file(file_path: str, remove_original: bool = True, compresslevel: int = COMPRESS_LEVEL) -> str:
+    """
+    Writes file_path.gz and returns its path. Files that are compressed already are only renamed to .gz
+    """
+    compressed_file_path = get_output_file_path(file_path, compress=True)
+    if compressed_file_path == file_path:
+        return file_path
+
+    if is_compressed_file(file_path):
+        if remove_original:
+            os.replace(file_path, compressed_file_path)
+        else:
+            shutil.copy2(file_path, compressed_file_path)
+        return compressed_file_path
+
+    # write to a temporary file first so readers never see a partial file
+    tmp_file_path = f"{compressed_file_path}.{os.getpid()}.tmp"
+    with open(file_path, "rb") as f_in, gzip.open(tmp_file_path, "wb", compresslevel=compresslevel) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    shutil.copystat(file_path, tmp_file_path)
+    os.replace(tmp_file_path, compressed_file_path)
+    if remove_original:
+        os.remove(file_path)
+    return compressed_file_path
+
+
+def compress_files_in_dir(dir_path: str, pattern: str, compresslevel: int = COMPRESS_LEVEL) -> typing.List[str]:
+    """
+    Compresses the files within dir_path (recursively) that match pattern and are not compressed yet
+    """
+    compressed_file_paths = []
+    for file_path in glob.glob(dir_path + os.sep + "**" + os.sep + pattern, recursive=True):
+        if os.path.isfile(file_path):
+            compressed_file_paths.append(compress_file(file_path, compresslevel=compresslevel))
+    return compressed_file_paths
@@ -7,8 +7,8 @@ import pandas as pd
 from subprocess import CompletedProcess
 
 from autofr.common.action_space_utils import TYPE_ESLD, TYPE_FQDN, TYPE_FQDN_PATH
-from autofr.common.selenium_utils import get_webrequests_from_perf_json
-from autofr.common.utils import get_variations_of_domains
+from autofr.common.compression_utils import COMPRESS_OUTPUTS, COMPRESS_OUTPUTS_ENV, is_compressed_file
+from autofr.common.perf_log_utils import get_parsed_perf_log
 from autofr.rl.browser_env.reward import SiteFeedback, SiteFeedbackRange, RewardTerms
 
 logger = logging.getLogger(__name__)
@@ -61,15 +61,11 @@ class DockerResponseBase:
                                                           TYPE_FQDN_PATH: dict()}
 
             for perf_log in response.perf_log_files:
-                out_tmp = get_webrequests_from_perf_json(perf_log)
-                for url in out_tmp:
-                    sld, fqdn, fqdn_path, _ = get_variations_of_domains(url)
-                    if sld:
-                        self.response_to_url_variations[index][TYPE_ESLD][sld] = 1
-                    if fqdn:
-                        self.response_to_url_variations[index][TYPE_FQDN][fqdn] = 1
-                    if fqdn_path:
-                        self.response_to_url_variations[index][TYPE_FQDN][fqdn_path] = 1
+                # variations of each perf log are computed once, see perf_log_utils.get_parsed_perf_log
+                slds, fqdns, fqdn_paths = get_parsed_perf_log(perf_log).get_url_variations()
+                self.response_to_url_variations[index][TYPE_ESLD].update(dict.fromkeys(slds, 1))
+                self.response_to_url_variations[index][TYPE_FQDN].update(dict.fromkeys(fqdns, 1))
+                self.response_to_url_variations[index][TYPE_FQDN].update(dict.fromkeys(fqdn_paths, 1))
 
         return self.response_to_url_variations
 
@@ -125,7 +121,7 @@ class InitSiteFeedbackDockerResponse(DockerResponseBase):
         dissimilar_hashes_df_merged = None
         try:
             for f in self.dissimilar_hash_files:
-                dissimilar_hashes_dfs.append(pd.read_csv(f))
+                dissimilar_hashes_dfs.append(pd.read_csv(f, compression="gzip" if is_compressed_file(f) else None))
             if len(dissimilar_hashes_dfs) > 0:
                 dissimilar_hashes_df_merged = pd.concat(dissimilar_hashes_dfs)
         except ValueError:
@@ -208,6 +204,8 @@ def get_docker_run_params(docker_name: str, **env_vars) -> list:
 
 
 def run_browser_docker_process(docker_name: str, **env_vars) -> CompletedProcess:
+    # docker runs compress their outputs whenever we do
+    env_vars.setdefault(COMPRESS_OUTPUTS_ENV, COMPRESS_OUTPUTS)
     process = subprocess.run(get_docker_run_params(docker_name, **env_vars),
                              stdout=subprocess.PIPE, universal_newlines=True)
     return process
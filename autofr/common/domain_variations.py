@@ -0,0 +1,59 @@
+import functools
+import logging
+import typing
+from typing import Tuple
+from urllib.parse import urlparse
+
+import tldextract
+
+logger = logging.getLogger(__name__)
+
+# max number of urls remembered by each memoized function
+DOMAIN_VARIATIONS_CACHE_SIZE = 2 ** 17
+
+# Extractor over the public suffix list snapshot that ships with tldextract.
+# It never goes to the network, so results do not change between runs or machines.
+# The suffix list is compiled into a trie the first time it is used.
+_OFFLINE_TLD_EXTRACTOR = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None, fallback_to_snapshot=True)
+
+
+@functools.lru_cache(maxsize=DOMAIN_VARIATIONS_CACHE_SIZE)
+def extract_tld(url: str):
+    """
+    Splits the url into subdomain, domain and suffix (see tldextract.extract)
+    """
+    return _OFFLINE_TLD_EXTRACTOR(url)
+
+
+@functools.lru_cache(maxsize=DOMAIN_VARIATIONS_CACHE_SIZE)
+def get_variations_of_domains(domain: str) -> Tuple[
+    typing.Optional[str], str, typing.Optional[str], typing.Optional[str]]:
+    """
+        Given a domain, return the eSLD, FQDN, FQDN+Path, Path with no protocol
+    """
+    url_tld = extract_tld(domain)
+    sld = url_tld.domain + "." + url_tld.suffix
+    fqdn = sld
+    if url_tld.subdomain:
+        fqdn = url_tld.subdomain + "." + sld
+
+    path = urlparse(domain).path
+    if path == "/" or path == "":
+        # if path is not there, then we don't need to consider it fqdn_and_path
+        fqdn_and_path = None
+        path = None
+    else:
+        fqdn_and_path = fqdn + path
+
+    if sld.endswith("."):
+        sld = None
+
+    return sld, fqdn, fqdn_and_path, path
+
+
+def get_domain_variations_cache_info() -> typing.Dict[str, dict]:
+    """
+    Hits, misses and sizes of the memoized functions
+    """
+    return {"extract_tld": extract_tld.cache_info()._asdict(),
+            "get_variations_of_domains": get_variations_of_domains.cache_info()._asdict()}
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import logging
 import os
@@ -95,6 +96,14 @@ class FilterRuleBlockRecord:
         return False
 
 
+def get_rules_hash(filter_rules: typing.Iterable[str]) -> str:
+    """
+    Hash of the set of rules, independent of their order, duplicates and surrounding whitespace
+    """
+    canonical_rules = sorted(set(rule.strip() for rule in filter_rules))
+    return hashlib.sha256("\n".join(canonical_rules).encode("utf-8")).hexdigest()
+
+
 def create_rule_simple(domain: str) -> str:
     if "/" not in domain:
         return f"{FILTER_RULE_DOMAIN_START}{domain}{FILTER_RULE_DOMAIN_DELIMITER}"
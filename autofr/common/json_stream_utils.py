@@ -0,0 +1,157 @@
+import json
+import logging
+import typing
+
+from autofr.common.compression_utils import open_maybe_compressed
+
+logger = logging.getLogger(__name__)
+
+# number of characters read from the file at a time
+JSON_STREAM_CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = " \t\n\r"
+# characters that can continue a number, valid JSON never has them right after one
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+class JSONStreamReader:
+    """
+    Reads a JSON file whose top-level value is an object, one value at a time.
+    Arrays of the given stream keys are read one element at a time, so only the element being decoded
+    and a read buffer are kept in memory.
+
+    Example:
+        with JSONStreamReader(file_path) as reader:
+            for key, value in reader.iter_object(stream_keys=["timeline"]):
+                if key == "timeline":
+                    for event in value:
+                        ...
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = JSON_STREAM_CHUNK_SIZE):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        # gzip compressed files are read as well
+        self._file = open_maybe_compressed(file_path)
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        # the array iterator that must be exhausted before the next key can be read
+        self._open_array: typing.Optional[typing.Iterator] = None
+
+    def _read_more(self, size: int) -> bool:
+        """
+        Appends up to size characters to the buffer, dropping what has been consumed already
+        """
+        if self._eof:
+            return False
+        data = self._file.read(size)
+        if not data:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """
+        Skips whitespace and returns the next character without consuming it, empty at the end of the file
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more(self.chunk_size):
+                return ""
+
+    def _expect(self, expected: str):
+        found = self._peek()
+        if found != expected:
+            raise json.JSONDecodeError(f"Expected {expected!r} but found {found!r}", self._buffer, self._pos)
+        self._pos += 1
+
+    def _decode_value(self) -> typing.Any:
+        """
+        Decodes the next value. When the buffer ends within the value, more is read and decoding starts over,
+        reading twice as much each time so that large values are not decoded over and over.
+        """
+        self._peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if self._eof or (end < len(self._buffer) and self._buffer[end] not in _NUMBER_CHARS):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._read_more(read_size)
+            read_size *= 2
+
+    def _iter_array(self) -> typing.Iterator[typing.Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._decode_value()
+            if self._peek() == ",":
+                self._pos += 1
+            else:
+                self._expect("]")
+                return
+
+    def _close_open_array(self):
+        if self._open_array is not None:
+            for _ in self._open_array:
+                pass
+            self._open_array = None
+
+    def iter_object(self, stream_keys: typing.Iterable[str] = ()) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+        """
+        Yields the keys of the top-level object with their value, in file order.
+        Values of stream_keys are iterators over the array elements instead. They must be used before moving on
+        to the next key, whatever is left of them is skipped.
+        """
+        stream_keys = set(stream_keys)
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._decode_value()
+            self._expect(":")
+            if key in stream_keys and self._peek() == "[":
+                self._open_array = self._iter_array()
+                yield key, self._open_array
+                self._close_open_array()
+            else:
+                yield key, self._decode_value()
+            if self._peek() == ",":
+                self._pos += 1
+            else:
+                self._expect("}")
+                return
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> "JSONStreamReader":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iter_json_array_of_key(file_path: str, key: str) -> typing.Iterator[typing.Any]:
+    """
+    Yields the elements of the array held by key within the top-level object of the file
+    """
+    with JSONStreamReader(file_path) as reader:
+        for found_key, value in reader.iter_object(stream_keys=[key]):
+            if found_key == key:
+                yield from value
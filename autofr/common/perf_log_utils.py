@@ -0,0 +1,199 @@
+import functools
+import heapq
+import json
+import logging
+import os
+import pickle
+import tempfile
+import typing
+
+from autofr.common.compression_utils import open_maybe_compressed
+from autofr.common.utils import should_skip_perf_url, get_variations_of_domains
+
+try:
+    # optional, decodes perf log lines several times faster than json
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+REQUEST_WILL_BE_SENT = "Network.requestWillBeSent"
+# the event is json within the json of the line, so its method name is always followed by an escaped quote.
+# Lines without it are skipped without decoding them, including Network.requestWillBeSentExtraInfo
+_REQUEST_WILL_BE_SENT_MARKER = REQUEST_WILL_BE_SENT + '\\"'
+
+# max number of parsed perf logs remembered, a site has one perf log per init state visit
+PARSED_PERF_LOG_CACHE_SIZE = 64
+# max number of entries that iter_initiator_chain_log_entries keeps in memory before spilling them to disk
+PERF_LOG_SORT_CHUNK_SIZE = 50000
+
+
+def json_loads(value: typing.Union[str, bytes]) -> typing.Any:
+    """
+    json.loads, using orjson when it is installed. Falls back to json for what orjson rejects (e.g. NaN)
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(value)
+
+
+def iter_request_will_be_sent_params(lines: typing.Iterable[str],
+                                     loads: typing.Callable = json_loads) -> typing.Iterator[dict]:
+    """
+    Yields the params of the Network.requestWillBeSent events of the perf log lines, in file order.
+    Only lines that can hold such an event are decoded.
+    """
+    for line in lines:
+        if _REQUEST_WILL_BE_SENT_MARKER not in line:
+            continue
+        try:
+            line_json = loads(line.strip())
+            message_json = loads(line_json["message"])
+            if REQUEST_WILL_BE_SENT != message_json["message"]["method"]:
+                continue
+            yield message_json["message"]["params"]
+        except Exception as e:
+            logger.warning("Could not parse json of perf log %s", str(e))
+
+
+def _is_initiator_chain_log_entry(params: dict) -> bool:
+    try:
+        return not should_skip_perf_url(params["documentURL"])
+    except Exception as e:
+        logger.warning("Could not parse json of perf log %s", str(e))
+        return False
+
+
+def _write_sorted_run(run: list, spill_dir: str = None) -> typing.IO:
+    run.sort()
+    run_file = tempfile.TemporaryFile(dir=spill_dir)
+    for item in run:
+        pickle.dump(item, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+    run_file.seek(0)
+    return run_file
+
+
+def _iter_sorted_run(run_file: typing.IO) -> typing.Iterator[tuple]:
+    while True:
+        try:
+            yield pickle.load(run_file)
+        except EOFError:
+            return
+
+
+def sort_by_timestamp(entries: typing.Iterable[dict], chunk_size: int = PERF_LOG_SORT_CHUNK_SIZE,
+                      spill_dir: str = None) -> typing.Iterator[dict]:
+    """
+    Yields the entries sorted by their timestamp, entries with the same timestamp in the order they came in.
+    At most chunk_size entries are kept in memory: every chunk_size entries are sorted and written to a
+    temporary file in spill_dir, then the files are merged.
+    """
+    run_files = []
+    run = []
+    try:
+        # the sequence number keeps the sort stable and means entries themselves are never compared
+        for seq, entry in enumerate(entries):
+            run.append((entry["timestamp"], seq, entry))
+            if len(run) >= chunk_size:
+                run_files.append(_write_sorted_run(run, spill_dir=spill_dir))
+                run = []
+        run.sort()
+        runs = [_iter_sorted_run(f) for f in run_files] + [iter(run)]
+        for _, _, entry in heapq.merge(*runs):
+            yield entry
+    finally:
+        for f in run_files:
+            f.close()
+
+
+def iter_initiator_chain_log_entries_from_lines(lines: typing.Iterable[str],
+                                                chunk_size: int = PERF_LOG_SORT_CHUNK_SIZE) -> typing.Iterator[dict]:
+    """
+    Same entries as ParsedPerfLog.log_entries, streamed with at most chunk_size of them in memory
+    """
+    yield from sort_by_timestamp(filter(_is_initiator_chain_log_entry, iter_request_will_be_sent_params(lines)),
+                                 chunk_size=chunk_size)
+
+
+def iter_initiator_chain_log_entries(file_path: str,
+                                     chunk_size: int = PERF_LOG_SORT_CHUNK_SIZE) -> typing.Iterator[dict]:
+    """
+    Streams the initiator chain entries of the perf log file, see iter_initiator_chain_log_entries_from_lines
+    """
+    with open_maybe_compressed(file_path) as f:
+        yield from iter_initiator_chain_log_entries_from_lines(f, chunk_size=chunk_size)
+
+
+class ParsedPerfLog:
+    """
+    The Network.requestWillBeSent events of a Chrome perf log (see selenium_utils.output_performance_logs),
+    parsed in one pass. Use get_parsed_perf_log so that everything reading the same file shares one.
+    """
+
+    def __init__(self, lines: typing.Iterable[str], file_path: str = None):
+        self.file_path = file_path
+        # params of the events whose documentURL is not skipped, sorted by timestamp (the initiator chain entries)
+        self.log_entries: list = []
+        # urls of the events that are not skipped, in file order
+        self.webrequests: typing.List[str] = []
+        self._url_variations: typing.Optional[typing.Tuple[set, set, set]] = None
+        self._parse(lines)
+
+    def _parse(self, lines: typing.Iterable[str]):
+        for params in iter_request_will_be_sent_params(lines):
+            try:
+                url = params["request"]["url"]
+                if not should_skip_perf_url(url):
+                    self.webrequests.append(url)
+            except (TypeError, KeyError) as e:
+                logger.warning(f"Could not get url from perf log event: {params}, {repr(e)} {e}")
+
+            if _is_initiator_chain_log_entry(params):
+                self.log_entries.append(params)
+
+        # all entries are kept anyway, so they are sorted in memory
+        self.log_entries.sort(key=lambda x: x["timestamp"])
+
+    def get_url_variations(self) -> typing.Tuple[set, set, set]:
+        """
+        eSLDs, FQDNs and FQDN+paths of the webrequests
+        """
+        if self._url_variations is None:
+            slds, fqdns, fqdn_paths = set(), set(), set()
+            for url in set(self.webrequests):
+                sld, fqdn, fqdn_path, _ = get_variations_of_domains(url)
+                if sld:
+                    slds.add(sld)
+                if fqdn:
+                    fqdns.add(fqdn)
+                if fqdn_path:
+                    fqdn_paths.add(fqdn_path)
+            self._url_variations = slds, fqdns, fqdn_paths
+        return self._url_variations
+
+
+@functools.lru_cache(maxsize=PARSED_PERF_LOG_CACHE_SIZE)
+def _read_parsed_perf_log(file_path: str, mtime_ns: int, size: int) -> ParsedPerfLog:
+    """
+    mtime_ns and size are only part of the cache key, so a perf log that changed is parsed again
+    """
+    with open_maybe_compressed(file_path) as f:
+        return ParsedPerfLog(f, file_path=file_path)
+
+
+def get_parsed_perf_log(file_path: str) -> ParsedPerfLog:
+    """
+    Parses the perf log (which may be gzip compressed) once, later calls share it as long as the file is unchanged.
+    The returned object is shared, so do not modify it.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    return _read_parsed_perf_log(file_path, stat.st_mtime_ns, stat.st_size)
+
+
+def get_parsed_perf_log_cache_info() -> dict:
+    return _read_parsed_perf_log.cache_info()._asdict()
@@ -17,7 +17,9 @@ from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
+from autofr.common.compression_utils import open_maybe_compressed
 from autofr.common.exceptions import AutoFRException
+from autofr.common.perf_log_utils import get_parsed_perf_log
 from autofr.common.utils import should_skip_perf_url
 
 logger = logging.getLogger(__name__)
@@ -857,8 +859,9 @@ def output_performance_logs(driver,
     while not done:
         perf_logs = driver.get_log("performance")
         count = 0
-        with open(output_network_file_path, "a+") as network_file:
-            with open(output_page_lifecycle_path, "a+") as page_file:
+        # compressed when the paths end with .gz, see compression_utils.get_output_file_path
+        with open_maybe_compressed(output_network_file_path, "a") as network_file:
+            with open_maybe_compressed(output_page_lifecycle_path, "a") as page_file:
                 for event in perf_logs:
                     if "Network.requestWillBeSent" in event["message"]:
                         network_file.write(json.dumps(event) + "\n")
@@ -902,20 +905,10 @@ def output_performance_logs(driver,
 
 def get_webrequests_from_perf_json(file_path: str) -> list:
     """
-    Read from file_path where each line is a perf log event in JSON format
+    Read from file_path where each line is a perf log event in JSON format.
+    The perf log is parsed once and shared with the other readers, see perf_log_utils.get_parsed_perf_log
     """
-    webrequests = []
-    with open(file_path) as webrequests_file:
-        for line in webrequests_file:
-            try:
-                line_json = json.loads(line.strip())
-                message_json = json.loads(line_json["message"])
-                url = get_webrequests_from_perf_event_json(message_json)
-                if url:
-                    webrequests.append(url)
-            except json.JSONDecodeError as e:
-                logger.warning(f"Could not parse json of perf log {repr(e)} {e}")
-    return webrequests
+    return list(get_parsed_perf_log(file_path).webrequests)
 
 
 def get_webrequests_from_perf_event_json(event: typing.Any) -> typing.Optional[str]:
@@ -7,10 +7,11 @@ import typing
 import urllib.request
 import uuid
 import numpy as np
-import tldextract
 from json import JSONDecodeError
 from typing import Tuple
-from urllib.parse import urlparse
+
+from autofr.common import domain_variations
+from autofr.common.compression_utils import glob_maybe_compressed, open_maybe_compressed
 
 
 opener = urllib.request.build_opener()
@@ -33,7 +34,7 @@ TOPFRAME = "topframe_"
 # webrequests = get_webrequests_from_raw_json(path_file, 200)
 def get_webrequests_from_raw_json(file_path, event_status=200):
     webrequests = []
-    with open(file_path) as f:
+    with open_maybe_compressed(file_path) as f:
         try:
             file_data = json.load(f)
             requests = file_data[JSON_WEBREQUEST_KEY]
@@ -56,7 +57,8 @@ def get_webrequests_from_raw_json(file_path, event_status=200):
 
 
 def extract_tld(url: str):
-    return tldextract.extract(url)
+    # memoized and offline, see domain_variations
+    return domain_variations.extract_tld(url)
 
 
 def get_second_level_domain_from_tld(url_tld) -> str:
@@ -119,12 +121,17 @@ def clean_url_for_file(url: str, max_length: int = 50) -> str:
 
 def get_file_from_path_by_key(path: str, file_name_regex: str,
                               by_key: typing.Callable = os.path.getmtime,
-                              ignore: list = None) -> typing.Optional[str]:
+                              ignore: list = None,
+                              include_compressed: bool = False) -> typing.Optional[str]:
     """
     From a list of files from path, get the file that has max based on the by_key criteria
     Default: most recent file by time
+    include_compressed: also consider the .gz variants of the matching files
     """
-    list_of_files = glob.glob(path + os.sep + file_name_regex)
+    if include_compressed:
+        list_of_files = glob_maybe_compressed(path + os.sep + file_name_regex)
+    else:
+        list_of_files = glob.glob(path + os.sep + file_name_regex)
     latest_file = None
     if len(list_of_files) > 0:
         # ignore some files based on names
@@ -137,13 +144,14 @@ def get_file_from_path_by_key(path: str, file_name_regex: str,
     return latest_file
 
 
-def get_largest_file_from_path(path: str, file_name_regex: str, ignore: list = None) -> str:
+def get_largest_file_from_path(path: str, file_name_regex: str, ignore: list = None,
+                               include_compressed: bool = False) -> str:
     """
     From a list of files from path, get the file is largest
     Default: most recent file by time
     """
     return get_file_from_path_by_key(path, file_name_regex,
-                                     by_key=os.path.getsize, ignore=ignore)
+                                     by_key=os.path.getsize, ignore=ignore, include_compressed=include_compressed)
 
 
 def chunk_list(some_list: list, n: int = 4) -> list:
@@ -189,24 +197,9 @@ def get_variations_of_domains(domain: str) -> Tuple[
     typing.Optional[str], str, typing.Optional[str], typing.Optional[str]]:
     """
         Given a domain, return the eSLD, FQDN, FQDN+Path, Path with no protocol
+        Results are memoized, see domain_variations.get_domain_variations_cache_info
     """
-    sld = get_second_level_domain_by_url(domain)
-    fqdn = get_domain_only_from_url(domain, remove_www=False)
-
-    path = urlparse(domain).path
-    if path == "/" or path == "":
-        # if path is not there, then we don't need to consider it fqdn_and_path
-        fqdn_and_path = None
-        path = None
-    else:
-        fqdn_and_path = fqdn + path
-
-    if sld.endswith("."):
-        sld = None
-
-    # logger.debug("sld %s, fqdn %s, fqdn_and_path %s, path %s", sld, fqdn, str(fqdn_and_path), str(path))
-
-    return sld, fqdn, fqdn_and_path, path
+    return domain_variations.get_variations_of_domains(domain)
 
 
 def is_request_js_extension(req: str) -> Tuple[bool, bool]:
@@ -11,9 +11,11 @@ from selenium.common.exceptions import WebDriverException
 
 from autofr.common.action_space_utils import TYPE_ESLD
 from autofr.common.docker_utils import InitSiteFeedbackDockerResponse, SiteFeedbackFilterRulesDockerResponse
+from autofr.common.domain_variations import get_domain_variations_cache_info
 from autofr.common.exceptions import InvalidSiteFeedbackException, BanditPullTimeout, AutoFRException, \
     BanditPullInvalid
 from autofr.common.filter_rules_utils import RULES_DELIMITER, get_rules_from_filter_list
+from autofr.common.perf_log_utils import get_parsed_perf_log_cache_info
 from autofr.rl.action_space import TYPE, SLEEPING_ARM, UNKNOWN_ARM
 from autofr.rl.agent import DomainHierarchyAgent
 from autofr.rl.bandits import AutoFRMultiArmedBandit
@@ -150,6 +152,15 @@ class AutoFREnvironmentBase(Environment):
         if self.save_output:
             self.main_agent.save()
         self.print_filter_rules_created()
+        self.log_cache_info()
+
+    def log_cache_info(self):
+        """
+        Hits, misses and sizes of the memoized functions, which are shared by all experiments of the process
+        """
+        for name, cache_info in get_domain_variations_cache_info().items():
+            logger.info(f"{self.url} - cache of {name}: {cache_info}")
+        logger.info(f"{self.url} - cache of parsed perf logs: {get_parsed_perf_log_cache_info()}")
 
 
 class AutoFREnvironment(AutoFREnvironmentBase):
@@ -10,6 +10,7 @@ from selenium.common.exceptions import NoSuchElementException, StaleElementRefer
 from selenium.webdriver.common.by import By
 
 from autofr.common.adgraph_version import get_adgraph_version
+from autofr.common.compression_utils import COMPRESS_OUTPUTS, compress_files_in_dir
 from autofr.common.exceptions import MissingRawAdgraphException, SiteSnapshotInvalid
 from autofr.common.selenium_utils import get_node_stack_traces_of_annotated_iframe_ads, \
     get_node_stack_traces_of_annotated_images, get_node_stack_traces_of_annotated_textnodes, switch_to_defaultcontent, \
@@ -56,6 +57,9 @@ class AdgraphBrowserWithAdHighlighter(BrowserWithAdHighlighter):
             shutil.copytree(adgraph_default_dir, self.adgraph_dir,
                             ignore_dangling_symlinks=True)
             clean_adgraph_rendering_dir()
+            if COMPRESS_OUTPUTS:
+                # raw adgraphs are only written by the browser, so they are compressed once they are saved
+                compress_files_in_dir(self.adgraph_dir, "log*.json")
         else:
             logger.warning(f"Missing {adgraph_default_dir}")
 
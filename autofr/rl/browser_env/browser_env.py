@@ -1,4 +1,3 @@
-import glob
 import logging
 import os
 import random
@@ -13,6 +12,7 @@ from selenium.webdriver import ActionChains
 from selenium.webdriver.common.by import By
 
 from autofr.common.adgraph_version import get_adgraph_version
+from autofr.common.compression_utils import get_output_file_path, glob_maybe_compressed
 from autofr.common.filter_rules_utils import create_whitelist_rule_simple, output_filter_list, \
     get_filter_records_by_rule
 from autofr.common.selenium_utils import create_driver_with_adhighlilghter, BLANK_CHROME_PAGE, \
@@ -134,10 +134,10 @@ class BrowserWithAdHighlighterBase:
         time.sleep(2)
         # clean up profile
         try:
-            for file_tmp in glob.glob(self.downloads_path + os.sep + "about_blank*.json"):
+            for file_tmp in glob_maybe_compressed(self.downloads_path + os.sep + "about_blank*.json"):
                 os.remove(file_tmp)
             if self.tmp_domain:
-                for file_tmp in glob.glob(self.downloads_path + os.sep + "*" + self.tmp_domain + "*.json"):
+                for file_tmp in glob_maybe_compressed(self.downloads_path + os.sep + "*" + self.tmp_domain + "*.json"):
                     os.remove(file_tmp)
             if self.clean_up_profile_path:
                 # save the logs
@@ -301,8 +301,9 @@ class BrowserWithAdHighlighterBase:
             #logger.debug(f"Enabled Page.setLifecycleEventsEnabled")
 
         file_name = self.main_domain + str(iteration) + suffix
-        latest_webreq_file_path = self.downloads_path + os.sep + file_name + WEBREQUESTS_DATA_FILE_SUFFIX
-        latest_page_file_path = self.downloads_path + os.sep + "page_" + file_name + ".json"
+        latest_webreq_file_path = get_output_file_path(self.downloads_path + os.sep + file_name
+                                                       + WEBREQUESTS_DATA_FILE_SUFFIX)
+        latest_page_file_path = get_output_file_path(self.downloads_path + os.sep + "page_" + file_name + ".json")
 
         webrequests = output_performance_logs(self.driver,
                                                 latest_webreq_file_path,
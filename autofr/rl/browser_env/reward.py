@@ -1,6 +1,10 @@
+import collections
+import json
 import logging
 import os
 import pickle
+import sqlite3
+import threading
 import typing
 
 import numpy as np
@@ -10,6 +14,9 @@ logger = logging.getLogger(__name__)
 
 NOISE_THRESHOLD = 0.05
 SITE_FEEDBACK_CACHE_CSV = "site_feedback_cache.pickle"
+SITE_FEEDBACK_CACHE_SQLITE = "site_feedback_cache.sqlite"
+# max number of decoded entries that SQLiteSiteFeedbackCache keeps in memory
+SITE_FEEDBACK_CACHE_MEMORY_ENTRIES = 10000
 
 
 class SiteFeedback:
@@ -57,6 +64,209 @@ class SiteFeedbackCache(dict):
         return SiteFeedbackCache()
 
 
+class SiteFeedbackCacheEntry:
+    """
+    Compact outcome of a controlled pull: the counters before falling back to the init site feedback,
+    whether any ad, image or textnode was blocked, and the urls blocked by each rule.
+    """
+
+    def __init__(self,
+                 ad_counter: int = 0,
+                 image_counter: int = 0,
+                 textnode_counter: int = 0,
+                 ads_blocked: bool = False,
+                 images_blocked: bool = False,
+                 textnodes_blocked: bool = False,
+                 rule_to_urls: typing.Dict[str, typing.List[str]] = None):
+        self.ad_counter = ad_counter
+        self.image_counter = image_counter
+        self.textnode_counter = textnode_counter
+        self.ads_blocked = ads_blocked
+        self.images_blocked = images_blocked
+        self.textnodes_blocked = textnodes_blocked
+        self.rule_to_urls = rule_to_urls or dict()
+
+    def get_site_feedback(self, init_site_feedback: SiteFeedback = None) -> SiteFeedback:
+        """
+        If init_site_feedback is given, counters of categories where nothing was blocked are set back to it
+        """
+        site_feedback = SiteFeedback(ad_counter=self.ad_counter,
+                                     image_counter=self.image_counter,
+                                     textnode_counter=self.textnode_counter)
+        if init_site_feedback:
+            if not self.ads_blocked:
+                site_feedback.ad_counter = init_site_feedback.ad_counter
+            if not self.images_blocked:
+                site_feedback.image_counter = init_site_feedback.image_counter
+            if not self.textnodes_blocked:
+                site_feedback.textnode_counter = init_site_feedback.textnode_counter
+        return site_feedback
+
+    def to_json(self) -> str:
+        return json.dumps([self.ad_counter, self.image_counter, self.textnode_counter,
+                           int(self.ads_blocked), int(self.images_blocked), int(self.textnodes_blocked),
+                           self.rule_to_urls], separators=(",", ":"))
+
+    @staticmethod
+    def from_json(value: str) -> "SiteFeedbackCacheEntry":
+        ad_counter, image_counter, textnode_counter, \
+            ads_blocked, images_blocked, textnodes_blocked, rule_to_urls = json.loads(value)
+        return SiteFeedbackCacheEntry(ad_counter, image_counter, textnode_counter,
+                                      bool(ads_blocked), bool(images_blocked), bool(textnodes_blocked),
+                                      rule_to_urls)
+
+
+class SQLiteSiteFeedbackCache:
+    """
+    SiteFeedbackCache that is stored in a sqlite file. Entries are written as soon as they are added,
+    so runs can share the file and nothing is lost if a run stops early.
+    Only the most recently used entries are kept in memory.
+    """
+
+    def __init__(self, cache_file: str, max_memory_entries: int = SITE_FEEDBACK_CACHE_MEMORY_ENTRIES):
+        self.cache_file = cache_file
+        self.max_memory_entries = max_memory_entries
+        self._memory_entries: typing.OrderedDict[str, SiteFeedbackCacheEntry] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # pulls can happen in other threads, the lock keeps the connection to one thread at a time
+        self._connection = sqlite3.connect(cache_file, timeout=60, check_same_thread=False, isolation_level=None)
+        # WAL lets readers of other runs go on while we write
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS site_feedback_cache "
+                                 "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @staticmethod
+    def get_cache_file(directory: str) -> str:
+        return directory + os.sep + SITE_FEEDBACK_CACHE_SQLITE
+
+    def get(self, key: str, default=None) -> typing.Optional[SiteFeedbackCacheEntry]:
+        with self._lock:
+            if key in self._memory_entries:
+                self._memory_entries.move_to_end(key)
+                return self._memory_entries[key]
+            row = self._connection.execute("SELECT value FROM site_feedback_cache WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is None:
+                return default
+            entry = SiteFeedbackCacheEntry.from_json(row[0])
+            self._remember(key, entry)
+            return entry
+
+    def __getitem__(self, key: str) -> SiteFeedbackCacheEntry:
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __setitem__(self, key: str, entry: SiteFeedbackCacheEntry):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO site_feedback_cache (key, value) VALUES (?, ?)",
+                                     (key, entry.to_json()))
+            self._remember(key, entry)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM site_feedback_cache").fetchone()[0]
+
+    def _remember(self, key: str, entry: SiteFeedbackCacheEntry):
+        self._memory_entries[key] = entry
+        self._memory_entries.move_to_end(key)
+        while len(self._memory_entries) > self.max_memory_entries:
+            self._memory_entries.popitem(last=False)
+
+    def update_many(self, entries: typing.Dict[str, SiteFeedbackCacheEntry]):
+        """
+        Adds many entries within one transaction
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN")
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO site_feedback_cache (key, value) VALUES (?, ?)",
+                    ((key, entry.to_json()) for key, entry in entries.items()))
+
+    def update_from_cache_file(self, cache_file: str) -> int:
+        """
+        Adds the entries of another sqlite cache file, which is only read. Returns the number of entries added
+        """
+        with open(cache_file, "rb") as f:
+            is_wal_mode = f.read(20)[18:19] == b"\x02"
+        # reading a cache file in WAL mode creates its -wal and -shm files, unless it is opened as immutable.
+        # That is only safe when there is no -wal file, e.g. the cache was closed
+        if is_wal_mode and not os.path.isfile(cache_file + "-wal"):
+            rows = self._read_rows(f"file:{cache_file}?immutable=1")
+        else:
+            try:
+                rows = self._read_rows(f"file:{cache_file}?mode=ro")
+            except sqlite3.OperationalError:
+                # the -shm file cannot be created within a read-only directory
+                rows = self._read_rows(f"file:{cache_file}?immutable=1")
+
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN")
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO site_feedback_cache (key, value) VALUES (?, ?)", rows)
+        return len(rows)
+
+    @staticmethod
+    def _read_rows(uri: str) -> list:
+        connection = sqlite3.connect(uri, uri=True)
+        try:
+            return connection.execute("SELECT key, value FROM site_feedback_cache").fetchall()
+        finally:
+            connection.close()
+
+    def checkpoint(self):
+        """
+        Moves what is in the WAL into the cache file, so the file alone holds every entry
+        """
+        with self._lock:
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def save(self, output_directory: str = None):
+        """
+        Entries are already written when added, so this only checkpoints the cache file.
+        If output_directory is given and the cache file is elsewhere, a copy of it is written there.
+        """
+        self.checkpoint()
+        if output_directory is None:
+            return
+        output_file = SQLiteSiteFeedbackCache.get_cache_file(output_directory)
+        if os.path.abspath(output_file) == os.path.abspath(self.cache_file):
+            return
+        output_connection = sqlite3.connect(output_file)
+        try:
+            with self._lock:
+                self._connection.backup(output_connection)
+            # the copy is not shared, so it does not need the WAL and can be read from read-only directories
+            output_connection.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            output_connection.close()
+        logger.info(f"Saved a copy of the site feedback cache {self.cache_file} to {output_file}")
+
+    def close(self):
+        with self._lock:
+            if self._connection is None:
+                return
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def read_cache(directory: str, max_memory_entries: int = SITE_FEEDBACK_CACHE_MEMORY_ENTRIES) \
+            -> "SQLiteSiteFeedbackCache":
+        """
+        Opens (or creates) the cache file within the directory
+        """
+        return SQLiteSiteFeedbackCache(SQLiteSiteFeedbackCache.get_cache_file(directory),
+                                       max_memory_entries=max_memory_entries)
+
+
 class SiteFeedbackRange:
 
     def __init__(self):
@@ -1,9 +1,9 @@
-import glob
 import os
 from subprocess import CompletedProcess
 
 from selenium.common.exceptions import WebDriverException
 
+from autofr.common.compression_utils import glob_maybe_compressed
 from autofr.common.docker_utils import DockerResponseBase
 from autofr.common.filter_rules_utils import get_rules_from_filter_list
 from autofr.common.utils import clean_url_for_file
@@ -40,7 +40,7 @@ class AdgraphBrowserEnvRunner(InitSiteFeedbackBrowserEnvRunner):
         # read in the site snapshots
         snapshot_files = []
         input_dir = docker_response.main_path + os.sep + ADGRAPH_NETWORKX
-        snapshot_files = glob.glob(input_dir + os.sep + "*.graphml")
+        snapshot_files = glob_maybe_compressed(input_dir + os.sep + "*.graphml")
         #logger.debug(f"found snapshotfiles in {input_dir}: {len(snapshot_files)}")
         docker_response.snapshot_files = snapshot_files
         docker_response.snapshot_files.sort()
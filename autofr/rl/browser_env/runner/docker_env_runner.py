@@ -8,6 +8,7 @@ from subprocess import CompletedProcess
 import pandas as pd
 
 from autofr.common.adgraph_version import get_adgraph_version
+from autofr.common.compression_utils import glob_maybe_compressed
 from autofr.common.docker_utils import DEFAULT_DOCKER_NAME, DOCKER_OUTPUT_PATH, HOST_MACHINE_OUTPUT_PATH, \
     InitSiteFeedbackDockerResponse, logger, run_browser_docker_process, ONE_ITERATION_DOCKER_NAME, \
     DockerResponseBase, SiteFeedbackFilterRulesDockerResponse
@@ -211,7 +212,7 @@ class InitSiteFeedbackDockerEnvRunner(DockerEnvRunner):
             dissimilar_hashes_files = glob.glob(dissimilar_hash_file_path + "*.csv")
 
             # get all requests that we find
-            perf_log_files = glob.glob(json_lists_path + os.sep + "*--cvwebrequests.json")
+            perf_log_files = glob_maybe_compressed(json_lists_path + os.sep + "*--cvwebrequests.json")
             outgoing_requests = []
             for f_path in perf_log_files:
                 out_tmp = get_webrequests_from_perf_json(f_path)
@@ -385,7 +386,7 @@ class AdgraphDockerEnvRunner (InitSiteFeedbackDockerEnvRunner):
         # read in the site snapshots
         snapshot_files = []
         input_dir = docker_response.main_path + os.sep + ADGRAPH_NETWORKX
-        snapshot_files = glob.glob(input_dir + os.sep + "*.graphml")
+        snapshot_files = glob_maybe_compressed(input_dir + os.sep + "*.graphml")
         #logger.debug(f"found snapshotfiles in {input_dir}: {len(snapshot_files)}")
         docker_response.snapshot_files = snapshot_files
         docker_response.snapshot_files.sort()
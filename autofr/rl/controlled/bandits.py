@@ -1,9 +1,11 @@
 import collections
 import concurrent
-import glob
+import concurrent.futures
 import logging
+import multiprocessing
 import os
 import random
+import sqlite3
 import time
 import typing
 from typing import Tuple, List
@@ -12,24 +14,82 @@ import networkx as nx
 from adblockparser import AdblockRule
 
 from autofr.common.action_space_utils import ROOT_NODE_ID
-from autofr.common.adblockparser_utils import AutoFRAdblockRules
+from autofr.common.adblockparser_utils import AutoFRAdblockRules, AutoFRDomainAnchorRules, get_adblock_rules
+from autofr.common.compression_utils import glob_maybe_compressed
 from autofr.common.docker_utils import HOST_MACHINE_OUTPUT_PATH, InitSiteFeedbackDockerResponse, \
     SiteFeedbackFilterRulesDockerResponse
-from autofr.common.exceptions import AutoFRException
-from autofr.common.filter_rules_utils import FilterRuleBlockRecord, create_rule_simple
+from autofr.common.exceptions import AutoFRException, MissingSnapshotException
+from autofr.common.filter_rules_utils import FilterRuleBlockRecord, create_rule_simple, get_rules_hash
 from autofr.rl.action_space import EDGE_TYPE, TYPE, ActionSpace
 from autofr.rl.bandits import AutoFRMultiArmedBandit
-from autofr.rl.browser_env.reward import SiteFeedback, SiteFeedbackCache
+from autofr.rl.browser_env.reward import SiteFeedbackCache, SiteFeedbackCacheEntry, \
+    SQLiteSiteFeedbackCache, SITE_FEEDBACK_CACHE_CSV
 from autofr.rl.browser_env.runner.adgraph_env_runner import AdgraphBrowserEnvRunner, \
     AdgraphBrowserFromDirEnvRunner
 from autofr.rl.browser_env.runner.docker_env_runner import AdgraphDockerEnvRunner
+from autofr.rl.controlled.compiled_snapshot import RuleMatches, SnapshotPullResult
 from autofr.rl.controlled.site_snapshot import ADGRAPH_NETWORKX, NODE_TYPE, INFO, REQUESTED_URL, FLG_IMAGE, \
-    FLG_TEXTNODE, FLG_AD, has_non_dom_predecessor_edges, SNAPSHOT_EDGE__DOM, SiteSnapshot, is_flg_ad_node, \
+    FLG_TEXTNODE, FLG_AD, SNAPSHOT_EDGE__DOM, SiteSnapshot, is_flg_ad_node, \
     is_flg_image_node, is_flg_textnode, \
-    is_node_data_annotated
+    is_node_data_annotated, convert_raw_adgraph_files
+from autofr.rl.controlled.snapshot_corpus import CorpusSiteSnapshot, get_snapshot_corpus
+from autofr.rl.controlled.snapshot_manifest import read_snapshot_manifest
 
 logger = logging.getLogger(__name__)
 
+# how DomainHierarchyMABControlled.pull_each_arm_parallel runs the pulls
+PULL_EXECUTOR_THREAD = "thread"
+PULL_EXECUTOR_PROCESS = "process"
+PULL_EXECUTORS = [PULL_EXECUTOR_THREAD, PULL_EXECUTOR_PROCESS]
+
+# site snapshots inherited by forked pull workers, see DomainHierarchyMABControlled._pull_each_arm_in_processes
+_forked_site_snapshots: typing.List[typing.Tuple[SiteSnapshot, str]] = []
+
+
+def _simulate_pull_in_forked_process(site_snapshot_index: int, filter_rules: list) \
+        -> typing.Tuple[typing.Dict[str, RuleMatches], SnapshotPullResult]:
+    """
+    Runs within a forked worker, where the site snapshots (and their compiled arrays) are shared with the parent.
+    Returns the matches of each rule as well, so that the parent can memoize them.
+    """
+    site_snapshot, _ = _forked_site_snapshots[site_snapshot_index]
+    compiled_snapshot = site_snapshot.get_compiled_snapshot()
+    pull_result = compiled_snapshot.simulate_pull_for_rules(filter_rules)
+    return compiled_snapshot.get_rule_matches(filter_rules), pull_result
+
+
+def _load_site_snapshot(site_snapshot_klass: typing.Callable, url: str, base_name: str,
+                        infused_snapshot_dir: typing.Optional[str],
+                        snapshot_nx_file_path: str) -> typing.Tuple[typing.Optional[SiteSnapshot], float]:
+    """
+    Reads in one site snapshot, including its callstack infusion. Can run within a worker process.
+    Returns the site snapshot (None if it has no ads or page content) and how long it took to load
+    """
+    before = time.time()
+    site_snapshot: SiteSnapshot = site_snapshot_klass(url,
+                                                      base_name=base_name,
+                                                      snapshot_nx_file_path=snapshot_nx_file_path,
+                                                      infused_snapshot_dir=infused_snapshot_dir)
+    if not (site_snapshot.has_ads() and site_snapshot.has_page_content()):
+        site_snapshot = None
+    return site_snapshot, time.time() - before
+
+
+def _load_corpus_site_snapshot(corpus_file: str, site_name: str, url: str, base_name: str,
+                               snapshot_path: str) -> typing.Tuple[typing.Optional[SiteSnapshot], float]:
+    """
+    Same as _load_site_snapshot, for a site snapshot of a SnapshotCorpus
+    """
+    before = time.time()
+    site_snapshot: SiteSnapshot = CorpusSiteSnapshot(url,
+                                                     get_snapshot_corpus(corpus_file),
+                                                     site_name,
+                                                     snapshot_path,
+                                                     base_name=base_name)
+    if not (site_snapshot.has_ads() and site_snapshot.has_page_content()):
+        site_snapshot = None
+    return site_snapshot, time.time() - before
+
 
 class AutoFRMultiArmedBanditGetSnapshots(AutoFRMultiArmedBandit):
 
@@ -41,7 +101,22 @@ class AutoFRMultiArmedBanditGetSnapshots(AutoFRMultiArmedBandit):
                  adgraph_files: list = None,
                  site_snapshot_dir_name: str = ADGRAPH_NETWORKX,
                  site_snapshot_klass: typing.Callable = SiteSnapshot,
+                 snapshot_load_workers: int = 1,
+                 snapshot_corpus_file: str = None,
+                 corpus_site_name: str = None,
+                 dedupe_site_snapshots: bool = False,
+                 infused_snapshot_dir: str = None,
                  **kwargs):
+        """
+        snapshot_load_workers: number of processes that read in site snapshots (or convert raw adgraphs into them),
+            1 reads them within this process
+        snapshot_corpus_file: SnapshotCorpus to read the site snapshots of corpus_site_name from,
+            instead of the snapshot directory
+        dedupe_site_snapshots: keep one site snapshot per content hash. The others are only kept by name,
+            as the weight of the one they collapse into, see get_weighted_site_snapshots
+        infused_snapshot_dir: where the callstack infused versions of the site snapshot files are kept,
+            e.g. to share them between runs. Defaults to the snapshot directory of the output.
+        """
         super(AutoFRMultiArmedBanditGetSnapshots, self).__init__(*args, **kwargs)
         self.ad_highlighter_ext_path = ad_highlighter_ext_path
         self.browser_path = browser_path
@@ -50,6 +125,15 @@ class AutoFRMultiArmedBanditGetSnapshots(AutoFRMultiArmedBandit):
         self.adgraph_files = adgraph_files or []
         self.site_snapshots: typing.List[typing.Tuple[SiteSnapshot, str]] = []
         self.site_snapshot_klass = site_snapshot_klass
+        self.snapshot_load_workers = snapshot_load_workers
+        self.snapshot_corpus_file = snapshot_corpus_file
+        self.corpus_site_name = corpus_site_name
+        self.dedupe_site_snapshots = dedupe_site_snapshots
+        self.infused_snapshot_dir = infused_snapshot_dir
+        # name of a site snapshot to the names of the duplicates that collapsed into it
+        self.site_snapshot_duplicates: typing.Dict[str, typing.List[str]] = collections.defaultdict(list)
+        # content hash to the name of the site snapshot that is kept for it
+        self._site_snapshot_by_content_hash: typing.Dict[str, str] = dict()
 
         # dir name only that holds the processed snapshots already
         self.site_snapshot_dir_name = site_snapshot_dir_name
@@ -70,15 +154,139 @@ class AutoFRMultiArmedBanditGetSnapshots(AutoFRMultiArmedBandit):
         """
         Read in site snapshots that have already been processed from JSON into graphml files
         """
+        if self.snapshot_corpus_file:
+            self._read_corpus_site_snapshots(url)
+            return
         processed_nx_dir = self.get_base_site_snapshots_dir()
         if os.path.isdir(processed_nx_dir):
-            networkx_files = glob.glob(processed_nx_dir + os.sep + "*.graphml")
-            for f in networkx_files:
-                site_snapshot: SiteSnapshot = self.site_snapshot_klass(url,
-                                                base_name=self.base_name,
-                                                snapshot_nx_file_path=f)
-                if site_snapshot.has_ads() and site_snapshot.has_page_content():
-                    self.site_snapshots.append((site_snapshot, site_snapshot.snapshot_name))
+            networkx_files = glob_maybe_compressed(processed_nx_dir + os.sep + "*.graphml")
+            self._load_site_snapshots(url, networkx_files)
+
+    def _load_site_snapshots(self, url: str, networkx_files: typing.List[str]):
+        """
+        Reads in the given site snapshot files, using snapshot_load_workers processes.
+        Site snapshots are added in the order of their sorted file paths, no matter how many workers are used.
+        """
+        networkx_files = sorted(networkx_files)
+
+        # skip snapshots that the manifest already tells us have no ads or page content
+        for f in list(networkx_files):
+            manifest = read_snapshot_manifest(f)
+            if manifest and not (manifest.has_ads() and manifest.has_page_content()):
+                logger.info(f"Skipping site snapshot {os.path.basename(f)} since its manifest has no ads "
+                            f"or page content")
+                networkx_files.remove(f)
+
+        if self.dedupe_site_snapshots:
+            networkx_files = self._remove_duplicate_snapshot_files(networkx_files)
+
+        self._load_site_snapshots_with(_load_site_snapshot, networkx_files,
+                                       [self.site_snapshot_klass] * len(networkx_files),
+                                       [url] * len(networkx_files),
+                                       [self.base_name] * len(networkx_files),
+                                       [self.infused_snapshot_dir] * len(networkx_files),
+                                       networkx_files)
+
+    def _remove_duplicate_snapshot_files(self, networkx_files: typing.List[str]) -> typing.List[str]:
+        """
+        Leaves out the files whose manifest has the content hash of an earlier file, so they are never read in.
+        Files without a manifest are kept, they are deduplicated once loaded instead.
+        """
+        kept_files = []
+        for f in networkx_files:
+            manifest = read_snapshot_manifest(f)
+            name = os.path.basename(f)
+            if manifest and manifest.content_hash:
+                representative = self._site_snapshot_by_content_hash.setdefault(manifest.content_hash, name)
+                if representative != name:
+                    logger.info(f"Skipping site snapshot {name} since its manifest has the same content "
+                                f"as {representative}")
+                    self.site_snapshot_duplicates[representative].append(name)
+                    continue
+            kept_files.append(f)
+        return kept_files
+
+    def _add_site_snapshot(self, site_snapshot: SiteSnapshot):
+        """
+        Adds the site snapshot, or only its name when dedupe_site_snapshots is on
+        and a site snapshot with the same content was added already
+        """
+        name = site_snapshot.snapshot_name
+        if self.dedupe_site_snapshots:
+            content_hash = site_snapshot.get_compiled_snapshot().get_content_hash()
+            representative = self._site_snapshot_by_content_hash.setdefault(content_hash, name)
+            if representative != name:
+                logger.info(f"Site snapshot {name} has the same content as {representative}, collapsing it")
+                self.site_snapshot_duplicates[representative].append(name)
+                return
+        self.site_snapshots.append((site_snapshot, name))
+
+    def get_site_snapshot_weight(self, site_snapshot_name: str) -> int:
+        """
+        Number of site snapshots that the given one stands for, including itself
+        """
+        return 1 + len(self.site_snapshot_duplicates.get(site_snapshot_name, []))
+
+    def get_weighted_site_snapshots(self, site_snapshots: typing.List[typing.Tuple[SiteSnapshot, str]]) \
+            -> typing.List[typing.Tuple[SiteSnapshot, str]]:
+        """
+        Repeats each site snapshot under the names of its duplicates, sorted by name when there are any.
+        Choosing from it is the same as choosing from the site snapshots before they were deduplicated,
+        including the random draws, while the duplicates share one graph.
+        """
+        if not self.site_snapshot_duplicates:
+            return site_snapshots
+        weighted_site_snapshots = list(site_snapshots)
+        for site_snapshot, name in site_snapshots:
+            for duplicate_name in self.site_snapshot_duplicates.get(name, []):
+                weighted_site_snapshots.append((site_snapshot, duplicate_name))
+        weighted_site_snapshots.sort(key=lambda x: x[1])
+        return weighted_site_snapshots
+
+    def _read_corpus_site_snapshots(self, url: str):
+        """
+        Read in the site snapshots of corpus_site_name straight from the SnapshotCorpus
+        """
+        corpus = get_snapshot_corpus(self.snapshot_corpus_file)
+        if not corpus.has_site(self.corpus_site_name):
+            raise MissingSnapshotException(f"Could not find {self.corpus_site_name} in {self.snapshot_corpus_file}")
+        snapshot_paths = corpus.get_snapshot_paths(self.corpus_site_name, directory=self.site_snapshot_dir_name)
+        self._load_site_snapshots_with(_load_corpus_site_snapshot, snapshot_paths,
+                                       [self.snapshot_corpus_file] * len(snapshot_paths),
+                                       [self.corpus_site_name] * len(snapshot_paths),
+                                       [url] * len(snapshot_paths),
+                                       [self.base_name] * len(snapshot_paths),
+                                       snapshot_paths)
+
+    def _load_site_snapshots_with(self, load_site_snapshot: typing.Callable, snapshot_files: typing.List[str],
+                                  *load_args: list):
+        """
+        Calls load_site_snapshot with each of the load_args, using snapshot_load_workers processes.
+        Site snapshots are added in the order of snapshot_files, no matter how many workers are used.
+        """
+        if len(snapshot_files) == 0:
+            return
+
+        before = time.time()
+        if self.snapshot_load_workers and self.snapshot_load_workers > 1 and len(snapshot_files) > 1:
+            max_workers = min(self.snapshot_load_workers, len(snapshot_files))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                # map returns results in the order of snapshot_files
+                results = list(executor.map(load_site_snapshot, *load_args))
+        else:
+            max_workers = 1
+            results = [load_site_snapshot(*args) for args in zip(*load_args)]
+
+        for f, (site_snapshot, load_time) in zip(snapshot_files, results):
+            logger.info(f"Loaded site snapshot {os.path.basename(f)} in {load_time:.3f}s"
+                        + ("" if site_snapshot else ", skipped since it has no ads or page content"))
+            if site_snapshot:
+                self._add_site_snapshot(site_snapshot)
+
+        load_times = [load_time for _, load_time in results]
+        logger.info(f"Loaded {len(snapshot_files)} site snapshots with {max_workers} worker(s) "
+                    f"in {time.time() - before:.3f}s (slowest {max(load_times):.3f}s, "
+                    f"mean {sum(load_times) / len(load_times):.3f}s)")
 
     def prepare_site_snapshots(self, url: str) -> bool:
         """
@@ -96,6 +304,10 @@ class AutoFRMultiArmedBanditGetSnapshots(AutoFRMultiArmedBandit):
         if len(self.site_snapshots) > 0:
             # sort by name
             self.site_snapshots.sort(key=lambda x: x[1])
+            if self.site_snapshot_duplicates:
+                duplicates = sum(len(names) for names in self.site_snapshot_duplicates.values())
+                logger.info(f"Kept {len(self.site_snapshots)} site snapshots, {duplicates} duplicates "
+                            f"collapsed into them")
             return True
 
         return False
@@ -105,13 +317,15 @@ class AutoFRMultiArmedBanditGetSnapshots(AutoFRMultiArmedBandit):
         Site Snapshots have not been processed, so only pass in the raw adgraphs files
         """
         if self.adgraph_files and len(self.site_snapshots) == 0:
-            # copy files to data dir ready to be processed
-            for f in self.adgraph_files:
-                site_snapshot: SiteSnapshot = self.site_snapshot_klass(url,
-                                             base_name=self.base_name,
-                                             adgraph_raw_file_path=f)
+            # each conversion has its own adgraphapi workspace, so they can use snapshot_load_workers processes
+            site_snapshots = convert_raw_adgraph_files(url,
+                                                       self.adgraph_files,
+                                                       workers=self.snapshot_load_workers,
+                                                       site_snapshot_klass=self.site_snapshot_klass,
+                                                       base_name=self.base_name)
+            for site_snapshot in site_snapshots:
                 if site_snapshot.has_ads() and site_snapshot.has_page_content():
-                    self.site_snapshots.append((site_snapshot, site_snapshot.snapshot_name))
+                    self._add_site_snapshot(site_snapshot)
 
     def find_initial_state(self, *args, **kwargs) -> InitSiteFeedbackDockerResponse:
 
@@ -160,11 +374,21 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
                  action_space: ActionSpace = None,
                  choose_snapshot_random: bool = True,
                  use_snapshot_cache: bool = False,
+                 pull_executor: str = PULL_EXECUTOR_THREAD,
+                 pull_workers: int = None,
+                 site_feedback_cache_dir: str = None,
                  **kwargs):
         """
         use_snapshot_cache: only controls whether we read from the filesystem for the cache file,
             otherwise we always keep an im memory cache for better performance
+        site_feedback_cache_dir: directory of the sqlite cache file when use_snapshot_cache is True, e.g. to share it
+            between runs. Defaults to the output directory of the run, where a new cache starts with the entries
+            of the cache within init_dir (init_dir is only read).
+        pull_executor: whether pull_each_arm_parallel uses threads or forked processes.
+            AutoFREnvironment.run_mab pulls one action at a time through pull, so runs are not affected by it.
+        pull_workers: max number of workers for pull_each_arm_parallel, defaults to the executor's default
         """
+        assert pull_executor in PULL_EXECUTORS, f"Pull executor not recognized {pull_executor}"
 
         ad_highlighter_path = ""
         super(DomainHierarchyMABControlled, self).__init__(ad_highlighter_path,
@@ -182,13 +406,9 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
 
         # keeps track of site feedback given an action and site snapshot
         self.site_feedback_cache = SiteFeedbackCache()
-        if self.init_dir and use_snapshot_cache:
-            try:
-                self.site_feedback_cache = SiteFeedbackCache.read_cache(self.init_dir)
-            except AttributeError as e:
-                logger.debug(f"Could not read in cache file, starting new one. {e}")
-        if self.site_feedback_cache is None:
-            self.site_feedback_cache = SiteFeedbackCache()
+        if use_snapshot_cache:
+            self.site_feedback_cache = self._read_site_feedback_cache(site_feedback_cache_dir or
+                                                                      self.get_base_data_dir())
 
         self.adblock_parser_cache = dict()
         if not os.path.isdir(self.get_base_site_snapshots_dir()):
@@ -197,6 +417,8 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
         self.choose_snapshot_random = choose_snapshot_random
         self.use_snapshot_cache = use_snapshot_cache
         self.snapshot_choice_history = []
+        self.pull_executor = pull_executor
+        self.pull_workers = pull_workers
 
     def reset(self):
         super(DomainHierarchyMABControlled, self).reset()
@@ -207,23 +429,73 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
             random.seed(40)
 
     def save_cache(self):
+        """
+        Checkpoints the sqlite cache, which is copied to the output directory if it is kept elsewhere
+        """
         if self.use_snapshot_cache:
             self.site_feedback_cache.save(self.get_base_data_dir())
 
+    def _read_site_feedback_cache(self, directory: str) -> SQLiteSiteFeedbackCache:
+        """
+        Opens the sqlite cache within the directory.
+        A new cache is filled with the entries of the cache within init_dir: its sqlite cache file,
+        or else the older pickled cache, if there is one.
+        """
+        os.makedirs(directory, exist_ok=True)
+        is_new_cache = not os.path.isfile(SQLiteSiteFeedbackCache.get_cache_file(directory))
+        site_feedback_cache = SQLiteSiteFeedbackCache.read_cache(directory)
+        if not is_new_cache or not self.init_dir:
+            return site_feedback_cache
+
+        init_cache_file = SQLiteSiteFeedbackCache.get_cache_file(self.init_dir)
+        if os.path.isfile(init_cache_file):
+            try:
+                entries_added = site_feedback_cache.update_from_cache_file(init_cache_file)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not read in cache file {init_cache_file}, starting new one. {e}")
+            else:
+                logger.info(f"Copied {entries_added} entries of {init_cache_file} to "
+                            f"{site_feedback_cache.cache_file}")
+        elif os.path.isfile(self.init_dir + os.sep + SITE_FEEDBACK_CACHE_CSV):
+            try:
+                pickled_cache = SiteFeedbackCache.read_cache(self.init_dir)
+            except (AttributeError, EOFError) as e:
+                logger.debug(f"Could not read in older cache file, starting new one. {e}")
+            else:
+                site_feedback_cache.update_many({key: self._create_cache_entry_from_response(response)
+                                                 for key, response in pickled_cache.items()})
+                logger.info(f"Moved {len(pickled_cache)} entries of the older cache file to "
+                            f"{site_feedback_cache.cache_file}")
+        return site_feedback_cache
+
+    @staticmethod
+    def _create_cache_entry_from_response(response: SiteFeedbackFilterRulesDockerResponse) \
+            -> SiteFeedbackCacheEntry:
+        """
+        Responses of older caches already fell back to the init site feedback, so they are marked as blocked
+        to keep their counters as they are
+        """
+        rule_to_urls = {rule: [record.url_blocked for record in records]
+                        for rule, records in response.block_items_and_match.items()}
+        return SiteFeedbackCacheEntry(ad_counter=response.site_feedback.ad_counter,
+                                      image_counter=response.site_feedback.image_counter,
+                                      textnode_counter=response.site_feedback.textnode_counter,
+                                      ads_blocked=True,
+                                      images_blocked=True,
+                                      textnodes_blocked=True,
+                                      rule_to_urls=rule_to_urls)
+
     def _read_site_snapshots(self, url: str):
         """
         Read in site snapshots that have already been processed from JSON into graphml files
         """
-        if self.init_dir:
+        if self.snapshot_corpus_file:
+            self._read_corpus_site_snapshots(url)
+        elif self.init_dir:
             processed_nx_dir = self.init_dir + os.sep + self.site_snapshot_dir_name
             if os.path.isdir(processed_nx_dir):
-                networkx_files = glob.glob(processed_nx_dir + os.sep + "*.graphml")
-                for f in networkx_files:
-                    site_snapshot = self.site_snapshot_klass(url,
-                                                    base_name=self.base_name,
-                                                    snapshot_nx_file_path=f)
-                    if site_snapshot.has_ads() and site_snapshot.has_page_content():
-                        self.site_snapshots.append((site_snapshot, site_snapshot.snapshot_name))
+                networkx_files = glob_maybe_compressed(processed_nx_dir + os.sep + "*.graphml")
+                self._load_site_snapshots(url, networkx_files)
 
     def find_initial_state(self,
                            url,
@@ -233,6 +505,12 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
                            filter_list_path: str = None,
                            ) -> InitSiteFeedbackDockerResponse:
 
+        # init state files of a corpus site are small, only they are written out to be read like the directories
+        if self.snapshot_corpus_file and not os.path.isdir(self.init_dir):
+            extracted_files = get_snapshot_corpus(self.snapshot_corpus_file).extract_files(self.corpus_site_name,
+                                                                                           self.init_dir)
+            logger.info(f"Wrote {len(extracted_files)} init state files of {self.corpus_site_name} to {self.init_dir}")
+
         # else read in the directories
         execute_done_count = 0
         docker_response_main = InitSiteFeedbackDockerResponse()
@@ -292,7 +570,12 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
         """
         results = []
         actions.sort()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+        if self.pull_executor == PULL_EXECUTOR_PROCESS and not kwargs.get("is_test"):
+            if "fork" in multiprocessing.get_all_start_methods():
+                return self._pull_each_arm_in_processes(actions)
+            logger.warning(f"Cannot fork processes on this platform, pulling with threads instead")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.pull_workers) as executor:
             future_to_info = {}
             for action in actions:
                 future = executor.submit(self.pull, url, action, **kwargs)
@@ -307,6 +590,60 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
                     results.append(result_tmp)
         return results
 
+    def _pull_each_arm_in_processes(self, actions: list) -> list:
+        """
+        Same as calling pull for each action in order, but the site snapshots are simulated in forked processes.
+        Snapshots are chosen and the cache is checked and updated in this process, so the results match a serial run.
+        """
+        global _forked_site_snapshots
+
+        # compile snapshots before forking, so workers share them instead of building their own
+        for site_snapshot, _ in self.site_snapshots:
+            site_snapshot.get_compiled_snapshot()
+        site_snapshot_indexes = {id(site_snapshot): index for index, (site_snapshot, _) in enumerate(self.site_snapshots)}
+
+        pull_infos = []
+        responses = dict()
+        _forked_site_snapshots = self.site_snapshots
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.pull_workers,
+                                                        mp_context=multiprocessing.get_context("fork")) as executor:
+                future_by_cache_key = dict()
+                snapshot_by_cache_key = dict()
+                for action in actions:
+                    try:
+                        filter_rules, site_snapshot, ss_cache_key, response = self._start_pull(action)
+                    except (OSError, AutoFRException) as e:
+                        logger.warning(f"{action} pull_each_arm_parallel: generated an exception: {repr(e)} {e}")
+                        continue
+                    if response is not None:
+                        responses[len(pull_infos)] = response
+                    elif ss_cache_key not in future_by_cache_key:
+                        snapshot_by_cache_key[ss_cache_key] = site_snapshot
+                        future_by_cache_key[ss_cache_key] = executor.submit(
+                            _simulate_pull_in_forked_process, site_snapshot_indexes[id(site_snapshot)], filter_rules)
+                    pull_infos.append((action, filter_rules, ss_cache_key))
+
+                for index, (action, filter_rules, ss_cache_key) in enumerate(pull_infos):
+                    if index in responses:
+                        continue
+                    # the same snapshot and rules may have been pulled by a previous action
+                    response = self._get_cached_response(action, filter_rules, ss_cache_key)
+                    if response is not None:
+                        responses[index] = response
+                        continue
+                    try:
+                        rule_matches, pull_result = future_by_cache_key[ss_cache_key].result()
+                    except (OSError, AutoFRException) as e:
+                        logger.warning(f"{action} pull_each_arm_parallel: generated an exception: {repr(e)} {e}")
+                    else:
+                        snapshot_by_cache_key[ss_cache_key].get_compiled_snapshot().add_rule_matches(rule_matches)
+                        responses[index] = self._finish_pull(action, filter_rules, ss_cache_key, pull_result)
+        finally:
+            _forked_site_snapshots = []
+
+        return [responses[index] for index in sorted(responses)]
+
     @staticmethod
     def _increment_counter(node_data: dict, ad_counter: int, image_counter: int, textnode_counter: int) \
             -> Tuple[int, int, int, bool, bool, bool]:
@@ -331,7 +668,7 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
         """
         if self.choose_snapshot_random:
             #logger.debug(f"Choosing site snapshot randomly")
-            return random.choice(self.site_snapshots)
+            return random.choice(self.get_weighted_site_snapshots(self.site_snapshots))
 
         possible_site_snapshots = []
         for arm in actions:
@@ -345,10 +682,10 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
         #logger.debug(f"Choosing site snapshot from possible {len(possible_site_snapshots)} for {actions}")
         if possible_site_snapshots:
             possible_site_snapshots.sort(key=lambda x: x[1])
-            return random.choice(possible_site_snapshots)
+            return random.choice(self.get_weighted_site_snapshots(possible_site_snapshots))
 
         #logger.warning(f"Found no possible site snapshot for {actions}, falling back to choosing randomly")
-        return random.choice(self.site_snapshots)
+        return random.choice(self.get_weighted_site_snapshots(self.site_snapshots))
 
     def _is_ancestor_blocked(self, node_tmp: str, block_nodes_tmp: dict, site_snapshot: SiteSnapshot) -> typing.Optional[str]:
         found_blocked_ancestor = None
@@ -358,61 +695,17 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
                 break
         return found_blocked_ancestor
 
-    def pull(self, url: str, actions: list,
-             is_test: bool = False,
-             **kwargs) \
-            -> SiteFeedbackFilterRulesDockerResponse:
+    def _simulate_pull_with_networkx(self, site_snapshot: SiteSnapshot, parser: AutoFRAdblockRules,
+                                     is_test: bool = False) -> SnapshotPullResult:
         """
-        Do the following:
-        (1) Select a Site Snapshot randomly
-        (2) Create a AdblockRules (parser) with the rules version of the actions
-        (3) Do a breadth first search to get the site feedback
-        (4) Return the response
+        Breadth first search directly over the networkx graph of the site snapshot.
+        This is slower than the compiled snapshot but can print out debug information when is_test is True.
         """
-
-        # create rules and a parser
-        filter_rules = [create_rule_simple(x) for x in actions]
-
-        logger.info(f"{self.__class__.__name__} pulling filter rule(s): {filter_rules}")
-
         # reset counters and keep track of blocked actions
         ad_counter = 0
         image_counter = 0
         textnode_counter = 0
-
-        # for the control, this is different since the blocking is based on the whole filter_rules
-        # we do not know which rule was matched here, so we treat the entire filter_rules as one
         block_items_and_match = dict()
-        filter_rules_str = ",".join(filter_rules)
-
-        site_snapshot, site_snapshot_name = self._choose_site_snapshot(actions)
-
-        logger.info(f"Chose {site_snapshot_name} as simulated site from possible {len(self.site_snapshots)} snapshots")
-        self.snapshot_choice_history.append(site_snapshot_name)
-
-        # is it in our cache?
-        ss_cache_key = site_snapshot_name + filter_rules_str
-        if not is_test and self.site_feedback_cache.get(ss_cache_key):
-            if self.use_snapshot_cache:
-                logger.info(f"Cache hit: {ss_cache_key} for {filter_rules}")
-            else:
-                logger.info(f"In memory cache hit: {ss_cache_key} for {filter_rules}")
-            response: SiteFeedbackFilterRulesDockerResponse = self.site_feedback_cache.get(ss_cache_key)
-            response.reward = self.get_reward(response.site_feedback)
-            response.is_optimal = self.is_optimal(actions)
-            response.action = actions
-            logger.info(f"Pull results from cache: {response}")
-            return response
-
-        before = time.time()
-        if not is_test:
-            if filter_rules_str in self.adblock_parser_cache:
-                parser = self.adblock_parser_cache[filter_rules_str]
-            else:
-                parser = AutoFRAdblockRules(filter_rules)
-                self.adblock_parser_cache[filter_rules_str] = parser
-        else:
-            parser = AutoFRAdblockRules(filter_rules)
 
         # prepare for BFS from randomly chosen site
         node_queue = collections.deque()
@@ -480,7 +773,7 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
                         #before_adding_successor = time.time()
                         edge_data = site_snapshot.get_graph().get_edge_data(tmp_node, s)
                         if EDGE_TYPE in edge_data and edge_data[EDGE_TYPE] == SNAPSHOT_EDGE__DOM:
-                            if not has_non_dom_predecessor_edges(site_snapshot.get_graph(), s):
+                            if not site_snapshot.has_non_dom_predecessor_edges(s):
                                 node_queue.append(s)
                             #print(f"Time took to decide to add successor {s}: {time.time() - before_adding_successor}")
                             # logger.debug(f"ignoring node {s} for now due to having other edge types")
@@ -530,12 +823,6 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
                         print(f"Node textnode {node} blocked because ancestor {found_blocked_ancestor}: path {path_tmp}")
 
 
-        # create site feedback
-        site_feedback = SiteFeedback(ad_counter=ad_counter,
-                                     image_counter=image_counter,
-                                     textnode_counter=textnode_counter)
-
-
         # Categorize blocked nodes.
         # Note that nodes that are explicitly blocked or are not visited are considered "blocked"
         blocked_nodes_all = list(blocked_nodes.keys()) + list(not_visited.keys())
@@ -556,39 +843,153 @@ class DomainHierarchyMABControlled(AutoFRMultiArmedBanditGetSnapshots):
         #print(f"FLG_AD blocked during test: {flg_ads_blocked}")
         #print(f"FLG_IMAGE blocked during test: {flg_images_blocked}")
         #print(f"FLG_TEXTNODE blocked during test: {flg_textnodes_blocked}")
-        # if there were no blocking of ads, images, or textnodes, then set it back to the init_site_feedback
-        # Note: this is only possible in the controlled environment
-        if not is_test:
-            if len(flg_ads_blocked) == 0:
-                site_feedback.ad_counter = self.init_site_feedback.ad_counter
-            if len(flg_images_blocked) == 0:
-                site_feedback.image_counter = self.init_site_feedback.image_counter
-            if len(flg_textnodes_blocked) == 0:
-                site_feedback.textnode_counter = self.init_site_feedback.textnode_counter
-
         if is_test:
             print(f"Others type of nodes blocked: {others_blocked}")
             print(f"Explicit Blocked nodes: {blocked_nodes}, \n Not visited nodes: {not_visited}")
 
-        logger.info(f"Site feedback found: {site_feedback} for filter rule(s) {filter_rules_str}")
-        logger.info(f"Pull {filter_rules} took {time.time() - before}")
+        return SnapshotPullResult(ad_counter=ad_counter,
+                                  image_counter=image_counter,
+                                  textnode_counter=textnode_counter,
+                                  block_items_and_match=block_items_and_match,
+                                  ads_blocked=len(flg_ads_blocked) > 0,
+                                  images_blocked=len(flg_images_blocked) > 0,
+                                  textnodes_blocked=len(flg_textnodes_blocked) > 0)
+
+    def _get_parser(self, filter_rules: list, is_test: bool = False) \
+            -> typing.Union[AutoFRAdblockRules, AutoFRDomainAnchorRules]:
+        if is_test:
+            return AutoFRAdblockRules(filter_rules)
+        filter_rules_str = ",".join(filter_rules)
+        if filter_rules_str not in self.adblock_parser_cache:
+            # rules created by create_rule_simple are matched by the faster domain anchor matcher
+            self.adblock_parser_cache[filter_rules_str] = get_adblock_rules(filter_rules)
+        return self.adblock_parser_cache[filter_rules_str]
+
+    def _start_pull(self, actions: list, is_test: bool = False) \
+            -> typing.Tuple[list, SiteSnapshot, typing.Optional[str],
+                            typing.Optional[SiteFeedbackFilterRulesDockerResponse]]:
+        """
+        Creates the rules of the actions, chooses the site snapshot and checks the cache.
+        Returns the filter rules, the site snapshot, the cache key (None if is_test) and the cached response if any
+        """
+        # create rules and a parser
+        filter_rules = [create_rule_simple(x) for x in actions]
+
+        logger.info(f"{self.__class__.__name__} pulling filter rule(s): {filter_rules}")
+
+        site_snapshot, site_snapshot_name = self._choose_site_snapshot(actions)
+
+        logger.info(f"Chose {site_snapshot_name} as simulated site from possible {len(self.site_snapshots)} snapshots")
+        self.snapshot_choice_history.append(site_snapshot_name)
+
+        # is it in our cache?
+        ss_cache_key = None
+        response = None
+        if not is_test:
+            ss_cache_key = self.get_cache_key(site_snapshot, filter_rules)
+            response = self._get_cached_response(actions, filter_rules, ss_cache_key)
+            if response is None and self.use_snapshot_cache:
+                # caches of older runs were keyed by the snapshot name and the rules in order
+                legacy_cache_key = site_snapshot_name + ",".join(filter_rules)
+                response = self._get_cached_response(actions, filter_rules, legacy_cache_key)
+                if response is not None:
+                    self.site_feedback_cache[ss_cache_key] = self.site_feedback_cache.get(legacy_cache_key)
+
+        return filter_rules, site_snapshot, ss_cache_key, response
+
+    @staticmethod
+    def get_cache_key(site_snapshot: SiteSnapshot, filter_rules: list) -> str:
+        """
+        For the control, the blocking is based on the whole filter_rules,
+        so the key is made of the content of the snapshot and the set of rules.
+        It does not depend on file names or rule order, so the cache can be shared across runs and datasets.
+        """
+        return site_snapshot.get_compiled_snapshot().get_content_hash() + ":" + get_rules_hash(filter_rules)
+
+    def _get_cached_response(self, actions: list, filter_rules: list, ss_cache_key: str) \
+            -> typing.Optional[SiteFeedbackFilterRulesDockerResponse]:
+        cache_entry: SiteFeedbackCacheEntry = self.site_feedback_cache.get(ss_cache_key)
+        if cache_entry is not None:
+            if self.use_snapshot_cache:
+                logger.info(f"Cache hit: {ss_cache_key} for {filter_rules}")
+            else:
+                logger.info(f"In memory cache hit: {ss_cache_key} for {filter_rules}")
+            response = self._create_response(actions, filter_rules, cache_entry)
+            logger.info(f"Pull results from cache: {response}")
+            return response
+        return None
+
+    def _create_response(self, actions: list, filter_rules: list, cache_entry: SiteFeedbackCacheEntry,
+                         is_test: bool = False) -> SiteFeedbackFilterRulesDockerResponse:
+        # if there were no blocking of ads, images, or textnodes, then set it back to the init_site_feedback
+        # Note: this is only possible in the controlled environment
+        site_feedback = cache_entry.get_site_feedback(None if is_test else self.init_site_feedback)
+
+        block_items_and_match = dict()
+        for rule, urls in cache_entry.rule_to_urls.items():
+            block_items_and_match[rule] = [FilterRuleBlockRecord(rule, url_blocked, "", "") for url_blocked in urls]
 
         main_path = ""
         outgoing_requests = []
-        logger.info(f"Rules triggered: {list(block_items_and_match.keys())}")
-        response = SiteFeedbackFilterRulesDockerResponse(site_feedback,
-                                                         main_path,
-                                                         outgoing_requests,
-                                                         filter_rules=filter_rules,
-                                                         action=actions,
-                                                         block_items_and_match=block_items_and_match,
-                                                         reward=self.get_reward(site_feedback),
-                                                         is_optimal=self.is_optimal(actions)
-                                                         )
+        return SiteFeedbackFilterRulesDockerResponse(site_feedback,
+                                                     main_path,
+                                                     outgoing_requests,
+                                                     filter_rules=filter_rules,
+                                                     action=actions,
+                                                     block_items_and_match=block_items_and_match,
+                                                     reward=self.get_reward(site_feedback),
+                                                     is_optimal=self.is_optimal(actions)
+                                                     )
+
+    def _finish_pull(self, actions: list, filter_rules: list, ss_cache_key: str,
+                     pull_result: SnapshotPullResult, is_test: bool = False) -> SiteFeedbackFilterRulesDockerResponse:
+        """
+        Creates the response from the outcome of the simulated pull and adds it to the cache
+        """
+        # the cache keeps only the counters and the urls blocked by each rule
+        rule_to_urls = {rule: [record.url_blocked for record in records]
+                        for rule, records in pull_result.block_items_and_match.items()}
+        cache_entry = SiteFeedbackCacheEntry(ad_counter=pull_result.ad_counter,
+                                             image_counter=pull_result.image_counter,
+                                             textnode_counter=pull_result.textnode_counter,
+                                             ads_blocked=pull_result.ads_blocked,
+                                             images_blocked=pull_result.images_blocked,
+                                             textnodes_blocked=pull_result.textnodes_blocked,
+                                             rule_to_urls=rule_to_urls)
+        response = self._create_response(actions, filter_rules, cache_entry, is_test=is_test)
+
+        logger.info(f"Site feedback found: {response.site_feedback} for filter rule(s) {','.join(filter_rules)}")
+        logger.info(f"Rules triggered: {list(response.block_items_and_match.keys())}")
         if not is_test:
             # add to cache
-            self.site_feedback_cache[ss_cache_key] = response
+            self.site_feedback_cache[ss_cache_key] = cache_entry
 
         logger.info(f"Pull results: {response}")
 
         return response
+
+    def pull(self, url: str, actions: list,
+             is_test: bool = False,
+             **kwargs) \
+            -> SiteFeedbackFilterRulesDockerResponse:
+        """
+        Do the following:
+        (1) Select a Site Snapshot randomly
+        (2) Create the rules version of the actions, where the urls matched by each rule are memoized per snapshot
+        (3) Do a breadth first search (or compose the memoized matches) to get the site feedback
+        (4) Return the response
+        """
+        filter_rules, site_snapshot, ss_cache_key, response = self._start_pull(actions, is_test=is_test)
+        if response is not None:
+            return response
+
+        before = time.time()
+        if is_test:
+            parser = self._get_parser(filter_rules, is_test=is_test)
+            pull_result = self._simulate_pull_with_networkx(site_snapshot, parser, is_test=is_test)
+        else:
+            # composed from the memoized matches of each rule on this snapshot
+            pull_result = site_snapshot.get_compiled_snapshot().simulate_pull_for_rules(filter_rules)
+        logger.info(f"Pull {filter_rules} took {time.time() - before}")
+
+        return self._finish_pull(actions, filter_rules, ss_cache_key, pull_result, is_test=is_test)
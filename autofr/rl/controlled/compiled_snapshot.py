@@ -0,0 +1,496 @@
+import collections
+import hashlib
+import json
+import logging
+import typing
+
+import networkx as nx
+import numpy as np
+from adblockparser import AdblockRule
+
+from autofr.common.action_space_utils import ROOT_NODE_ID
+from autofr.common.adblockparser_utils import get_adblock_rules
+from autofr.common.filter_rules_utils import FilterRuleBlockRecord
+from autofr.rl.action_space import EDGE_TYPE
+from autofr.rl.controlled.site_snapshot import INFO, FLG_AD, FLG_IMAGE, FLG_TEXTNODE, SNAPSHOT_EDGE__DOM, \
+    get_nodes_with_non_dom_predecessor_edges, get_url_from_node_data, is_node_data_annotated
+
+logger = logging.getLogger(__name__)
+
+# edge type code used when an edge has no EDGE_TYPE attribute
+EDGE_CODE_UNKNOWN = -1
+
+
+def is_iframe_node_data(node_data: dict) -> bool:
+    return INFO in node_data and node_data[INFO].lower() == "iframe"
+
+
+def _popcount(bitset: int) -> int:
+    return bin(bitset).count("1")
+
+
+def _add_block_records(block_items_and_match: dict, seen_records: set, url_found: str, matched_rules: list):
+    """
+    Records that url_found was blocked by matched_rules, once per rule and url
+    """
+    for adblock_rule in matched_rules:
+        rule_text = adblock_rule.raw_rule_text
+        if rule_text not in block_items_and_match:
+            block_items_and_match[rule_text] = []
+        if (rule_text, url_found) not in seen_records:
+            seen_records.add((rule_text, url_found))
+            block_items_and_match[rule_text].append(FilterRuleBlockRecord(rule_text, url_found, "", ""))
+
+
+class SnapshotPullResult:
+    """
+    Outcome of simulating a pull over a site snapshot.
+    The *_blocked attributes tell whether any node of that category was blocked or not visited.
+    """
+
+    def __init__(self,
+                 ad_counter: int = 0,
+                 image_counter: int = 0,
+                 textnode_counter: int = 0,
+                 block_items_and_match: dict = None,
+                 ads_blocked: bool = False,
+                 images_blocked: bool = False,
+                 textnodes_blocked: bool = False):
+        self.ad_counter = ad_counter
+        self.image_counter = image_counter
+        self.textnode_counter = textnode_counter
+        self.block_items_and_match = block_items_and_match or dict()
+        self.ads_blocked = ads_blocked
+        self.images_blocked = images_blocked
+        self.textnodes_blocked = textnodes_blocked
+
+
+class RuleMatches:
+    """
+    Urls of a snapshot matched by one filter rule, with the bitsets of their reachable nodes
+    and of the nodes those remove when blocked. See CompiledSiteSnapshot.get_rule_matches
+    """
+
+    def __init__(self,
+                 adblock_rule: typing.Optional[AdblockRule],
+                 urls: typing.Tuple[str, ...],
+                 matched_mask: int,
+                 closures_mask: int):
+        self.adblock_rule = adblock_rule
+        self.urls = urls
+        self.matched_mask = matched_mask
+        self.closures_mask = closures_mask
+
+
+class CompiledSiteSnapshot:
+    """
+    Array-backed, read-only version of a site snapshot graph used to simulate pulls.
+    Nodes are mapped to integer ids (in the order of the networkx graph) and edges are kept
+    in CSR form for successors and predecessors, preserving the adjacency order of the graph.
+    """
+
+    def __init__(self, g: nx.DiGraph, nodes_with_non_dom_parent: set = None):
+        """
+        nodes_with_non_dom_parent: see get_nodes_with_non_dom_predecessor_edges, computed if not given
+        """
+        self.node_names: typing.List[str] = list(g.nodes())
+        self.node_index: typing.Dict[str, int] = {n: i for i, n in enumerate(self.node_names)}
+        self.number_of_nodes = len(self.node_names)
+        self.root = self.node_index[g.graph[ROOT_NODE_ID]]
+
+        # intern edge types into codes
+        self.edge_types: typing.List[str] = []
+        edge_type_codes = dict()
+
+        succ_indptr = np.zeros(self.number_of_nodes + 1, dtype=np.int64)
+        succ_indices = []
+        succ_edge_codes = []
+        for i, n in enumerate(self.node_names):
+            for s, edge_data in g.adj[n].items():
+                succ_indices.append(self.node_index[s])
+                if EDGE_TYPE in edge_data:
+                    edge_type = edge_data[EDGE_TYPE]
+                    if edge_type not in edge_type_codes:
+                        edge_type_codes[edge_type] = len(self.edge_types)
+                        self.edge_types.append(edge_type)
+                    succ_edge_codes.append(edge_type_codes[edge_type])
+                else:
+                    succ_edge_codes.append(EDGE_CODE_UNKNOWN)
+            succ_indptr[i + 1] = len(succ_indices)
+        self.succ_indptr = succ_indptr
+        self.succ_indices = np.array(succ_indices, dtype=np.int32)
+        self.succ_edge_codes = np.array(succ_edge_codes, dtype=np.int16)
+
+        pred_indptr = np.zeros(self.number_of_nodes + 1, dtype=np.int64)
+        pred_indices = []
+        for i, n in enumerate(self.node_names):
+            pred_indices.extend(self.node_index[p] for p in g.pred[n])
+            pred_indptr[i + 1] = len(pred_indices)
+        self.pred_indptr = pred_indptr
+        self.pred_indices = np.array(pred_indices, dtype=np.int32)
+
+        # node flags and urls
+        self.is_ad = np.zeros(self.number_of_nodes, dtype=bool)
+        self.is_image = np.zeros(self.number_of_nodes, dtype=bool)
+        self.is_textnode = np.zeros(self.number_of_nodes, dtype=bool)
+        self.is_iframe = np.zeros(self.number_of_nodes, dtype=bool)
+        self.urls: typing.List[typing.Optional[str]] = [None] * self.number_of_nodes
+        for i, (n, node_data) in enumerate(g.nodes(data=True)):
+            self.is_ad[i] = is_node_data_annotated(node_data, FLG_AD)
+            self.is_image[i] = is_node_data_annotated(node_data, FLG_IMAGE)
+            self.is_textnode[i] = is_node_data_annotated(node_data, FLG_TEXTNODE)
+            self.is_iframe[i] = is_iframe_node_data(node_data)
+            if i != self.root:
+                self.urls[i] = get_url_from_node_data(node_data) or None
+
+        # nodes that are only followed through non-DOM edges during a pull
+        if nodes_with_non_dom_parent is None:
+            nodes_with_non_dom_parent = get_nodes_with_non_dom_predecessor_edges(g)
+        self.has_non_dom_parent = np.zeros(self.number_of_nodes, dtype=bool)
+        for n in nodes_with_non_dom_parent:
+            self.has_non_dom_parent[self.node_index[n]] = True
+
+        self._build_traversal_lists(edge_type_codes.get(SNAPSHOT_EDGE__DOM))
+        self._build_blocking_masks()
+        self._content_hash: typing.Optional[str] = None
+
+    def _build_traversal_lists(self, dom_code: typing.Optional[int]):
+        """
+        Python lists derived from the arrays, used within the hot loops of a pull
+        """
+        succ_indptr = self.succ_indptr.tolist()
+        succ_indices = self.succ_indices.tolist()
+        succ_edge_codes = self.succ_edge_codes.tolist()
+        has_non_dom_parent = self.has_non_dom_parent.tolist()
+        self._successors = [succ_indices[succ_indptr[i]:succ_indptr[i + 1]] for i in range(self.number_of_nodes)]
+        # successors that the pull BFS is allowed to follow:
+        # a DOM edge is not followed if its target has non-DOM parents
+        self._allowed_successors = []
+        for i in range(self.number_of_nodes):
+            allowed = []
+            for j in range(succ_indptr[i], succ_indptr[i + 1]):
+                s = succ_indices[j]
+                if succ_edge_codes[j] == dom_code and has_non_dom_parent[s]:
+                    continue
+                allowed.append(s)
+            self._allowed_successors.append(allowed)
+        self._is_ad = self.is_ad.tolist()
+        self._is_image = self.is_image.tolist()
+        self._is_textnode = self.is_textnode.tolist()
+        self._is_iframe = self.is_iframe.tolist()
+
+    def _build_blocking_masks(self):
+        """
+        Bitsets (python ints, bit i is node i) that do not depend on which rules are pulled
+        """
+        # distinct urls to the nodes that have them
+        self._url_to_nodes: typing.Dict[str, typing.List[int]] = dict()
+        for i, url_found in enumerate(self.urls):
+            if url_found:
+                self._url_to_nodes.setdefault(url_found, []).append(i)
+
+        # breadth first search without any blocking, keeping the order in which nodes are visited
+        self._bfs_rank = [self.number_of_nodes] * self.number_of_nodes
+        self._is_reachable = [False] * self.number_of_nodes
+        visit_count = 0
+        node_queue = collections.deque([self.root])
+        while node_queue:
+            tmp_node = node_queue.popleft()
+            if self._is_reachable[tmp_node]:
+                continue
+            self._is_reachable[tmp_node] = True
+            self._bfs_rank[tmp_node] = visit_count
+            visit_count += 1
+            for s in self._allowed_successors[tmp_node]:
+                if not self._is_reachable[s]:
+                    node_queue.append(s)
+
+        is_reachable = np.array(self._is_reachable, dtype=bool)
+        not_root = np.ones(self.number_of_nodes, dtype=bool)
+        not_root[self.root] = False
+        counted = is_reachable & not_root
+
+        self._root_mask = 1 << self.root
+        self._unreachable_mask = self._to_bitset(np.flatnonzero(~is_reachable))
+        self._counted_ad_mask = self._to_bitset(np.flatnonzero(counted & self.is_ad))
+        self._counted_ad_non_iframe_mask = self._to_bitset(np.flatnonzero(counted & self.is_ad & ~self.is_iframe))
+        self._counted_image_mask = self._to_bitset(np.flatnonzero(counted & self.is_image))
+        self._counted_textnode_mask = self._to_bitset(np.flatnonzero(counted & self.is_textnode))
+        # a blocked node falls into only one category: ad, then image, then textnode
+        self._ad_category_mask = self._to_bitset(np.flatnonzero(self.is_ad))
+        self._image_category_mask = self._to_bitset(np.flatnonzero(self.is_image & ~self.is_ad))
+        self._textnode_category_mask = self._to_bitset(
+            np.flatnonzero(self.is_textnode & ~self.is_image & ~self.is_ad))
+
+        # url node to the bitset of nodes that it removes when blocked, filled lazily
+        self._blocking_closures: typing.Dict[int, int] = dict()
+        # filter rule to the url nodes it matches, filled lazily
+        self._rule_matches: typing.Dict[str, RuleMatches] = dict()
+
+    def get_content_hash(self) -> str:
+        """
+        Hash of everything a pull depends on: urls, annotations, edges and their order, but not node names.
+        Snapshots with the same hash give the same pull outcomes.
+        """
+        if self._content_hash is None:
+            content_hash = hashlib.sha256()
+            content_hash.update(json.dumps([self.number_of_nodes, self.root, self.edge_types, self.urls]).encode("utf-8"))
+            for array in (self.succ_indptr, self.succ_indices, self.succ_edge_codes,
+                          self.is_ad, self.is_image, self.is_textnode, self.is_iframe, self.has_non_dom_parent):
+                content_hash.update(str(array.dtype).encode("utf-8"))
+                content_hash.update(np.ascontiguousarray(array).tobytes())
+            self._content_hash = content_hash.hexdigest()
+        return self._content_hash
+
+    def _to_bitset(self, nodes: typing.Iterable[int]) -> int:
+        flags = np.zeros(self.number_of_nodes, dtype=bool)
+        flags[np.fromiter(nodes, dtype=np.int64)] = True
+        return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+    def get_blocking_closure(self, node: int) -> int:
+        """
+        Returns the bitset of nodes that have node as an ancestor (all edge types).
+        These are the nodes that are no longer counted when node is blocked.
+        """
+        if node not in self._blocking_closures:
+            reached = self._get_descendants([node])
+            self._blocking_closures[node] = self._to_bitset(i for i, r in enumerate(reached) if r)
+        return self._blocking_closures[node]
+
+    def get_successors(self, node: int) -> np.ndarray:
+        return self.succ_indices[self.succ_indptr[node]:self.succ_indptr[node + 1]]
+
+    def get_predecessors(self, node: int) -> np.ndarray:
+        return self.pred_indices[self.pred_indptr[node]:self.pred_indptr[node + 1]]
+
+    def _get_descendants(self, sources: typing.Iterable[int]) -> typing.List[bool]:
+        """
+        Returns a flag list of nodes reachable from any of the sources by at least one edge
+        """
+        reached = [False] * self.number_of_nodes
+        stack = []
+        for source in sources:
+            stack.extend(self._successors[source])
+        while stack:
+            node = stack.pop()
+            if not reached[node]:
+                reached[node] = True
+                stack.extend(self._successors[node])
+        return reached
+
+    def simulate_pull(self, should_block: typing.Callable[[str], typing.Tuple[bool, list]]) -> SnapshotPullResult:
+        """
+        Simulates a pull with the same outcome as the breadth first search of DomainHierarchyMABControlled.pull.
+        should_block: given a url, returns whether it is blocked and the rules that matched it (see should_block_2)
+        """
+        url_to_rules = dict()
+        for url_found in self._url_to_nodes:
+            is_blocked, matched_rules = should_block(url_found)
+            if is_blocked:
+                url_to_rules[url_found] = matched_rules
+
+        matched_nodes = self._get_reachable_url_nodes(url_to_rules)
+        matched_mask = self._to_bitset(matched_nodes)
+        closures_mask = 0
+        for node in matched_nodes:
+            closures_mask |= self.get_blocking_closure(node)
+
+        return self._simulate_pull_from_masks(url_to_rules, matched_nodes, matched_mask, closures_mask)
+
+    def get_rule_matches(self, filter_rules: typing.List[str]) -> typing.Dict[str, "RuleMatches"]:
+        """
+        Returns the url nodes matched by each of the filter rules, memoized per rule.
+        Rules that are not memoized yet are matched together in one pass over the urls.
+        """
+        missing_rules = [r for r in dict.fromkeys(filter_rules) if r not in self._rule_matches]
+        if missing_rules:
+            parser = get_adblock_rules(missing_rules)
+            rule_to_urls = {r: [] for r in missing_rules}
+            rule_to_adblock_rule = dict()
+            for url_found in self._url_to_nodes:
+                is_blocked, matched_rules = parser.should_block_2(url_found)
+                if is_blocked:
+                    for adblock_rule in matched_rules:
+                        rule_to_urls[adblock_rule.raw_rule_text].append(url_found)
+                        rule_to_adblock_rule[adblock_rule.raw_rule_text] = adblock_rule
+
+            for rule in missing_rules:
+                matched_nodes = self._get_reachable_url_nodes(rule_to_urls[rule])
+                closures_mask = 0
+                for node in matched_nodes:
+                    closures_mask |= self.get_blocking_closure(node)
+                self._rule_matches[rule] = RuleMatches(rule_to_adblock_rule.get(rule),
+                                                       tuple(rule_to_urls[rule]),
+                                                       self._to_bitset(matched_nodes),
+                                                       closures_mask)
+
+        return {r: self._rule_matches[r] for r in filter_rules}
+
+    def add_rule_matches(self, rule_matches: typing.Dict[str, "RuleMatches"]):
+        """
+        Memoizes rule matches found elsewhere, like in a forked worker over the same snapshot
+        """
+        for rule, rule_match in rule_matches.items():
+            self._rule_matches.setdefault(rule, rule_match)
+
+    def simulate_pull_for_rules(self, filter_rules: typing.List[str]) -> SnapshotPullResult:
+        """
+        Same as simulate_pull with the parser of filter_rules, but composed from the memoized matches of each rule.
+        This only holds for blocking rules, so whitelist rules go through simulate_pull.
+        """
+        if any(r.startswith("@@") for r in filter_rules):
+            return self.simulate_pull(get_adblock_rules(filter_rules).should_block_2)
+
+        rule_matches = self.get_rule_matches(filter_rules)
+        url_to_rules = dict()
+        matched_mask = 0
+        closures_mask = 0
+        # matched rules of an url follow the order of filter_rules, like the parser does
+        for rule in filter_rules:
+            rule_match = rule_matches[rule]
+            for url_found in rule_match.urls:
+                url_to_rules.setdefault(url_found, []).append(rule_match.adblock_rule)
+            matched_mask |= rule_match.matched_mask
+            closures_mask |= rule_match.closures_mask
+
+        matched_nodes = self._get_reachable_url_nodes(url_to_rules)
+        return self._simulate_pull_from_masks(url_to_rules, matched_nodes, matched_mask, closures_mask)
+
+    def _get_reachable_url_nodes(self, urls: typing.Iterable[str]) -> typing.List[int]:
+        matched_nodes = []
+        for url_found in urls:
+            matched_nodes += [n for n in self._url_to_nodes[url_found] if self._is_reachable[n]]
+        return matched_nodes
+
+    def _simulate_pull_from_masks(self, url_to_rules: dict, matched_nodes: typing.List[int],
+                                  matched_mask: int, closures_mask: int) -> SnapshotPullResult:
+        """
+        The outcome is computed by OR-ing the blocking closures of the matched url nodes.
+        We fall back to the breadth first search when a matched node is within the closure of another matched node
+        or when an ad node that is not an iframe is within the closures, since the closures cannot express those cases.
+        url_to_rules: blocked urls to the rules that matched them
+        """
+        if closures_mask & (matched_mask | self._counted_ad_non_iframe_mask):
+            return self._simulate_pull_bfs(url_to_rules)
+
+        removed_mask = matched_mask | closures_mask
+        block_items_and_match = dict()
+        seen_records = set()
+        for node in sorted(matched_nodes, key=self._bfs_rank.__getitem__):
+            url_found = self.urls[node]
+            _add_block_records(block_items_and_match, seen_records, url_found, url_to_rules[url_found])
+
+        # the root is never counted nor blocked
+        blocked_mask = (removed_mask | self._unreachable_mask) & ~self._root_mask
+        return SnapshotPullResult(ad_counter=_popcount(self._counted_ad_mask & ~removed_mask),
+                                  image_counter=_popcount(self._counted_image_mask & ~removed_mask),
+                                  textnode_counter=_popcount(self._counted_textnode_mask & ~removed_mask),
+                                  block_items_and_match=block_items_and_match,
+                                  ads_blocked=bool(blocked_mask & self._ad_category_mask),
+                                  images_blocked=bool(blocked_mask & self._image_category_mask),
+                                  textnodes_blocked=bool(blocked_mask & self._textnode_category_mask))
+
+    def _simulate_pull_bfs(self, url_to_rules: dict) -> SnapshotPullResult:
+        """
+        Does a breadth first search from the root, the same way DomainHierarchyMABControlled.pull does.
+        url_to_rules: blocked urls to the rules that matched them
+        """
+        is_ad = self._is_ad
+        is_image = self._is_image
+        is_textnode = self._is_textnode
+        is_iframe = self._is_iframe
+        urls = self.urls
+        allowed_successors = self._allowed_successors
+        root = self.root
+
+        ad_counter = 0
+        image_counter = 0
+        textnode_counter = 0
+
+        block_items_and_match = dict()
+        seen_records = set()
+
+        visited = [False] * self.number_of_nodes
+        iframe_nodes = []
+        img_nodes_not_blocked = []
+        text_nodes_not_blocked = []
+        explicit_blocked_nodes = []
+
+        node_queue = collections.deque([root])
+        while node_queue:
+            tmp_node = node_queue.popleft()
+            if visited[tmp_node]:
+                continue
+
+            url_found = urls[tmp_node]
+            matched_rules = url_to_rules.get(url_found) if url_found else None
+
+            if matched_rules is not None:
+                _add_block_records(block_items_and_match, seen_records, url_found, matched_rules)
+                explicit_blocked_nodes.append(tmp_node)
+            else:
+                if tmp_node != root:
+                    if is_iframe[tmp_node]:
+                        # for iframe nodes, we need to check later
+                        iframe_nodes.append(tmp_node)
+                    else:
+                        if is_ad[tmp_node]:
+                            ad_counter += 1
+                        if is_image[tmp_node]:
+                            image_counter += 1
+                            img_nodes_not_blocked.append(tmp_node)
+                        if is_textnode[tmp_node]:
+                            textnode_counter += 1
+                            text_nodes_not_blocked.append(tmp_node)
+
+                for s in allowed_successors[tmp_node]:
+                    if not visited[s]:
+                        node_queue.append(s)
+
+            visited[tmp_node] = True
+
+        # a node has a blocked ancestor if it is reachable from an explicitly blocked node.
+        # Nodes that get blocked afterwards are themselves descendants of those, so this is the same
+        # as checking ancestors against the growing set of blocked nodes.
+        has_blocked_ancestor = self._get_descendants(explicit_blocked_nodes) if explicit_blocked_nodes else None
+
+        blocked_by_ancestor = []
+        for node in iframe_nodes:
+            if has_blocked_ancestor and has_blocked_ancestor[node]:
+                blocked_by_ancestor.append(node)
+            else:
+                ad_counter += is_ad[node]
+                image_counter += is_image[node]
+                textnode_counter += is_textnode[node]
+
+        if has_blocked_ancestor:
+            for node in img_nodes_not_blocked:
+                if has_blocked_ancestor[node]:
+                    blocked_by_ancestor.append(node)
+                    image_counter -= 1
+            for node in text_nodes_not_blocked:
+                if has_blocked_ancestor[node]:
+                    blocked_by_ancestor.append(node)
+                    textnode_counter -= 1
+
+        # categorize blocked nodes, where nodes that are not visited are considered blocked as well
+        ads_blocked = False
+        images_blocked = False
+        textnodes_blocked = False
+        blocked_nodes_all = explicit_blocked_nodes + blocked_by_ancestor + \
+            [n for n in range(self.number_of_nodes) if not visited[n]]
+        for node in blocked_nodes_all:
+            if is_ad[node]:
+                ads_blocked = True
+            elif is_image[node]:
+                images_blocked = True
+            elif is_textnode[node]:
+                textnodes_blocked = True
+
+        return SnapshotPullResult(ad_counter=ad_counter,
+                                  image_counter=image_counter,
+                                  textnode_counter=textnode_counter,
+                                  block_items_and_match=block_items_and_match,
+                                  ads_blocked=ads_blocked,
+                                  images_blocked=images_blocked,
+                                  textnodes_blocked=textnodes_blocked)
@@ -1,26 +1,36 @@
+import array
 import collections
+import concurrent.futures
+import fnmatch
 import glob
 import json
 import logging
 import os.path
 import shutil
 import subprocess
+import tempfile
 import time
 import typing
 
 import networkx as nx
-from tldextract import tldextract
 
 from autofr.common.action_space_utils import ROOT_NODE_ID, TYPE_ESLD, TYPE_FQDN, TYPE_FQDN_PATH, \
     get_initiator_chain_log_entries
+from autofr.common.compression_utils import COMPRESSED_FILE_EXT, compress_file, get_output_file_path, \
+    glob_maybe_compressed, open_maybe_compressed, remove_compressed_ext
 from autofr.common.docker_utils import DATA_DIR_NAME, DOCKER_OUTPUT_PATH, HOST_MACHINE_OUTPUT_PATH, \
     IS_INSIDE_DOCKER
 from autofr.common.exceptions import MissingSnapshotException, BuildingSnapshotException, \
     MissingWebRequestFilesException, RootMissingException, SiteSnapshotException
+from autofr.common.json_stream_utils import JSONStreamReader
 from autofr.common.selenium_utils import CDP_CALLFRAMES, CDP_SCRIPTID, INITIATOR_KEY
-from autofr.common.utils import get_variations_of_domains, get_largest_file_from_path, \
+from autofr.common.utils import get_variations_of_domains, get_largest_file_from_path, extract_tld, \
     get_file_from_path_by_key, TOPFRAME, JSON_WEBREQUEST_KEY
 from autofr.rl.action_space import EDGE_TYPE
+from autofr.rl.controlled.snapshot_format import write_binary_snapshot, read_binary_snapshot, \
+    get_binary_snapshot_path, has_up_to_date_binary_snapshot, is_binary_snapshot_path, BinarySnapshotReader, \
+    get_infused_snapshot_path, get_files_fingerprint, read_graphml_snapshot
+from autofr.rl.controlled.snapshot_manifest import SnapshotManifest, get_manifest_path, read_snapshot_manifest
 
 INIT_ADGRAPH = "init_adgraph"
 ADGRAPH_NETWORKX = "adgraph_networkx"
@@ -120,8 +130,8 @@ def clean_adgraph_parsing_dir():
     os.makedirs(get_adgraph_mapping_dir())
 
 
-def copy_adgraph_as_parsed_log(dir_name: str, file_path: str):
-    output_dir = get_adgraph_data_dir() + os.sep + dir_name
+def copy_adgraph_as_parsed_log(dir_name: str, file_path: str, data_dir: str = None):
+    output_dir = (data_dir or get_adgraph_data_dir()) + os.sep + dir_name
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir, exist_ok=True)
 
@@ -131,9 +141,12 @@ def copy_adgraph_as_parsed_log(dir_name: str, file_path: str):
     shutil.copyfile(file_path, output_dir + os.sep + new_file_name)
 
 
-def run_adgraphapi() -> subprocess.CompletedProcess:
+def run_adgraphapi(base_dir: str = None) -> subprocess.CompletedProcess:
+    """
+    base_dir: absolute directory holding the data, features and mapping directories, defaults to get_adgraph_base_dir
+    """
     params = ["./adgraph-buildgraph",
-              "base_dir" + os.sep,
+              (base_dir or "base_dir") + os.sep,
               "data" + os.sep,
               "features" + os.sep,
               "mapping" + os.sep,
@@ -143,6 +156,67 @@ def run_adgraphapi() -> subprocess.CompletedProcess:
     return process
 
 
+def get_parsed_adgraph_dir_name(adgraph_raw_file_path: str) -> str:
+    """
+    Directory that adgraph-buildgraph parses the stitched raw adgraph from, which names the site snapshot too
+    """
+    return "snapshot_" + os.path.basename(remove_compressed_ext(adgraph_raw_file_path))[:-len(".json")]
+
+
+class AdgraphWorkspace:
+    """
+    Scratch base_dir for one adgraphapi run, so that conversions do not share get_adgraph_base_dir and
+    can run at the same time. The directory is removed when leaving the context, even on errors.
+
+    Example:
+        with AdgraphWorkspace() as workspace:
+            workspace.copy_adgraph_as_parsed_log(dir_name, stitched_adgraph_file)
+            p = workspace.run_adgraphapi()
+            parsed_file_path = workspace.get_parsed_file_path(dir_name)
+    """
+
+    def __init__(self, root_dir: str = None):
+        """
+        root_dir: where the workspace directory is created, defaults to the temporary directory
+        """
+        self.root_dir = root_dir
+        self.base_dir: typing.Optional[str] = None
+
+    def __enter__(self) -> "AdgraphWorkspace":
+        if self.root_dir:
+            os.makedirs(self.root_dir, exist_ok=True)
+        self.base_dir = os.path.abspath(tempfile.mkdtemp(prefix="adgraph_workspace_", dir=self.root_dir))
+        for dir_path in (self.get_data_dir(), self.get_features_dir(), self.get_mapping_dir()):
+            os.makedirs(dir_path)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.clean_up()
+
+    def get_data_dir(self) -> str:
+        return self.base_dir + os.sep + DATA_DIR_NAME
+
+    def get_features_dir(self) -> str:
+        return self.base_dir + os.sep + "features"
+
+    def get_mapping_dir(self) -> str:
+        return self.base_dir + os.sep + "mapping"
+
+    def get_parsed_file_path(self, dir_name: str) -> str:
+        return self.get_mapping_dir() + os.sep + dir_name + ".json"
+
+    def copy_adgraph_as_parsed_log(self, dir_name: str, file_path: str):
+        copy_adgraph_as_parsed_log(dir_name, file_path, data_dir=self.get_data_dir())
+
+    def run_adgraphapi(self) -> subprocess.CompletedProcess:
+        return run_adgraphapi(base_dir=self.base_dir)
+
+    def clean_up(self):
+        if self.base_dir:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+            self.base_dir = None
+
+
 def is_node_data_annotated(node_data: dict, node_data_key: str) -> bool:
     return node_data and node_data_key in node_data and node_data[node_data_key].lower() == "true"
 
@@ -208,6 +282,33 @@ def has_non_dom_predecessor_edges(g: nx.DiGraph, node_str: str,
     return False
 
 
+def get_url_from_node_data(node_data: dict) -> typing.Optional[str]:
+    """
+    Returns the url that a snapshot node represents, if any
+    """
+    url_found = None
+    if REQUESTED_URL in node_data:
+        url_found = node_data[REQUESTED_URL]
+    if INFO in node_data and NODE_TYPE in node_data \
+            and node_data[NODE_TYPE] == "URL":
+        url_found = node_data[INFO]
+    return url_found
+
+
+def get_nodes_with_non_dom_predecessor_edges(g: nx.DiGraph) -> set:
+    """
+    Returns all nodes for which has_non_dom_predecessor_edges(g, node) is True, in linear time.
+    A node can reach its parent only if both are in the same strongly connected component,
+    so non-DOM edges within a component are the ones ignored as cycles.
+    """
+    component_of_node = nx.condensation(g).graph["mapping"]
+    nodes_found = set()
+    for parent, node, edge_data in g.edges(data=True):
+        if is_non_dom_edge(edge_data) and component_of_node[parent] != component_of_node[node]:
+            nodes_found.add(node)
+    return nodes_found
+
+
 def get_nodes_by_data_key(g: nx.DiGraph, node_key: str, node_value: typing.Any) -> list:
     """
     Given graph g, return nodes that have a certain node_key attribute with node_value
@@ -374,14 +475,14 @@ def get_main_raw_adgraph_file_path(input_directory: str, url: str) -> typing.Opt
             adgraph_dir_with_sld = input_directory + os.sep + dir
 
             main_file_path = get_largest_file_from_path(adgraph_dir_with_sld, "log*" + sld + "*.json",
-                                                        ignore=[TOPFRAME])
+                                                        ignore=[TOPFRAME], include_compressed=True)
             if main_file_path:
                 break
 
     # try last chance with input_directory
     if not main_file_path:
         main_file_path = get_largest_file_from_path(input_directory, "log*" + sld + "*.json",
-                                                    ignore=[TOPFRAME])
+                                                    ignore=[TOPFRAME], include_compressed=True)
 
     if not main_file_path:
         logger.warning(f"Could not find main raw adgraph for {input_directory}")
@@ -389,11 +490,25 @@ def get_main_raw_adgraph_file_path(input_directory: str, url: str) -> typing.Opt
     return main_file_path
 
 
-def convert_adgrahph_to_site_snapshot(adgraph_json_file_path: str, main_url: str, output_directory: str) \
-        -> typing.Tuple[nx.DiGraph, str]:
+def get_snapshot_unique_key(snapshot_file_path: str) -> typing.Optional[str]:
+    """
+    The key made from AdGraph based on time within the name of a site snapshot file,
+    which the raw files of the snapshot have in their names too
+    """
+    path_split = os.path.basename(remove_compressed_ext(snapshot_file_path)).split("_")
+    for path in reversed(path_split):
+        path_clean = path.replace(".graphml", "")
+        if len(path_clean) == SiteSnapshot.SNAPSHOT_UNIQUE_KEY_LEN:
+            return path_clean
+    return None
+
+
+def convert_adgrahph_to_site_snapshot(adgraph_json_file_path: str, main_url: str, output_directory: str,
+                                      compress: bool = None) -> typing.Tuple[nx.DiGraph, str]:
     """
     Converts the JSON parsed file into networkx digraph. Outputs as graphml file as well.
     Input MUST have already been parsed by adgraph-buildgraph
+    compress: write the graphml file and the parsed file gzip compressed, defaults to COMPRESS_OUTPUTS
     """
 
     def _is_adgraph_root_node(node: dict) -> bool:
@@ -411,33 +526,40 @@ def convert_adgrahph_to_site_snapshot(adgraph_json_file_path: str, main_url: str
     nodes_to_remove = []
     # find root node to link virtual root later
     adgraph_root_nodes = []
-    with open(adgraph_json_file_path) as adgraph_file:
-        adgraph_JSON = json.load(adgraph_file)
-
-        nodes_with_types = []
-        for node in adgraph_JSON["nodes"]:
-            node[NODE_TYPE] = node["id"].split("_")[0]
-            if node[NODE_TYPE] in [SNAPSHOT_NODE__URL, SNAPSHOT_NODE__SCRIPT]:
-                tld_result = tldextract.extract(node["info"])
-                node["sld"] = tld_result.domain + "." + tld_result.suffix
-                node["is_main_site"] = root == node["sld"]
-                node["root"] = "false"
-                # remove data only
-                if should_skip_node(node["info"]):
-                    nodes_to_remove.append(node["id"])
-            else:
-                if _is_adgraph_root_node(node):
-                    adgraph_root_nodes.append((node["id"], int(node["id"].split("_")[1])))
-                elif not is_frg_annotated(node):
-                    nodes_to_remove.append(node["id"])
-
-            nodes_with_types.append(node)
-
-        nodes = [(x["id"], x) for x in nodes_with_types]
-        g.add_nodes_from(nodes)
-
-        for edge_data in adgraph_JSON["links"]:
-            g.add_edge(edge_data["source"], edge_data["target"], edge_type=edge_data["edge_type"])
+    # nodes and links are read one at a time, so the JSON file is never held in memory as a whole
+    with JSONStreamReader(adgraph_json_file_path) as adgraph_reader:
+        # links that come before the nodes in the file are only added after the nodes, to keep the node order
+        links_before_nodes = []
+        nodes_added = False
+        for key, values in adgraph_reader.iter_object(stream_keys=["nodes", "links"]):
+            if key == "nodes":
+                for node in values:
+                    node[NODE_TYPE] = node["id"].split("_")[0]
+                    if node[NODE_TYPE] in [SNAPSHOT_NODE__URL, SNAPSHOT_NODE__SCRIPT]:
+                        tld_result = extract_tld(node["info"])
+                        node["sld"] = tld_result.domain + "." + tld_result.suffix
+                        node["is_main_site"] = root == node["sld"]
+                        node["root"] = "false"
+                        # remove data only
+                        if should_skip_node(node["info"]):
+                            nodes_to_remove.append(node["id"])
+                    else:
+                        if _is_adgraph_root_node(node):
+                            adgraph_root_nodes.append((node["id"], int(node["id"].split("_")[1])))
+                        elif not is_frg_annotated(node):
+                            nodes_to_remove.append(node["id"])
+
+                    g.add_node(node["id"], **node)
+                nodes_added = True
+                for source, target, edge_type in links_before_nodes:
+                    g.add_edge(source, target, edge_type=edge_type)
+                links_before_nodes = []
+            elif key == "links":
+                for edge_data in values:
+                    if nodes_added:
+                        g.add_edge(edge_data["source"], edge_data["target"], edge_type=edge_data["edge_type"])
+                    else:
+                        links_before_nodes.append((edge_data["source"], edge_data["target"], edge_data["edge_type"]))
 
         #logger.debug("Built new graph from adgraph data: nodes %d, edges %d",
         #             g.number_of_nodes(),
@@ -459,12 +581,18 @@ def convert_adgrahph_to_site_snapshot(adgraph_json_file_path: str, main_url: str
             if node != root_key:
                 g.add_edge(root_key, node, edge_type=SNAPSHOT_EDGE__VIRTUAL)
 
-    base_name_no_ext = os.path.basename(adgraph_json_file_path)[:-len(".json")] + ".graphml"
+    base_name_no_ext = os.path.basename(remove_compressed_ext(adgraph_json_file_path))[:-len(".json")] + ".graphml"
     os.makedirs(output_directory, exist_ok=True)
-    nx.write_graphml(g, output_directory + os.sep + base_name_no_ext)
+    # networkx compresses the graphml file when its name ends with .gz
+    graphml_file_path = get_output_file_path(output_directory + os.sep + base_name_no_ext, compress=compress)
+    nx.write_graphml(g, graphml_file_path)
+    # binary version that is much faster to read back, see SiteSnapshot._read_snapshot
+    write_binary_snapshot(g, get_binary_snapshot_path(graphml_file_path))
     logger.info(f"Copying processed site snapshot from {adgraph_json_file_path} to {output_directory}")
-    shutil.copy2(adgraph_json_file_path, output_directory)
-    return g, base_name_no_ext
+    copied_file_path = shutil.copy2(adgraph_json_file_path, output_directory)
+    if graphml_file_path.endswith(COMPRESSED_FILE_EXT):
+        compress_file(copied_file_path)
+    return g, os.path.basename(graphml_file_path)
 
 
 def has_path_to_ads_without_script_used_by_edge(script_node_id: str,
@@ -495,6 +623,295 @@ def has_path_to_ads_without_script_used_by_edge(script_node_id: str,
 
     return False
 
+
+# event types that stitching cares about, see AdgraphTimelineIndex
+_EVENT_OTHER = 0
+_EVENT_NODE_INSERTION = 1
+_EVENT_NODE_REMOVAL = 2
+# a reference to an event of the stitched timeline is (timeline index << _EVENT_INDEX_BITS) | event index,
+# while a negative reference -(i + 1) is the i-th flg-ad event added by stitching
+_EVENT_INDEX_BITS = 32
+_EVENT_INDEX_MASK = (1 << _EVENT_INDEX_BITS) - 1
+
+
+def _get_adgraph_iframe_node_id(timeline_event: typing.Any) -> typing.Optional[str]:
+    if "event_type" in timeline_event and timeline_event["event_type"] == "NodeInsertion":
+        if "tag_name" in timeline_event and timeline_event["tag_name"].lower() == "iframe":
+            return timeline_event["node_id"]
+    return None
+
+
+def _adgraph_event_has_ad(timeline_event: typing.Any) -> bool:
+    """
+    Whether a NodeInsertion event has the CITP_isAnAd class, e.g. "attr_value": "CITP_adBlockerCover ByURL CITP_isAnAd"
+    """
+    if "event_type" in timeline_event and timeline_event["event_type"] == "NodeInsertion":
+        if "node_attributes" in timeline_event and len(timeline_event["node_attributes"]) > 0:
+            for node_attr in timeline_event["node_attributes"]:
+                if node_attr["attr_name"] == "class" and "CITP_isAnAd" in node_attr["attr_value"]:
+                    return True
+    return False
+
+
+def _create_adgraph_flg_ad_event(node_id: str, actor_id: str = "0") -> dict:
+    return {"actor_id": actor_id,
+            "node_id": node_id,
+            "event_type": "AttrAddition",
+            "node_attribute": {"event_type": "NodeAttribute", "attr_name": FLG_AD, "attr_value": "true"}}
+
+
+class AdgraphTimelineIndex:
+    """
+    What stitching needs to know about the timeline of a raw adgraph file, read in one event at a time:
+    the node id and type of every event, the iframes and ads found and the top-level values besides the timeline.
+    Events themselves are not kept, see AdgraphTimelineReader.
+    """
+
+    def __init__(self, file_path: str, node_id_curr: str = None, keep_values: bool = True):
+        """
+        node_id_curr: iframe node that the timeline is stitched into, None for the main timeline
+        keep_values: whether to keep all top-level values, otherwise only the url is kept
+        """
+        self.file_path = file_path
+        self.node_id_curr = node_id_curr
+        # top-level values in file order, the timeline is only a placeholder
+        self.values: typing.Dict[str, typing.Any] = dict()
+        self.node_ids: typing.List[typing.Optional[str]] = []
+        self.event_types = bytearray()
+        # node id to the index of its last event
+        self.last_event_indexes: typing.Dict[str, int] = dict()
+        # event index to the node id of events with the html tag
+        self.html_node_ids: typing.Dict[int, int] = dict()
+        self.first_html_node_id = -1
+        self.first_html_event_index = -1
+        # iframe node ids in the order they were inserted
+        self.iframe_node_ids: typing.List[str] = []
+        self.has_ads = False
+        # the parent of the top nodes of an iframe timeline, replaced by node_id_curr when stitching
+        self.wrong_node_parent_id = None
+
+        with JSONStreamReader(file_path) as reader:
+            for key, value in reader.iter_object(stream_keys=["timeline"]):
+                if key == "timeline":
+                    self.values[key] = None
+                    for event in value:
+                        self._add_event(event)
+                elif keep_values or key == "url":
+                    self.values[key] = value
+
+    def _add_event(self, event: dict):
+        index = len(self.node_ids)
+        if self.node_id_curr is not None and not self.wrong_node_parent_id and "node_parent_id" in event:
+            self.wrong_node_parent_id = event["node_parent_id"]
+
+        node_id = event.get("node_id")
+        self.node_ids.append(node_id)
+        if node_id is not None:
+            self.last_event_indexes[node_id] = index
+        event_type = event.get("event_type")
+        if event_type == "NodeInsertion":
+            self.event_types.append(_EVENT_NODE_INSERTION)
+        elif event_type == "NodeRemoval":
+            self.event_types.append(_EVENT_NODE_REMOVAL)
+        else:
+            self.event_types.append(_EVENT_OTHER)
+
+        if "tag_name" in event and event["tag_name"].lower() == "html" and "node_id" in event:
+            self.html_node_ids[index] = int(event["node_id"])
+            if self.first_html_node_id == -1:
+                self.first_html_node_id = self.html_node_ids[index]
+                self.first_html_event_index = index
+
+        if _adgraph_event_has_ad(event):
+            self.has_ads = True
+        iframe_node_id = _get_adgraph_iframe_node_id(event)
+        if iframe_node_id is not None:
+            self.iframe_node_ids.append(iframe_node_id)
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+
+class AdgraphTimelineReader:
+    """
+    Reads the events of an indexed timeline again, in order, fixing the node parent of iframe timelines
+    """
+
+    def __init__(self, timeline_index: AdgraphTimelineIndex):
+        self.timeline_index = timeline_index
+        self._reader: typing.Optional[JSONStreamReader] = None
+        self._items: typing.Optional[typing.Iterator] = None
+        self._events: typing.Optional[typing.Iterator[dict]] = None
+        self._next_index = 0
+
+    def get_event(self, index: int) -> dict:
+        """
+        Events must be asked for in increasing order, the ones in between are skipped
+        """
+        if self._reader is None:
+            self._reader = JSONStreamReader(self.timeline_index.file_path)
+            self._items = self._reader.iter_object(stream_keys=["timeline"])
+            self._events = iter(())
+            for key, value in self._items:
+                if key == "timeline":
+                    self._events = value
+                    break
+
+        while self._next_index < index:
+            next(self._events)
+            self._next_index += 1
+        event = next(self._events)
+        self._next_index += 1
+
+        wrong_node_parent_id = self.timeline_index.wrong_node_parent_id
+        if wrong_node_parent_id and "node_parent_id" in event and event["node_parent_id"] == wrong_node_parent_id:
+            event["node_parent_id"] = self.timeline_index.node_id_curr
+
+        if self._next_index == len(self.timeline_index):
+            self.close()
+        return event
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._events = iter(())
+
+
+class AdgraphFrameownerFiles:
+    """
+    Finds the raw adgraph file of an iframe like get_file_from_path_by_key(input_directory,
+    f"log*{frameowner}{node_id}*.json") does, but lists the directory only once.
+    """
+
+    def __init__(self, input_directory: str, frameowner: str):
+        self.input_directory = input_directory
+        self.frameowner = frameowner
+        # every prefix of what follows the frameowner in a file name to the file names that have it,
+        # since the glob matches node ids that are a prefix of another one too
+        self._file_names_by_prefix: typing.Dict[str, typing.List[str]] = collections.defaultdict(list)
+        file_names = set(os.listdir(input_directory))
+        for file_name in file_names:
+            # raw adgraphs may be gzip compressed, their names are matched without the .gz.
+            # Like glob_maybe_compressed, the uncompressed file wins when both are there
+            name = remove_compressed_ext(file_name)
+            if name != file_name and name in file_names:
+                continue
+            if not name.startswith("log") or not name.endswith(".json"):
+                continue
+            prefixes = set()
+            start = name.find(frameowner)
+            while start != -1:
+                rest = name[start + len(frameowner):]
+                for end in range(len(rest) + 1):
+                    prefixes.add(rest[:end])
+                start = name.find(frameowner, start + 1)
+            for prefix in prefixes:
+                self._file_names_by_prefix[prefix].append(file_name)
+
+    def get_file_path(self, node_id: str) -> typing.Optional[str]:
+        """
+        The most recent file of the iframe node, None if there is none
+        """
+        file_name_regex = f"log*{self.frameowner}{node_id}*.json"
+        if glob.has_magic(node_id):
+            return get_file_from_path_by_key(self.input_directory, file_name_regex, include_compressed=True)
+        # check the whole pattern, e.g. the node id must not overlap with the .json extension
+        file_paths = [self.input_directory + os.sep + f for f in self._file_names_by_prefix.get(node_id, [])
+                      if fnmatch.fnmatchcase(remove_compressed_ext(f), file_name_regex)]
+        if not file_paths:
+            return None
+        return max(file_paths, key=os.path.getmtime)
+
+
+class AdgraphStitchedTimeline:
+    """
+    The stitched timeline as a linked list of event references (see _EVENT_INDEX_BITS), so that
+    timelines are inserted and events removed in constant time per event.
+    Each entry also has an order label, increasing along the list, to tell which of two entries comes first
+    without walking the list.
+    """
+
+    # labels are spread over [0, _LABEL_MAX)
+    _LABEL_MAX = 1 << 62
+
+    def __init__(self):
+        self.event_refs = array.array("q")
+        self.next_entries = array.array("q")
+        self.previous_entries = array.array("q")
+        self.labels = array.array("q")
+        self.head = -1
+        self.tail = -1
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> typing.Iterator[int]:
+        """
+        Yields the entries in timeline order
+        """
+        entry = self.head
+        while entry != -1:
+            yield entry
+            entry = self.next_entries[entry]
+
+    def _relabel(self, extra: int):
+        spacing = self._LABEL_MAX // (self._length + extra + 1)
+        for number, entry in enumerate(self, 1):
+            self.labels[entry] = number * spacing
+
+    def insert_after(self, entry: int, event_refs: typing.Sequence[int]) -> int:
+        """
+        Inserts the event references after entry (at the start if entry is -1).
+        Returns the entry of the first one
+        """
+        count = len(event_refs)
+        first_entry = len(self.event_refs)
+        if count == 0:
+            return first_entry
+        next_entry = self.head if entry == -1 else self.next_entries[entry]
+
+        low = 0 if entry == -1 else self.labels[entry]
+        high = self._LABEL_MAX if next_entry == -1 else self.labels[next_entry]
+        if high - low <= count:
+            self._relabel(count)
+            low = 0 if entry == -1 else self.labels[entry]
+            high = self._LABEL_MAX if next_entry == -1 else self.labels[next_entry]
+        step = (high - low) // (count + 1)
+
+        last_entry = first_entry + count - 1
+        self.event_refs.extend(event_refs)
+        self.labels.extend(range(low + step, low + step * (count + 1), step))
+        self.next_entries.extend(range(first_entry + 1, last_entry + 2))
+        self.next_entries[last_entry] = next_entry
+        self.previous_entries.extend(range(first_entry - 1, last_entry))
+        self.previous_entries[first_entry] = entry
+
+        if entry == -1:
+            self.head = first_entry
+        else:
+            self.next_entries[entry] = first_entry
+        if next_entry == -1:
+            self.tail = last_entry
+        else:
+            self.previous_entries[next_entry] = last_entry
+        self._length += count
+        return first_entry
+
+    def remove(self, entry: int):
+        previous_entry = self.previous_entries[entry]
+        next_entry = self.next_entries[entry]
+        if previous_entry == -1:
+            self.head = next_entry
+        else:
+            self.next_entries[previous_entry] = next_entry
+        if next_entry == -1:
+            self.tail = previous_entry
+        else:
+            self.previous_entries[next_entry] = previous_entry
+        self._length -= 1
+
+
 class SiteSnapshot:
     # example key made from AdGraph based on time: 1655747065.993929
     SNAPSHOT_UNIQUE_KEY_LEN = 17
@@ -510,10 +927,20 @@ class SiteSnapshot:
                  snapshot_name: str = "",
                  base_name: str = "",
                  output_directory: str = "",
-                 site_snapshot_dir_name: str = ADGRAPH_NETWORKX):
+                 site_snapshot_dir_name: str = ADGRAPH_NETWORKX,
+                 parsed_adgraph_file_path: str = None,
+                 infused_snapshot_dir: str = None):
+        """
+        parsed_adgraph_file_path: adgraph_raw_file_path already stitched and parsed by adgraph-buildgraph,
+            see convert_raw_adgraph_files_in_batch
+        infused_snapshot_dir: where the callstack infused version of snapshot_nx_file_path is kept,
+            e.g. to share it between runs. Defaults to the snapshot directory of the output
+            (see get_base_site_snapshots_dir), the directory of snapshot_nx_file_path is only read.
+        """
         self.url = url
         # raw file that has not been processed
         self.adgraph_raw_file_path = adgraph_raw_file_path
+        self.parsed_adgraph_file_path = parsed_adgraph_file_path
         # snapshot file that has been processed already
         self.snapshot_nx_file_path = snapshot_nx_file_path
         self.base_name = base_name
@@ -522,96 +949,158 @@ class SiteSnapshot:
         # this is only used to output the site snapshot if we need to convert from raw adgraph to site snapshot
         # if snapshot_nx_file_path is given, then we basically ignore output_directory
         self.output_directory = output_directory
+        self.infused_snapshot_dir = infused_snapshot_dir
 
         # cache whether a node has a path to a ad node where the path has no SCRIPT_USED_BY edge
         self.node_to_ads_cache = dict()
 
-        if adgraph_raw_file_path is None and snapshot_nx_file_path is None:
+        if not self._has_snapshot_source():
             raise MissingSnapshotException(f"Raw file and snapshot file cannot both be None")
 
         self._snapshot: nx.DiGraph = None
+        # array-backed version of the snapshot, built lazily for pulls
+        self._compiled_snapshot = None
+        # nodes that have a non-DOM parent which is not part of a cycle, built lazily
+        self._nodes_with_non_dom_parent: typing.Optional[set] = None
+        # url type to the url variations found in the graph
+        self._url_variation_index: typing.Optional[typing.Dict[str, set]] = None
+        # whether the callstack is already part of the snapshot, see _read_infused_snapshot
+        self._is_callstack_infused = False
+        # callstack files of the snapshot, found once
+        self._callstack_files: typing.Optional[list] = None
+        # path of the snapshot file written when converting from the raw file
+        self._converted_snapshot_file_path: typing.Optional[str] = None
+        # manifest of the snapshot file, its paths to the raw files save us from globbing for them
+        self._manifest: typing.Optional[SnapshotManifest] = None
+        if snapshot_nx_file_path:
+            self._manifest = read_snapshot_manifest(snapshot_nx_file_path)
         # read in snapshot if available
         self._read_snapshot()
         # or process the raw file into a snapshot file
         self._convert_into_snapshot_file()
         # infuse callstack into snapshot
         self._infuse_call_stack_to_snapshot()
+        # index url variations for has_url_variation_in_graph
+        self.get_url_variation_index()
+
+    def _has_snapshot_source(self) -> bool:
+        """
+        Whether there is something to read the snapshot from, see CorpusSiteSnapshot for snapshots without files
+        """
+        return self.adgraph_raw_file_path is not None or self.snapshot_nx_file_path is not None
 
     def _read_snapshot(self):
-        # read in snapshot file
+        # read in snapshot file, preferring its callstack infused version and then its binary version
         if self.snapshot_nx_file_path:
-            self._snapshot = nx.read_graphml(self.snapshot_nx_file_path)
+            if self._read_infused_snapshot():
+                self._is_callstack_infused = True
+            elif is_binary_snapshot_path(self.snapshot_nx_file_path):
+                self._snapshot = read_binary_snapshot(self.snapshot_nx_file_path)
+            elif has_up_to_date_binary_snapshot(self.snapshot_nx_file_path):
+                self._snapshot = read_binary_snapshot(get_binary_snapshot_path(self.snapshot_nx_file_path))
+            else:
+                self._snapshot = read_graphml_snapshot(self.snapshot_nx_file_path)
             if not self.snapshot_name:
                 self.snapshot_name = os.path.basename(self.snapshot_nx_file_path)
 
     def _convert_into_snapshot_file(self):
         if self._snapshot is None and self.adgraph_raw_file_path:
+            self._convert_raw_adgraph()
+            # summarize the new snapshot file for corpus scans once its callstack is infused, see snapshot_manifest
+            self._infuse_call_stack_to_snapshot()
+            self.write_manifest()
 
-            # get name based on file name but remove extension
-            self.snapshot_name = os.path.basename(self.adgraph_raw_file_path)[:-len(".json")]
-
-            # first stitch together multiple raw files for one given site
-            input_dir = os.path.dirname(self.adgraph_raw_file_path)
-            stitched_adgraph_file = self.stitch_adgraphs(input_dir, self.url)
-
-            if not os.path.isfile(stitched_adgraph_file):
-                raise MissingSnapshotException(f"Could not find stitched file {stitched_adgraph_file}")
-
-            # copy the stitched file to adgraphapi to be processed
-            clean_adgraph_parsing_dir()
-            # copy files to data dir ready to be processed
-            dir_name = f"snapshot_{self.snapshot_name}"
-            copy_adgraph_as_parsed_log(dir_name, stitched_adgraph_file)
-
-            # delete the stitched file, no longer need it
-            os.remove(stitched_adgraph_file)
-
-            # run adgraphpi
-            p = run_adgraphapi()
-            if p.returncode == 0:
-                parsed_file_path = get_adgraph_mapping_dir() + os.sep + dir_name + ".json"
-                adgraph_nx_g, g_name = convert_adgrahph_to_site_snapshot(parsed_file_path,
-                                                                         self.url,
-                                                                         self.get_base_site_snapshots_dir())
-                self._snapshot = adgraph_nx_g
-                if not self.snapshot_name:
-                    self.snapshot_name = g_name
-            else:
-                raise BuildingSnapshotException(
-                    f"Could not convert adgraph file {self.adgraph_raw_file_path} into a SiteSnapshot")
+    def _convert_raw_adgraph(self):
+        """
+        Converts adgraph_raw_file_path (or its parsed_adgraph_file_path) into a snapshot file in the output
+        """
+        # get name based on file name but remove extension
+        self.snapshot_name = os.path.basename(remove_compressed_ext(self.adgraph_raw_file_path))[:-len(".json")]
 
-    def _find_individual_init_adgraph_dir(self) -> typing.Optional[str]:
+        if self.parsed_adgraph_file_path:
+            if not os.path.isfile(self.parsed_adgraph_file_path):
+                raise BuildingSnapshotException(
+                    f"Could not find parsed adgraph file {self.parsed_adgraph_file_path} for {self.adgraph_raw_file_path}")
+            self._convert_parsed_adgraph(self.parsed_adgraph_file_path)
+            return
+
+        # first stitch together multiple raw files for one given site
+        input_dir = os.path.dirname(self.adgraph_raw_file_path)
+        stitched_adgraph_file = self.stitch_adgraphs(input_dir, self.url)
+
+        if not os.path.isfile(stitched_adgraph_file):
+            raise MissingSnapshotException(f"Could not find stitched file {stitched_adgraph_file}")
+
+        # parse the stitched file with adgraphapi in a workspace of its own
+        dir_name = get_parsed_adgraph_dir_name(self.adgraph_raw_file_path)
+        try:
+            with AdgraphWorkspace() as workspace:
+                # copy files to data dir ready to be processed
+                workspace.copy_adgraph_as_parsed_log(dir_name, stitched_adgraph_file)
+
+                # delete the stitched file, no longer need it
+                os.remove(stitched_adgraph_file)
+
+                # run adgraphpi
+                p = workspace.run_adgraphapi()
+                if p.returncode != 0:
+                    raise BuildingSnapshotException(
+                        f"Could not convert adgraph file {self.adgraph_raw_file_path} into a SiteSnapshot")
+
+                self._convert_parsed_adgraph(workspace.get_parsed_file_path(dir_name))
+        finally:
+            if os.path.isfile(stitched_adgraph_file):
+                os.remove(stitched_adgraph_file)
+
+    def _convert_parsed_adgraph(self, parsed_file_path: str):
+        adgraph_nx_g, g_name = convert_adgrahph_to_site_snapshot(parsed_file_path,
+                                                                 self.url,
+                                                                 self.get_base_site_snapshots_dir())
+        self._snapshot = adgraph_nx_g
+        self._converted_snapshot_file_path = self.get_base_site_snapshots_dir() + os.sep + g_name
+        if not self.snapshot_name:
+            self.snapshot_name = g_name
+
+    @classmethod
+    def stitch_raw_adgraph(cls, url: str, adgraph_raw_file_path: str) -> str:
         """
-        TODO: rewrite this or just make the caller pass in the necessary directory
-        Brittle code to find init_adgraph_dir. Each site snapshot is held in an individual folder for INIT_ADGRAPH.
-        Find the directory based on the given self.adgraph_raw_file_path or self.snapshot_nx_file_path
+        Stitches the raw adgraphs of the site without converting them, see convert_raw_adgraph_files_in_batch.
+        Returns the file path of the stitched adgraph file
+        """
+        # stitching only depends on class level constants, so there is no need to build a site snapshot
+        site_snapshot = cls.__new__(cls)
+        stitched_adgraph_file = site_snapshot.stitch_adgraphs(os.path.dirname(adgraph_raw_file_path), url)
+        if not os.path.isfile(stitched_adgraph_file):
+            raise MissingSnapshotException(f"Could not find stitched file {stitched_adgraph_file}")
+        return stitched_adgraph_file
+
+    def _find_raw_adgraph_file_path(self) -> typing.Optional[str]:
+        """
+        Brittle code to find the raw adgraph file within an INIT_ADGRAPH directory.
+        Find the file based on the given self.adgraph_raw_file_path or self.snapshot_nx_file_path
         """
         init_adgraph_dir = None
         if self.adgraph_raw_file_path:
             # we don't need to do more work like from snapshots because the raw adgraph file lies within the init dir that we want already
             init_adgraph_dir = self.adgraph_raw_file_path
+        elif self._manifest and self._manifest.raw_adgraph_file:
+            init_adgraph_dir = self._manifest.get_raw_adgraph_file_path()
         elif self.snapshot_nx_file_path:
             # identify path until we found the top-level SiteSnapshot.SNAPSHOT_DIRECTORY_PARTIAL
             top_level_dir = self.snapshot_nx_file_path
             while SiteSnapshot.SNAPSHOT_DIRECTORY_PARTIAL not in os.path.basename(top_level_dir):
                 top_level_dir = os.path.dirname(top_level_dir)
-            path_split = os.path.basename(self.snapshot_nx_file_path).split("_")
 
             # find the snapshot_unique_key
-            snapshot_unique_key = None
-            for path in reversed(path_split):
-                path_clean = path.replace(".graphml", "")
-                if len(path_clean) == SiteSnapshot.SNAPSHOT_UNIQUE_KEY_LEN:
-                    snapshot_unique_key = path_clean
-                    break
-
+            snapshot_unique_key = get_snapshot_unique_key(self.snapshot_nx_file_path)
             if not snapshot_unique_key:
                 raise MissingSnapshotException(
-                    f"Expected key length to be {SiteSnapshot.SNAPSHOT_UNIQUE_KEY_LEN} from path {path_split}")
+                    f"Expected key length to be {SiteSnapshot.SNAPSHOT_UNIQUE_KEY_LEN} "
+                    f"from path {os.path.basename(self.snapshot_nx_file_path)}")
 
             # use it to get where the raw adgraph file is location is
-            adgraph_raw_file_paths = glob.glob(top_level_dir + os.sep + "**" + os.sep + f"*{snapshot_unique_key}*.json",
-                                               recursive=True)
+            adgraph_raw_file_paths = glob_maybe_compressed(
+                top_level_dir + os.sep + "**" + os.sep + f"*{snapshot_unique_key}*.json", recursive=True)
 
             # if we find multiple, just find at least one file with INIT_ADGRAPH
             if len(adgraph_raw_file_paths) > 0:
@@ -620,6 +1109,15 @@ class SiteSnapshot:
                         init_adgraph_dir = f
                         break
 
+        return init_adgraph_dir
+
+    def _find_individual_init_adgraph_dir(self) -> typing.Optional[str]:
+        """
+        TODO: rewrite this or just make the caller pass in the necessary directory
+        Brittle code to find init_adgraph_dir. Each site snapshot is held in an individual folder for INIT_ADGRAPH.
+        Find the directory based on the given self.adgraph_raw_file_path or self.snapshot_nx_file_path
+        """
+        init_adgraph_dir = self._find_raw_adgraph_file_path()
         if init_adgraph_dir:
             # keep looping until we find the directory with INIT_ADGRAPH as the os.path.basename
             while os.path.basename(init_adgraph_dir) and INIT_ADGRAPH not in os.path.basename(init_adgraph_dir):
@@ -632,12 +1130,23 @@ class SiteSnapshot:
         """
         Brittle code to find callstack files within the AdGraph_Snapshots directory
         """
+        if self._callstack_files is None:
+            if self._manifest and self._manifest.callstack_files and \
+                    all(os.path.isfile(f) for f in self._manifest.get_callstack_file_paths()):
+                self._callstack_files = self._manifest.get_callstack_file_paths()
+            else:
+                self._callstack_files = self._glob_callstack_files()
+        return self._callstack_files
+
+    def _glob_callstack_files(self) -> typing.Optional[list]:
+        """
+        Lists the callstack files (which are webrequests files) within the init_adgraph dir, sorted
+        """
         init_adgraph_dir = self._find_individual_init_adgraph_dir()
         if init_adgraph_dir:
-            # now we can find the callstack files (which are webrequests files)
-            callstack_files = glob.glob(init_adgraph_dir + os.sep + "**" + os.sep + f"*{JSON_WEBREQUEST_KEY}.json",
-                                        recursive=True)
-            return callstack_files
+            return sorted(glob_maybe_compressed(
+                init_adgraph_dir + os.sep + "**" + os.sep + f"*{JSON_WEBREQUEST_KEY}.json", recursive=True))
+        return None
 
     def _infuse_callstack_entry_to_snapshot(self, entry: dict, url_to_script_nodes: dict) -> int:
         """
@@ -770,12 +1279,75 @@ class SiteSnapshot:
 
         return url_to_script_node
 
+    def _get_callstack_fingerprint(self, callstack_files: list) -> typing.List[list]:
+        """
+        Fingerprint of the files that the callstack infused snapshot is built from
+        """
+        base_dir = os.path.dirname(os.path.abspath(self.snapshot_nx_file_path))
+        return get_files_fingerprint([self.snapshot_nx_file_path] + callstack_files, base_dir)
+
+    def get_infused_snapshot_file_path(self) -> str:
+        """
+        Path of the callstack infused version of snapshot_nx_file_path within infused_snapshot_dir
+        """
+        infused_snapshot_dir = self.infused_snapshot_dir or self.get_base_site_snapshots_dir()
+        return infused_snapshot_dir + os.sep + os.path.basename(get_infused_snapshot_path(self.snapshot_nx_file_path))
+
+    def _read_infused_snapshot(self) -> bool:
+        """
+        Reads in the callstack infused snapshot written by an earlier load (see _write_infused_snapshot).
+        The callstack files are listed again, so it is only used if it was built from the same snapshot file
+        and the same callstack files, with the same size and mtime as back then.
+        Returns true if the snapshot was read in
+        """
+        infused_file_path = self.get_infused_snapshot_file_path()
+        if os.path.abspath(infused_file_path) == os.path.abspath(self.snapshot_nx_file_path) \
+                or not os.path.isfile(infused_file_path):
+            return False
+
+        # listed again, so that callstack files added since then are found and infused as well
+        callstack_files = self._glob_callstack_files()
+        self._callstack_files = callstack_files
+        try:
+            with BinarySnapshotReader(infused_file_path) as reader:
+                metadata = reader.get_metadata()
+                if not callstack_files or \
+                        metadata.get("snapshot_file") != os.path.abspath(self.snapshot_nx_file_path) or \
+                        metadata.get("fingerprint") != self._get_callstack_fingerprint(callstack_files):
+                    logger.debug(f"Infused snapshot {infused_file_path} is outdated")
+                    return False
+                self._snapshot = reader.to_networkx()
+        except (OSError, MissingSnapshotException) as e:
+            logger.debug(f"Could not read infused snapshot {infused_file_path}: {e}")
+            return False
+
+        return True
+
+    def _write_infused_snapshot(self, callstack_files: list):
+        """
+        Keeps the callstack infused snapshot within infused_snapshot_dir,
+        so later loads skip parsing the callstack files
+        """
+        infused_file_path = self.get_infused_snapshot_file_path()
+        base_dir = os.path.dirname(os.path.abspath(self.snapshot_nx_file_path))
+        try:
+            os.makedirs(os.path.dirname(infused_file_path), exist_ok=True)
+            metadata = {"snapshot_file": os.path.abspath(self.snapshot_nx_file_path),
+                        "callstack_files": [os.path.relpath(f, base_dir) for f in callstack_files],
+                        "fingerprint": self._get_callstack_fingerprint(callstack_files)}
+            write_binary_snapshot(self._snapshot, infused_file_path, metadata=metadata)
+        except OSError as e:
+            logger.debug(f"Could not write infused snapshot {infused_file_path}: {e}")
+
+    def _get_callstack_entries(self, callstack_file: str) -> typing.Iterable[dict]:
+        return get_initiator_chain_log_entries(callstack_file)
+
     def _infuse_call_stack_to_snapshot(self):
         """
         First search for the callstack file, then use it to add to the snapshot
         Callstack files are json files retrieved from Chrome https://chromedevtools.github.io/devtools-protocol/tot/Network/#event-requestWillBeSent
         """
-        if self._snapshot:
+        if self._snapshot and not self._is_callstack_infused:
             #logger.debug(f"_infuse_call_stack_to_snapshot")
             callstack_files = self._find_callstack_files()
             #logger.debug(
@@ -784,16 +1356,112 @@ class SiteSnapshot:
                 url_to_script_nodes = self._get_script_url_to_url_node()
                 for f in callstack_files:
                     total_fixed_edges = 0
-                    callstack_entries = get_initiator_chain_log_entries(f)
+                    callstack_entries = self._get_callstack_entries(f)
                     for entry in callstack_entries:
                         total_fixed_edges += self._infuse_callstack_entry_to_snapshot(entry, url_to_script_nodes)
                     #logger.debug(f"Fixed total {total_fixed_edges} from JS Callstack {f}")
+                self._invalidate_graph_caches()
+                self._is_callstack_infused = True
+                if self.snapshot_nx_file_path:
+                    self._write_infused_snapshot(callstack_files)
             else:
                 raise MissingWebRequestFilesException(f"Could not infuse callstack information {self.snapshot_name}")
 
     def get_graph(self) -> nx.DiGraph:
         return self._snapshot
 
+    def get_snapshot_file_path(self) -> typing.Optional[str]:
+        """
+        The graphml (or binary) file that the snapshot was read from or converted into
+        """
+        return self.snapshot_nx_file_path or self._converted_snapshot_file_path
+
+    def get_manifest(self) -> typing.Optional[SnapshotManifest]:
+        """
+        The manifest read along with the snapshot file, or else one built in memory.
+        Manifests are only written when converting snapshots, see write_manifest
+        """
+        snapshot_file_path = self.get_snapshot_file_path()
+        if self._manifest is None and self._snapshot is not None and snapshot_file_path:
+            self._manifest = self.build_manifest(snapshot_file_path)
+        return self._manifest
+
+    def build_manifest(self, snapshot_file_path: str) -> SnapshotManifest:
+        """
+        Summarizes the snapshot, counting its nodes by annotation in one pass
+        """
+        number_of_ads, number_of_images, number_of_textnodes = 0, 0, 0
+        for _, node_data in self._snapshot.nodes(data=True):
+            number_of_ads += node_data.get(FLG_AD) == "true"
+            number_of_images += node_data.get(FLG_IMAGE) == "true"
+            number_of_textnodes += node_data.get(FLG_TEXTNODE) == "true"
+
+        url_variation_index = self.get_url_variation_index()
+        manifest = SnapshotManifest(get_manifest_path(snapshot_file_path),
+                                    snapshot_name=self.snapshot_name,
+                                    snapshot_fingerprint=SnapshotManifest.get_fingerprint(snapshot_file_path),
+                                    number_of_nodes=self._snapshot.number_of_nodes(),
+                                    number_of_edges=self._snapshot.number_of_edges(),
+                                    number_of_ads=number_of_ads,
+                                    number_of_images=number_of_images,
+                                    number_of_textnodes=number_of_textnodes,
+                                    content_hash=self.get_compiled_snapshot().get_content_hash(),
+                                    eslds=sorted(url_variation_index[TYPE_ESLD]),
+                                    fqdns=sorted(url_variation_index[TYPE_FQDN]))
+        manifest.raw_adgraph_file = manifest.to_relative_path(self._find_raw_adgraph_file_path())
+        manifest.init_adgraph_dir = manifest.to_relative_path(self._find_individual_init_adgraph_dir())
+        manifest.callstack_files = sorted(manifest.to_relative_path(f) for f in self._find_callstack_files() or [])
+        return manifest
+
+    def write_manifest(self) -> typing.Optional[SnapshotManifest]:
+        """
+        Writes the manifest next to the snapshot file. Only called when converting snapshots
+        (see _convert_into_snapshot_file and scripts/convert_snapshots_to_binary.py), loads never write to the dataset.
+        Returns the manifest, None if it could not be written
+        """
+        snapshot_file_path = self.get_snapshot_file_path()
+        if self._snapshot is None or not snapshot_file_path:
+            return None
+        try:
+            manifest = self.build_manifest(snapshot_file_path)
+            manifest.save()
+        except OSError as e:
+            logger.debug(f"Could not write manifest for {snapshot_file_path}: {e}")
+            return None
+        self._manifest = manifest
+        return manifest
+
+    def get_compiled_snapshot(self) -> "CompiledSiteSnapshot":
+        """
+        Returns the compiled version of the graph, built once and reused until the graph changes
+        """
+        if self._compiled_snapshot is None:
+            from autofr.rl.controlled.compiled_snapshot import CompiledSiteSnapshot
+            self._compiled_snapshot = CompiledSiteSnapshot(
+                self.get_graph(), nodes_with_non_dom_parent=self.get_nodes_with_non_dom_parent())
+        return self._compiled_snapshot
+
+    def get_nodes_with_non_dom_parent(self) -> set:
+        """
+        Returns the nodes that have non-DOM parents (ignoring cycles), computed once per graph
+        """
+        if self._nodes_with_non_dom_parent is None:
+            self._nodes_with_non_dom_parent = get_nodes_with_non_dom_predecessor_edges(self.get_graph())
+        return self._nodes_with_non_dom_parent
+
+    def has_non_dom_predecessor_edges(self, node_str: str) -> bool:
+        """
+        Cached version of has_non_dom_predecessor_edges(self.get_graph(), node_str)
+        """
+        return node_str in self.get_nodes_with_non_dom_parent()
+
+    def _invalidate_graph_caches(self):
+        """
+        Must be called whenever the graph is mutated
+        """
+        self._compiled_snapshot = None
+        self._nodes_with_non_dom_parent = None
+
     def remove_edge_types(self, edge_type: str) -> int:
         """
         Helper method to remove edge types
@@ -805,6 +1473,8 @@ class SiteSnapshot:
                 edges_to_remove.append((u, v))
         for u, v in edges_to_remove:
             self.get_graph().remove_edge(u, v)
+        if edges_to_remove:
+            self._invalidate_graph_caches()
 
         return len(edges_to_remove)
 
@@ -825,218 +1495,148 @@ class SiteSnapshot:
         """
         Since each iframe will be outputted as its own adgraph JSON file, we need to stitch together
         all raw adgraphs in rendering_stream by using the frameowner of each JSON file to map with node ids in the main JSON.
+        Raw adgraphs are read one event at a time and only an index of their events is kept (see AdgraphTimelineIndex),
+        so memory does not grow with the size of the files. Timelines are spliced into a linked list
+        (see AdgraphStitchedTimeline) at the last event of their iframe node, looked up by node id, so stitching
+        is linear in the number of events. The stitched file is the same as the one written when all raw adgraphs
+        were held in memory (see scripts/benchmarks/benchmark_adgraph_ingestion.py).
         input_directory: is already the directory that holds all raw adgraph files for a given site
         Returns: the file path of the new stitched together adgraph file
         """
-
-        def _get_first_html_node_id(json_obj) -> int:
-            main_node_id = -1
-            for event in json_obj["timeline"]:
-                if "tag_name" in event and event["tag_name"].lower() == "html":
-                    if "node_id" in event:
-                        main_node_id = int(event["node_id"])
-                        break
-            return main_node_id
-
-        def _should_stitch(main_json, other_json, double_check_main_node_id: int = -1) -> bool:
-            main_url = main_json["url"]
-            other_url = other_json["url"]
-            if main_url != other_url:
-                return True
-
-            main_node_id = _get_first_html_node_id(main_json)
-            other_node_id = _get_first_html_node_id(other_json)
-
-            if double_check_main_node_id != -1 and main_node_id != double_check_main_node_id:
-                raise SiteSnapshotException(
-                    f"Could not stitch adgraphs, first HTML node id is wrong. Expected {double_check_main_node_id} vs. Got {main_node_id}")
-
-            # don't stitch if the doc URLs are the same and the node_ids overlap. This is due to a bug
-            #logger.info(f"Should stitch: {main_node_id} vs. {other_node_id}")
-            return main_node_id < other_node_id
-
-        def _get_iframe_node_id(timeline_event: typing.Any) \
-                -> typing.Optional[str]:
-
-            if "event_type" in timeline_event and timeline_event["event_type"] == "NodeInsertion":
-                if "tag_name" in timeline_event and timeline_event["tag_name"].lower() == "iframe":
-                    node_id = timeline_event["node_id"]
-                    return node_id
-
-            return None
-
-        def _event_has_ad(timeline_event: typing.Any) -> bool:
-            """ Example:
-                "node_id": "20979",
-                "actor_id": "0",
-                "node_type": 1,
-                "tag_name": "DIV",
-                "event_type": "NodeInsertion",
-                "node_parent_id": "20978",
-                "node_previous_sibling_id": "0",
-                "parent_node_type": 11,
-                "node_attributes": [
-                    {
-                    "event_type": "NodeAttribute",
-                    "attr_name": "class",
-                    "attr_value": "CITP_adBlockerCover ByURL CITP_isAnAd"
-                    },
-                ]
-            """
-            if "event_type" in timeline_event and timeline_event["event_type"] == "NodeInsertion":
-                if "node_attributes" in timeline_event and len(timeline_event["node_attributes"]) > 0:
-                    for node_attr in timeline_event["node_attributes"]:
-                        if node_attr["attr_name"] == "class" and "CITP_isAnAd" in node_attr["attr_value"]:
-                            return True
-
-            return False
-
-        def _create_annotate_flg_ad_event(_node_id: str, _actor_id: str = "0") -> dict:
-            """
-                {
-                "actor_id": "107",
-                "node_id": "18380",
-                "node_attribute": {
-                    "event_type": "NodeAttribute",
-                    "attr_name": "flg-ad",
-                    "attr_value": "true"
-                },
-                "event_type": "AttrAddition"
-                },
-            """
-            _event = dict()
-            _event["actor_id"] = _actor_id
-            _event["node_id"] = _node_id
-            _event["event_type"] = "AttrAddition"
-            _event["node_attribute"] = dict()
-            _event["node_attribute"]["event_type"] = "NodeAttribute"
-            _event["node_attribute"]["attr_name"] = FLG_AD
-            _event["node_attribute"]["attr_value"] = "true"
-            return _event
-
-        # logger.debug(f"Finding largest raw adgraph file from {input_directory}")
         main_file_path = get_main_raw_adgraph_file_path(input_directory, site_url)
 
         if main_file_path is None:
             raise MissingSnapshotException(f"A main raw file needs to be found in {input_directory}")
 
-        #logger.debug(f"Found main_file_path {main_file_path}")
-
-        main_file_html_node_id = -1
-        with open(main_file_path, "r") as f:
-            main_file_json = json.load(f)
-            if IS_IN_MAIN_FRAME in main_file_json and main_file_json[IS_IN_MAIN_FRAME] != True:
-                raise SiteSnapshotException(
-                    f"Did not find correct main file json {main_file_path} , is in main frame: {main_file_json[IS_IN_MAIN_FRAME]}")
-            main_file_html_node_id = _get_first_html_node_id(main_file_json)
-            if self.FRAMEOWNER_ID not in main_file_json:
-                logger.debug(f"{self.FRAMEOWNER_ID} keyword not there, using old stitching strategy")
-                return self.stitch_adgraphs_old(input_directory, site_url)
+        main_index = AdgraphTimelineIndex(main_file_path)
+        if IS_IN_MAIN_FRAME in main_index.values and main_index.values[IS_IN_MAIN_FRAME] != True:
+            raise SiteSnapshotException(
+                f"Did not find correct main file json {main_file_path} , is in main frame: {main_index.values[IS_IN_MAIN_FRAME]}")
+        main_file_html_node_id = main_index.first_html_node_id
+        if self.FRAMEOWNER_ID not in main_index.values:
+            logger.debug(f"{self.FRAMEOWNER_ID} keyword not there, using old stitching strategy")
+            return self.stitch_adgraphs_old(input_directory, site_url)
+        if "timeline" not in main_index.values:
+            raise SiteSnapshotException(f"Main file json {main_file_path} has no timeline")
+
+        # the stitched timeline, as references to the events of timeline_indexes
+        timeline_indexes = [main_index]
+        timeline = AdgraphStitchedTimeline()
+        timeline.insert_after(-1, range(len(main_index)))
+        # node id to the timeline entry of its last event, one per timeline it is in
+        last_entries_by_node_id: typing.Dict[str, typing.List[int]] = collections.defaultdict(list)
+        for node_id, event_index in main_index.last_event_indexes.items():
+            last_entries_by_node_id[node_id].append(event_index)
+
+        def _get_node_id(event_ref: int) -> typing.Optional[str]:
+            return timeline_indexes[event_ref >> _EVENT_INDEX_BITS].node_ids[event_ref & _EVENT_INDEX_MASK]
+
+        def _get_event_type(event_ref: int) -> int:
+            return timeline_indexes[event_ref >> _EVENT_INDEX_BITS].event_types[event_ref & _EVENT_INDEX_MASK]
+
+        def _get_html_node_id(entry: int) -> typing.Optional[int]:
+            event_ref = timeline.event_refs[entry]
+            if event_ref < 0:
+                return None
+            return timeline_indexes[event_ref >> _EVENT_INDEX_BITS].html_node_ids.get(event_ref & _EVENT_INDEX_MASK)
+
+        # entry of the first html event of the stitched timeline, kept up to date as timelines are inserted.
+        # None when it has to be searched for again, after that entry was removed
+        first_html_entry: typing.Optional[int] = main_index.first_html_event_index
+
+        def _get_first_html_node_id() -> int:
+            nonlocal first_html_entry
+            if first_html_entry is None:
+                first_html_entry = next((entry for entry in timeline if _get_html_node_id(entry) is not None), -1)
+            if first_html_entry == -1:
+                return -1
+            return _get_html_node_id(first_html_entry)
 
         # keep hierarchy of iframe nodes
         iframe_node_g = nx.DiGraph()
 
         flg_iframe_ids = set()
         flg_iframe_id_queue = collections.deque()
-        for event in main_file_json["timeline"]:
-            node_id = _get_iframe_node_id(event)
-            if node_id is not None and node_id not in flg_iframe_ids:
-                #logger.debug(f"found flg-frame-id to parse  {node_id}")
+        for node_id in main_index.iframe_node_ids:
+            if node_id not in flg_iframe_ids:
                 flg_iframe_id_queue.append(node_id)
                 flg_iframe_ids.add(node_id)
                 iframe_node_g.add_node(node_id)
 
-        #logger.info(f"Iframes found in main JSON: {flg_iframe_ids}")
-
         # find the file that matches each flg_iframe_id
+        frameowner_files = AdgraphFrameownerFiles(input_directory, self.FRAMEOWNER)
         ad_nodes = []
-        while  flg_iframe_id_queue:
+        while flg_iframe_id_queue:
             node_id_curr = flg_iframe_id_queue.popleft()
 
             # find the file
-            match_file = get_file_from_path_by_key(input_directory, f"log*{self.FRAMEOWNER}{node_id_curr}*.json")
+            match_file = frameowner_files.get_file_path(node_id_curr)
 
             if not match_file:
                 logger.debug(f"Cannot find adgraph corresponding to {node_id_curr}")
                 continue
 
-            # get the first node parent id, and replace all instances of that with the current node_id
-            timeline_to_add = None
-            with open(match_file) as f:
-                match_file_json = json.load(f)
-                # check to see if the match file is a valid file to stitch
-                should_stitch_with_match_file = _should_stitch(main_file_json, match_file_json,
-                                                               double_check_main_node_id=main_file_html_node_id)
-
-                if not should_stitch_with_match_file:
-                    logger.debug(f"Skipping stitching of {match_file}")
+            match_index = AdgraphTimelineIndex(match_file, node_id_curr=node_id_curr, keep_values=False)
 
-                if should_stitch_with_match_file:
-                    #logger.debug(f"Stitching of {match_file} into {main_file_path}")
-                    wrong_node_parent_id = None
+            # check to see if the match file is a valid file to stitch
+            should_stitch_with_match_file = True
+            if main_index.values["url"] == match_index.values["url"]:
+                main_node_id = _get_first_html_node_id()
+                if main_file_html_node_id != -1 and main_node_id != main_file_html_node_id:
+                    raise SiteSnapshotException(
+                        f"Could not stitch adgraphs, first HTML node id is wrong. Expected {main_file_html_node_id} vs. Got {main_node_id}")
+                # don't stitch if the doc URLs are the same and the node_ids overlap. This is due to a bug
+                should_stitch_with_match_file = main_node_id < match_index.first_html_node_id
 
-                    # update the match_file_json because it will have the wrong node_parent_id
-                    for tmp_event in match_file_json["timeline"]:
-                        if not wrong_node_parent_id and "node_parent_id" in tmp_event:
-                            wrong_node_parent_id = tmp_event["node_parent_id"]
-                            #logger.debug(
-                            #    f"wrong node parent id found: {wrong_node_parent_id}, will replace with {node_id_curr}")
-
-                        # for every event that has the wrong_node_parent_id, replace it with the node_id_curr
-                        if wrong_node_parent_id and "node_parent_id" in tmp_event \
-                                and tmp_event["node_parent_id"] == wrong_node_parent_id:
-                            tmp_event["node_parent_id"] = node_id_curr
-
-                        tmp_event_has_ads = _event_has_ad(tmp_event)
-                        if tmp_event_has_ads:
-                            ad_nodes.append(node_id_curr)
-
-                        # add more if this file also has flg_iframe_id to deal with nested iframes
-                        node_id_tmp = _get_iframe_node_id(tmp_event)
-                        if node_id_tmp is not None and node_id_tmp not in flg_iframe_ids:
-                            #logger.debug(f"found iframe node to parse {node_id_tmp}")
-                            flg_iframe_id_queue.append(node_id_tmp)
-                            flg_iframe_ids.add(node_id_tmp)
-                            iframe_node_g.add_node(node_id_tmp)
-                            iframe_node_g.add_edge(node_id_curr, node_id_tmp)
-
-                    timeline_to_add = match_file_json["timeline"]
-
-            if timeline_to_add:
-                # find the last occurrence of node_id in the main_file_json
-                index_found = None
-                remove_event_at_index = False
-                for index, tmp_event in enumerate(reversed(main_file_json["timeline"]), start=0):
-                    if "node_id" in tmp_event and tmp_event["node_id"] == node_id_curr:
-                        index_found = index
-                        # if the last event is a NodeRemoval event, then remove it, since we want to ignore it
-                        if "event_type" in tmp_event and tmp_event["event_type"] == "NodeRemoval":
-                            remove_event_at_index = True
-                        break
+            if not should_stitch_with_match_file:
+                logger.debug(f"Skipping stitching of {match_file}")
+                continue
 
-                if index_found is None:
-                    raise BuildingSnapshotException(
-                        f"Index to add cannot be None for {node_id_curr}")
+            if match_index.has_ads:
+                ad_nodes.append(node_id_curr)
 
-                if remove_event_at_index:
-                    remove_at_index = (-1 * index_found) - 1
-                    del main_file_json["timeline"][remove_at_index]
-                    #logger.debug(f"removing event from main file at index: {remove_at_index}")
-                    # replace it at the node we just deleted
-                    replace_at_index = (-1 * index_found)
-                else:
-                    # replace it at the node+1 of index_found
-                    replace_at_index = (-1 * index_found) + 1
+            # add more if this file also has flg_iframe_id to deal with nested iframes
+            for node_id_tmp in match_index.iframe_node_ids:
+                if node_id_tmp not in flg_iframe_ids:
+                    flg_iframe_id_queue.append(node_id_tmp)
+                    flg_iframe_ids.add(node_id_tmp)
+                    iframe_node_g.add_node(node_id_tmp)
+                    iframe_node_g.add_edge(node_id_curr, node_id_tmp)
 
-                #logger.debug(f"inserting new timeline into index: {replace_at_index}")
-                if replace_at_index < 0:
-                    # update the main_file_json
-                    main_file_json["timeline"][replace_at_index:replace_at_index] = timeline_to_add
-                else:
-                    main_file_json["timeline"] += timeline_to_add
+            if len(match_index) == 0:
+                continue
 
-        # annotate the found ad_nodes in the main_file_json
-        #logger.debug(f"Number of ad nodes found {set(ad_nodes)}")
+            # find the last occurrence of node_id in the stitched timeline
+            last_entries = last_entries_by_node_id.get(node_id_curr)
+            if not last_entries:
+                raise BuildingSnapshotException(
+                    f"Index to add cannot be None for {node_id_curr}")
+            entry_found = max(last_entries, key=timeline.labels.__getitem__)
+
+            if _get_event_type(timeline.event_refs[entry_found]) == _EVENT_NODE_REMOVAL:
+                # if the last event is a NodeRemoval event, then remove it, since we want to ignore it
+                insert_after = timeline.previous_entries[entry_found]
+                timeline.remove(entry_found)
+                if entry_found == first_html_entry:
+                    first_html_entry = None
+            else:
+                # the same place where the in-memory version inserted: after the event following the one found
+                insert_after = timeline.next_entries[entry_found]
+                if insert_after == -1:
+                    insert_after = entry_found
+
+            first_event_ref = len(timeline_indexes) << _EVENT_INDEX_BITS
+            timeline_indexes.append(match_index)
+            first_entry = timeline.insert_after(insert_after,
+                                                range(first_event_ref, first_event_ref + len(match_index)))
+            for node_id, event_index in match_index.last_event_indexes.items():
+                last_entries_by_node_id[node_id].append(first_entry + event_index)
+            if match_index.first_html_event_index != -1 and first_html_entry is not None:
+                html_entry = first_entry + match_index.first_html_event_index
+                if first_html_entry == -1 or timeline.labels[html_entry] < timeline.labels[first_html_entry]:
+                    first_html_entry = html_entry
+
+        # annotate the found ad_nodes in the stitched timeline
         top_most_ad_nodes = []
         for ad_node in set(ad_nodes):
             found_anc = False
@@ -1051,30 +1651,50 @@ class SiteSnapshot:
         # must be sorted because we are going through the timeline once
         top_most_ad_nodes = list(set(top_most_ad_nodes))
         top_most_ad_nodes.sort(key=lambda x: int(x))
-        #logger.debug(f"Number of top ad nodes found {top_most_ad_nodes}")
 
-        curr_index = 0
-        curr_len = len(main_file_json["timeline"])
+        flg_ad_node_ids = []
+        entry = timeline.head
         for node_id in top_most_ad_nodes:
-            # main_file_json["timeline"].append(_create_annotate_flg_ad_event(node_id))
-            while (curr_index < curr_len):
-                event = main_file_json["timeline"][curr_index]
-                found_match = False
-                if "event_type" in event and event["event_type"] == "NodeInsertion" and event["node_id"] == node_id:
-                    #logger.debug(f"Found location {curr_index + 1} to add flg-ad=true event")
-                    main_file_json["timeline"].insert(curr_index + 1, _create_annotate_flg_ad_event(node_id))
-                    curr_index += 1
-                    curr_len += 1
-                    found_match = True
-                curr_index += 1
-                if found_match:
+            while entry != -1:
+                event_ref = timeline.event_refs[entry]
+                if event_ref >= 0 and _get_event_type(event_ref) == _EVENT_NODE_INSERTION \
+                        and _get_node_id(event_ref) == node_id:
+                    flg_ad_node_ids.append(node_id)
+                    flg_ad_entry = timeline.insert_after(entry, [-len(flg_ad_node_ids)])
+                    entry = timeline.next_entries[flg_ad_entry]
                     break
-
-        # output a new json with everything stitched together
-        new_main_file_path = main_file_path[:-len(".json")] + "_all.json"
-        with open(new_main_file_path, "w") as f:
-            json.dump(main_file_json, f)
-            #logger.debug(f"outputted new stitched raw adgraph at {new_main_file_path}")
+                entry = timeline.next_entries[entry]
+
+        # output a new json with everything stitched together, one event at a time
+        # the stitched file is read by adgraph-buildgraph, it is never compressed
+        new_main_file_path = remove_compressed_ext(main_file_path)[:-len(".json")] + "_all.json"
+        timeline_readers = [AdgraphTimelineReader(timeline_index) for timeline_index in timeline_indexes]
+        try:
+            with open(new_main_file_path, "w") as f:
+                f.write("{")
+                for key_number, (key, value) in enumerate(main_index.values.items()):
+                    if key_number > 0:
+                        f.write(", ")
+                    f.write(json.dumps(key) + ": ")
+                    if key != "timeline":
+                        f.write(json.dumps(value))
+                        continue
+                    f.write("[")
+                    for position, entry in enumerate(timeline):
+                        if position > 0:
+                            f.write(", ")
+                        event_ref = timeline.event_refs[entry]
+                        if event_ref < 0:
+                            event = _create_adgraph_flg_ad_event(flg_ad_node_ids[-event_ref - 1])
+                        else:
+                            event = timeline_readers[event_ref >> _EVENT_INDEX_BITS].get_event(
+                                event_ref & _EVENT_INDEX_MASK)
+                        f.write(json.dumps(event))
+                    f.write("]")
+                f.write("}")
+        finally:
+            for timeline_reader in timeline_readers:
+                timeline_reader.close()
 
         return new_main_file_path
 
@@ -1130,7 +1750,7 @@ class SiteSnapshot:
             raise MissingSnapshotException(f"A main raw file needs to be found in {input_directory}")
 
         main_file_html_node_id = -1
-        with open(main_file_path, "r") as f:
+        with open_maybe_compressed(main_file_path, "r") as f:
             main_file_json = json.load(f)
             main_file_html_node_id = _get_first_html_node_id(main_file_json)
 
@@ -1148,7 +1768,8 @@ class SiteSnapshot:
             flg_iframe_id_curr, node_id_curr = flg_iframe_id_queue.popleft()
 
             # find the file
-            match_file = get_file_from_path_by_key(input_directory, f"log*{flg_iframe_id_curr}.json")
+            match_file = get_file_from_path_by_key(input_directory, f"log*{flg_iframe_id_curr}.json",
+                                                   include_compressed=True)
 
             if not match_file:
                 logger.debug(f"Cannot find adgraph corresponding to {flg_iframe_id_curr}")
@@ -1156,7 +1777,7 @@ class SiteSnapshot:
 
             # get the first node parent id, and replace all instances of that with the current node_id
             timeline_to_add = None
-            with open(match_file) as f:
+            with open_maybe_compressed(match_file) as f:
                 match_file_json = json.load(f)
                 # check to see if the match file is a valid file to stitch
                 should_stitch_with_match_file = _should_stitch(main_file_json, match_file_json,
@@ -1221,39 +1842,43 @@ class SiteSnapshot:
                     main_file_json["timeline"] += timeline_to_add
 
         # output a new json with everything stitched together
-        new_main_file_path = main_file_path[:-len(".json")] + "_all.json"
+        # the stitched file is read by adgraph-buildgraph, it is never compressed
+        new_main_file_path = remove_compressed_ext(main_file_path)[:-len(".json")] + "_all.json"
         with open(new_main_file_path, "w") as f:
             json.dump(main_file_json, f)
             #logger.debug(f"outputted new stitched raw adgraph at {new_main_file_path}")
 
         return new_main_file_path
 
-    def has_url_variation_in_graph(self, url_variation: str, url_type: str = None) -> bool:
+    def get_url_variation_index(self) -> typing.Dict[str, set]:
         """
-        Returns whether our graph holds any nodes that matches url_variation based on url_type as well
+        Returns the eSLD, FQDN and FQDN+path variations of all urls in the graph, by url type.
+        A variation is only kept if it appears as is within its url.
         """
-        url_found = ""
-        for n, node_data in self._snapshot.nodes(data=True):
-            if REQUESTED_URL in node_data:
-                url_found = node_data[REQUESTED_URL]
-            if INFO in node_data and NODE_TYPE in node_data \
-                    and node_data[NODE_TYPE] == "URL":
-                url_found = node_data[INFO]
-
-            if url_found and url_variation in url_found:
-                # check against the type to not over-match things like ads-twitter.com with twitter.com
+        if self._url_variation_index is None:
+            self._url_variation_index = {TYPE_ESLD: set(), TYPE_FQDN: set(), TYPE_FQDN_PATH: set()}
+            urls_found = set()
+            for n, node_data in self._snapshot.nodes(data=True):
+                url_found = get_url_from_node_data(node_data)
+                if url_found:
+                    urls_found.add(url_found)
+            for url_found in urls_found:
                 sld, fqdn, fqdn_path, _ = get_variations_of_domains(url_found)
-                if not url_type:
-                    if sld == url_variation or fqdn == url_variation or fqdn_path == url_variation:
-                        return True
-                else:
-                    if url_type == TYPE_ESLD and sld == url_variation:
-                        return True
-                    if url_type == TYPE_FQDN and fqdn == url_variation:
-                        return True
-                    if url_type == TYPE_FQDN_PATH and fqdn_path == url_variation:
-                        return True
+                for url_type, url_variation in ((TYPE_ESLD, sld), (TYPE_FQDN, fqdn), (TYPE_FQDN_PATH, fqdn_path)):
+                    if url_variation and url_variation in url_found:
+                        self._url_variation_index[url_type].add(url_variation)
+        return self._url_variation_index
 
+    def has_url_variation_in_graph(self, url_variation: str, url_type: str = None) -> bool:
+        """
+        Returns whether our graph holds any nodes that matches url_variation based on url_type as well
+        """
+        # check against the type to not over-match things like ads-twitter.com with twitter.com
+        url_variation_index = self.get_url_variation_index()
+        if not url_type:
+            return any(url_variation in variations for variations in url_variation_index.values())
+        if url_type in url_variation_index:
+            return url_variation in url_variation_index[url_type]
         return False
 
     def get_number_of_ads(self) -> int:
@@ -1347,3 +1972,157 @@ class SiteSnapshot:
                                 script_urls_found.append(pred_data[INFO])
 
         return set(script_urls_found)
+
+
+def _convert_raw_adgraph_file(site_snapshot_klass: typing.Callable, url: str, adgraph_raw_file_path: str,
+                              raise_errors: bool, kwargs: dict) -> typing.Optional[SiteSnapshot]:
+    """
+    Converts one raw adgraph into a site snapshot. Can run within a worker process.
+    """
+    try:
+        return site_snapshot_klass(url, adgraph_raw_file_path=adgraph_raw_file_path, **kwargs)
+    except SiteSnapshotException as e:
+        if raise_errors:
+            raise
+        logger.error(f"Could not convert {adgraph_raw_file_path}: {e}")
+        return None
+
+
+def convert_raw_adgraph_files(url: str,
+                              adgraph_raw_file_paths: typing.List[str],
+                              workers: int = 1,
+                              site_snapshot_klass: typing.Callable = None,
+                              raise_errors: bool = True,
+                              file_kwargs: typing.List[dict] = None,
+                              **kwargs) -> typing.List[typing.Optional[SiteSnapshot]]:
+    """
+    Converts raw adgraphs into site snapshots, using workers processes. Each conversion parses its adgraph
+    in its own AdgraphWorkspace, so they can run at the same time.
+    Returns the site snapshots in the order of adgraph_raw_file_paths, None for the ones that failed
+    when raise_errors is False.
+    file_kwargs: passed on to site_snapshot_klass for each raw adgraph, on top of kwargs
+    kwargs: passed on to site_snapshot_klass, like base_name or output_directory
+    """
+    site_snapshot_klass = site_snapshot_klass or SiteSnapshot
+    file_kwargs = file_kwargs or [dict()] * len(adgraph_raw_file_paths)
+    args = [[site_snapshot_klass] * len(adgraph_raw_file_paths),
+            [url] * len(adgraph_raw_file_paths),
+            adgraph_raw_file_paths,
+            [raise_errors] * len(adgraph_raw_file_paths),
+            [{**kwargs, **f_kwargs} for f_kwargs in file_kwargs]]
+    if workers and workers > 1 and len(adgraph_raw_file_paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(adgraph_raw_file_paths))) \
+                as executor:
+            # map returns results in the order of adgraph_raw_file_paths
+            return list(executor.map(_convert_raw_adgraph_file, *args))
+    return list(map(_convert_raw_adgraph_file, *args))
+
+
+def _stitch_raw_adgraph(site_snapshot_klass: typing.Callable, url: str, adgraph_raw_file_path: str,
+                        raise_errors: bool) -> typing.Optional[str]:
+    """
+    Stitches the raw adgraphs of one site. Can run within a worker process.
+    """
+    try:
+        return site_snapshot_klass.stitch_raw_adgraph(url, adgraph_raw_file_path)
+    except SiteSnapshotException as e:
+        if raise_errors:
+            raise
+        logger.error(f"Could not stitch {adgraph_raw_file_path}: {e}")
+        return None
+
+
+def convert_raw_adgraph_files_in_batch(url: str,
+                                       adgraph_raw_file_paths: typing.List[str],
+                                       batch_size: int = 100,
+                                       workers: int = 1,
+                                       site_snapshot_klass: typing.Callable = None,
+                                       raise_errors: bool = True,
+                                       file_kwargs: typing.List[dict] = None,
+                                       **kwargs) -> typing.List[typing.Optional[SiteSnapshot]]:
+    """
+    Like convert_raw_adgraph_files, but parses up to batch_size stitched adgraphs with one adgraph-buildgraph run
+    instead of one run per site snapshot. Site snapshots are written the same way as with convert_raw_adgraph_files.
+    Stitching and converting the parsed adgraphs use workers processes.
+    """
+    site_snapshot_klass = site_snapshot_klass or SiteSnapshot
+    file_kwargs = file_kwargs or [dict()] * len(adgraph_raw_file_paths)
+    site_snapshots: typing.List[typing.Optional[SiteSnapshot]] = [None] * len(adgraph_raw_file_paths)
+
+    before = time.time()
+    for batch_start in range(0, len(adgraph_raw_file_paths), batch_size):
+        batch = list(range(batch_start, min(batch_start + batch_size, len(adgraph_raw_file_paths))))
+        batch_before = time.time()
+        batch_file_paths = [adgraph_raw_file_paths[i] for i in batch]
+        args = [[site_snapshot_klass] * len(batch), [url] * len(batch), batch_file_paths,
+                [raise_errors] * len(batch)]
+        if workers and workers > 1 and len(batch) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(batch))) as executor:
+                stitched_adgraph_files = list(executor.map(_stitch_raw_adgraph, *args))
+        else:
+            stitched_adgraph_files = list(map(_stitch_raw_adgraph, *args))
+
+        parsed_indexes = []
+        buildgraph_time = 0
+        try:
+            with AdgraphWorkspace() as workspace:
+                # raw adgraphs of different sites often have the same file name, so each one is parsed within
+                # a directory prefixed by its index (adgraph-buildgraph only uses it to name its outputs)
+                for i, stitched_adgraph_file in zip(batch, stitched_adgraph_files):
+                    if stitched_adgraph_file:
+                        workspace.copy_adgraph_as_parsed_log(
+                            f"{i}_{get_parsed_adgraph_dir_name(adgraph_raw_file_paths[i])}", stitched_adgraph_file)
+                        os.remove(stitched_adgraph_file)
+                        parsed_indexes.append(i)
+
+                if not parsed_indexes:
+                    continue
+
+                buildgraph_before = time.time()
+                p = workspace.run_adgraphapi()
+                buildgraph_time = time.time() - buildgraph_before
+                if p.returncode != 0:
+                    error_message = f"Could not parse a batch of {len(parsed_indexes)} adgraph files " \
+                                    f"starting with {adgraph_raw_file_paths[parsed_indexes[0]]}"
+                    if raise_errors:
+                        raise BuildingSnapshotException(error_message)
+                    logger.error(error_message)
+                    continue
+
+                parsed_kwargs = []
+                for i in parsed_indexes:
+                    # move the parsed file back to the name that the site snapshot is named after
+                    dir_name = get_parsed_adgraph_dir_name(adgraph_raw_file_paths[i])
+                    parsed_file_path = workspace.get_parsed_file_path(f"{i}_{dir_name}")
+                    if os.path.isfile(parsed_file_path):
+                        os.makedirs(workspace.get_mapping_dir() + os.sep + str(i))
+                        renamed_file_path = workspace.get_mapping_dir() + os.sep + str(i) + os.sep + dir_name + ".json"
+                        os.replace(parsed_file_path, renamed_file_path)
+                        parsed_file_path = renamed_file_path
+                    parsed_kwargs.append({**file_kwargs[i], "parsed_adgraph_file_path": parsed_file_path})
+                converted = convert_raw_adgraph_files(url,
+                                                      [adgraph_raw_file_paths[i] for i in parsed_indexes],
+                                                      workers=workers,
+                                                      site_snapshot_klass=site_snapshot_klass,
+                                                      raise_errors=raise_errors,
+                                                      file_kwargs=parsed_kwargs,
+                                                      **kwargs)
+                for i, site_snapshot in zip(parsed_indexes, converted):
+                    site_snapshots[i] = site_snapshot
+        finally:
+            # stitched files that did not make it into the workspace
+            for stitched_adgraph_file in stitched_adgraph_files:
+                if stitched_adgraph_file and os.path.isfile(stitched_adgraph_file):
+                    os.remove(stitched_adgraph_file)
+
+        batch_time = time.time() - batch_before
+        batch_converted_count = sum(1 for i in batch if site_snapshots[i] is not None)
+        logger.info(f"Converted {batch_converted_count} of a batch of {len(batch)} adgraphs in {batch_time:.3f}s "
+                    f"({batch_converted_count / batch_time:.2f} snapshots/s, "
+                    f"adgraph-buildgraph {buildgraph_time:.3f}s)")
+
+    elapsed = time.time() - before
+    converted_count = sum(1 for site_snapshot in site_snapshots if site_snapshot is not None)
+    logger.info(f"Converted {converted_count} of {len(adgraph_raw_file_paths)} adgraphs in {elapsed:.3f}s "
+                f"({converted_count / elapsed if elapsed > 0 else 0:.2f} snapshots/s)")
+    return site_snapshots
@@ -0,0 +1,329 @@
+import fnmatch
+import gzip
+import io
+import logging
+import os
+import sqlite3
+import threading
+import typing
+import zipfile
+
+import networkx as nx
+
+from autofr.common.compression_utils import COMPRESS_LEVEL, GZIP_MAGIC, remove_compressed_ext
+from autofr.common.exceptions import MissingSnapshotException
+from autofr.common.perf_log_utils import iter_initiator_chain_log_entries_from_lines
+from autofr.common.utils import JSON_WEBREQUEST_KEY
+from autofr.rl.controlled.site_snapshot import INIT_ADGRAPH, SiteSnapshot, get_snapshot_unique_key
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_CORPUS_SQLITE = "snapshot_corpus.sqlite"
+# files of the snapshot directory that are kept in the corpus, matched without .gz.
+# Raw and parsed adgraphs, screenshots and binary snapshots are left out, they are not needed to load snapshots
+CORPUS_FILE_PATTERNS = ["*.graphml", f"*{JSON_WEBREQUEST_KEY}.json", "*.csv"]
+# files that the init state of DomainHierarchyMABControlled reads from disk, see SnapshotCorpus.extract_files
+CORPUS_INIT_FILE_PATTERNS = [f"{INIT_ADGRAPH}*/*{JSON_WEBREQUEST_KEY}.json", f"{INIT_ADGRAPH}*/*.csv"]
+
+
+def get_corpus_site_name(zip_file_path: str) -> str:
+    """
+    Sites are named after the dataset zip they were ingested from, without .zip
+    """
+    zip_file_name = os.path.basename(zip_file_path)
+    if zip_file_name.endswith(".zip"):
+        return zip_file_name[:-len(".zip")]
+    return zip_file_name
+
+
+def _get_init_dir(file_path: str) -> typing.Optional[str]:
+    parts = file_path.split("/")
+    for i, part in enumerate(parts[:-1]):
+        if part.startswith(INIT_ADGRAPH):
+            return "/".join(parts[:i + 1])
+    return None
+
+
+class SnapshotCorpus:
+    """
+    Site snapshots of many dataset zips in one sqlite file, so that they can be read without unpacking the zips.
+    Each zip is ingested once as a site. The files of its snapshot directory that loading snapshots needs
+    (see CORPUS_FILE_PATTERNS) are kept gzip compressed, one row per file, so any snapshot of any site
+    is read on its own. Paths are relative to the snapshot directory of the zip and use "/".
+    """
+
+    def __init__(self, corpus_file: str):
+        self.corpus_file = corpus_file
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(corpus_file, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS sites "
+                                 "(name TEXT PRIMARY KEY, zip_file_name TEXT NOT NULL, zip_size INTEGER NOT NULL, "
+                                 "zip_mtime REAL NOT NULL, snapshot_dir TEXT NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS files "
+                                 "(site TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, "
+                                 "data BLOB NOT NULL, PRIMARY KEY (site, path))")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS snapshots "
+                                 "(site TEXT NOT NULL, path TEXT NOT NULL, init_dir TEXT, PRIMARY KEY (site, path))")
+
+    @staticmethod
+    def get_corpus_file(directory: str) -> str:
+        return directory + os.sep + SNAPSHOT_CORPUS_SQLITE
+
+    def _is_ingested(self, site_name: str, zip_file_path: str) -> bool:
+        row = self._connection.execute("SELECT zip_size, zip_mtime FROM sites WHERE name = ?",
+                                       (site_name,)).fetchone()
+        return row is not None and row[0] == os.path.getsize(zip_file_path) \
+            and row[1] == os.path.getmtime(zip_file_path)
+
+    def ingest_zip(self, zip_file_path: str, overwrite: bool = False,
+                   compresslevel: int = COMPRESS_LEVEL) -> bool:
+        """
+        Adds the snapshot directory of a dataset zip as a site, replacing what the site had before.
+        Members are read straight from the zip, nothing is unpacked to disk.
+        Returns False if the zip was ingested already and has not changed since
+        """
+        site_name = get_corpus_site_name(zip_file_path)
+        with self._lock:
+            if not overwrite and self._is_ingested(site_name, zip_file_path):
+                logger.info(f"Skipping {zip_file_path}, it is in the corpus already")
+                return False
+
+        with zipfile.ZipFile(zip_file_path) as zip_file:
+            members = [info for info in zip_file.infolist() if not info.is_dir()]
+            # the snapshot directory is a subdirectory of the zip, see confirm_reproducibility.py
+            snapshot_dir = None
+            for info in sorted(members, key=lambda x: x.filename):
+                parts = info.filename.split("/")
+                for i, part in enumerate(parts[:-1]):
+                    if SiteSnapshot.SNAPSHOT_DIRECTORY_PARTIAL in part:
+                        snapshot_dir = "/".join(parts[:i + 1])
+                        break
+                if snapshot_dir:
+                    break
+            if not snapshot_dir:
+                raise MissingSnapshotException(f"Could not find snapshot directory in {zip_file_path}")
+
+            # relative path to the zip member, the uncompressed member wins when both are there
+            members_by_path: typing.Dict[str, zipfile.ZipInfo] = dict()
+            for info in members:
+                if not info.filename.startswith(snapshot_dir + "/"):
+                    continue
+                path = info.filename[len(snapshot_dir) + 1:]
+                name = remove_compressed_ext(path)
+                if name != path and name in members_by_path:
+                    continue
+                if any(fnmatch.fnmatchcase(name, p) for p in CORPUS_FILE_PATTERNS):
+                    members_by_path.pop(name + ".gz", None)
+                    members_by_path[path] = info
+
+            # init dir of every raw file, to find the init dir of snapshots outside of init dirs
+            # like SiteSnapshot._find_raw_adgraph_file_path does
+            init_dirs_by_file_name = dict()
+            for info in members:
+                if not info.filename.startswith(snapshot_dir + "/") or \
+                        not remove_compressed_ext(info.filename).endswith(".json"):
+                    continue
+                init_dir = _get_init_dir(info.filename[len(snapshot_dir) + 1:])
+                if init_dir:
+                    init_dirs_by_file_name[os.path.basename(info.filename)] = init_dir
+
+            with self._lock:
+                with self._connection:
+                    self._connection.execute("BEGIN")
+                    for table in ["sites", "files", "snapshots"]:
+                        key = "name" if table == "sites" else "site"
+                        self._connection.execute(f"DELETE FROM {table} WHERE {key} = ?", (site_name,))
+                    for path, info in sorted(members_by_path.items()):
+                        data = zip_file.read(info)
+                        if not data.startswith(GZIP_MAGIC):
+                            data = gzip.compress(data, compresslevel=compresslevel, mtime=0)
+                        self._connection.execute("INSERT INTO files (site, path, size, data) VALUES (?, ?, ?, ?)",
+                                                 (site_name, path, info.file_size, data))
+                        if fnmatch.fnmatchcase(remove_compressed_ext(path), "*.graphml"):
+                            init_dir = _get_init_dir(path)
+                            snapshot_unique_key = get_snapshot_unique_key(path)
+                            if not init_dir and snapshot_unique_key:
+                                init_dir = next((d for f, d in sorted(init_dirs_by_file_name.items())
+                                                 if snapshot_unique_key in f), None)
+                            self._connection.execute("INSERT INTO snapshots (site, path, init_dir) VALUES (?, ?, ?)",
+                                                     (site_name, path, init_dir))
+                    self._connection.execute("INSERT INTO sites (name, zip_file_name, zip_size, zip_mtime, "
+                                             "snapshot_dir) VALUES (?, ?, ?, ?, ?)",
+                                             (site_name, os.path.basename(zip_file_path),
+                                              os.path.getsize(zip_file_path), os.path.getmtime(zip_file_path),
+                                              snapshot_dir))
+        logger.info(f"Ingested {len(members_by_path)} files of {zip_file_path} as {site_name}")
+        return True
+
+    def get_site_names(self) -> typing.List[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT name FROM sites ORDER BY name")]
+
+    def has_site(self, site_name: str) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM sites WHERE name = ?", (site_name,)).fetchone() is not None
+
+    def get_snapshot_dir(self, site_name: str) -> typing.Optional[str]:
+        """
+        The snapshot directory of the site within its zip
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT snapshot_dir FROM sites WHERE name = ?", (site_name,)).fetchone()
+        return row[0] if row else None
+
+    def get_snapshot_paths(self, site_name: str, directory: str = None) -> typing.List[str]:
+        """
+        Paths of the graphml snapshots of the site, only the ones directly within directory if given
+        """
+        with self._lock:
+            paths = [row[0] for row in self._connection.execute(
+                "SELECT path FROM snapshots WHERE site = ? ORDER BY path", (site_name,))]
+        if directory is not None:
+            paths = [p for p in paths if os.path.dirname(p) == directory.strip("/")]
+        return paths
+
+    def get_init_dir(self, site_name: str, snapshot_path: str) -> typing.Optional[str]:
+        """
+        The init directory of the visit that the snapshot is from
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT init_dir FROM snapshots WHERE site = ? AND path = ?",
+                                           (site_name, snapshot_path)).fetchone()
+        return row[0] if row else None
+
+    def get_file_paths(self, site_name: str, pattern: str = "*") -> typing.List[str]:
+        """
+        Paths of the files of the site that match pattern, without .gz. Like fnmatch, * matches / as well
+        """
+        with self._lock:
+            paths = [row[0] for row in self._connection.execute(
+                "SELECT path FROM files WHERE site = ? ORDER BY path", (site_name,))]
+        return [p for p in paths if fnmatch.fnmatchcase(remove_compressed_ext(p), pattern)]
+
+    def get_callstack_file_paths(self, site_name: str, snapshot_path: str) -> typing.List[str]:
+        """
+        Callstack files (webrequests) of the init directory of the snapshot, like SiteSnapshot._find_callstack_files
+        """
+        init_dir = self.get_init_dir(site_name, snapshot_path)
+        if not init_dir:
+            return []
+        return self.get_file_paths(site_name, init_dir + f"/*{JSON_WEBREQUEST_KEY}.json")
+
+    def _read_compressed_file(self, site_name: str, path: str) -> bytes:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM files WHERE site = ? AND path = ?",
+                                           (site_name, path)).fetchone()
+        if row is None:
+            raise MissingSnapshotException(f"Could not find {path} of {site_name} in {self.corpus_file}")
+        return row[0]
+
+    def read_file(self, site_name: str, path: str) -> bytes:
+        """
+        Content of a file of the site, decompressed
+        """
+        return gzip.decompress(self._read_compressed_file(site_name, path))
+
+    def open_file(self, site_name: str, path: str, mode: str = "r") -> typing.IO:
+        """
+        Opens a file of the site for reading, as text unless mode has b
+        """
+        f = gzip.GzipFile(fileobj=io.BytesIO(self._read_compressed_file(site_name, path)), mode="rb")
+        if "b" in mode:
+            return f
+        return io.TextIOWrapper(f, encoding="utf-8")
+
+    def extract_files(self, site_name: str, output_directory: str,
+                      patterns: typing.List[str] = None) -> typing.List[str]:
+        """
+        Writes the files of the site that match patterns (defaults to CORPUS_INIT_FILE_PATTERNS) into
+        output_directory, keeping their relative paths. Files that were compressed within the zip stay compressed.
+        Returns the paths written
+        """
+        patterns = patterns or CORPUS_INIT_FILE_PATTERNS
+        file_paths = []
+        for path in self.get_file_paths(site_name):
+            if not any(fnmatch.fnmatchcase(remove_compressed_ext(path), p) for p in patterns):
+                continue
+            file_path = os.path.join(output_directory, *path.split("/"))
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if path.endswith(".gz"):
+                data = self._read_compressed_file(site_name, path)
+            else:
+                data = self.read_file(site_name, path)
+            with open(file_path, "wb") as f:
+                f.write(data)
+            file_paths.append(file_path)
+        return file_paths
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self) -> "SnapshotCorpus":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# corpora opened by this process, see get_snapshot_corpus
+_snapshot_corpora: typing.Dict[typing.Tuple[str, int], SnapshotCorpus] = dict()
+
+
+def get_snapshot_corpus(corpus_file: str) -> SnapshotCorpus:
+    """
+    The corpus of corpus_file, opened once per process since sqlite connections can not be shared with
+    worker processes
+    """
+    key = (os.path.abspath(corpus_file), os.getpid())
+    if key not in _snapshot_corpora:
+        _snapshot_corpora[key] = SnapshotCorpus(corpus_file)
+    return _snapshot_corpora[key]
+
+
+class CorpusSiteSnapshot(SiteSnapshot):
+    """
+    SiteSnapshot that is read from a SnapshotCorpus instead of files.
+    The callstack is infused from the corpus as well, each time the snapshot is read.
+    """
+
+    def __init__(self, url: str, snapshot_corpus: SnapshotCorpus, site_name: str, snapshot_path: str, **kwargs):
+        self.corpus_file = snapshot_corpus.corpus_file
+        self._snapshot_corpus: typing.Optional[SnapshotCorpus] = snapshot_corpus
+        self.site_name = site_name
+        # path of the graphml snapshot within the site, see SnapshotCorpus
+        self.snapshot_path = snapshot_path
+        super(CorpusSiteSnapshot, self).__init__(url, **kwargs)
+
+    @property
+    def snapshot_corpus(self) -> SnapshotCorpus:
+        if self._snapshot_corpus is None:
+            self._snapshot_corpus = get_snapshot_corpus(self.corpus_file)
+        return self._snapshot_corpus
+
+    def __getstate__(self) -> dict:
+        # the sqlite connection stays with this process, e.g. when loaded by a worker process
+        state = self.__dict__.copy()
+        state["_snapshot_corpus"] = None
+        return state
+
+    def _has_snapshot_source(self) -> bool:
+        return True
+
+    def _read_snapshot(self):
+        with self.snapshot_corpus.open_file(self.site_name, self.snapshot_path, mode="rb") as f:
+            self._snapshot = nx.read_graphml(f)
+        if not self.snapshot_name:
+            self.snapshot_name = os.path.basename(self.snapshot_path)
+
+    def _find_callstack_files(self) -> typing.Optional[list]:
+        if self._callstack_files is None:
+            self._callstack_files = self.snapshot_corpus.get_callstack_file_paths(self.site_name, self.snapshot_path)
+        return self._callstack_files
+
+    def _get_callstack_entries(self, callstack_file: str) -> typing.Iterator[dict]:
+        # read once per snapshot, so the entries are streamed instead of kept
+        with self.snapshot_corpus.open_file(self.site_name, callstack_file) as f:
+            yield from iter_initiator_chain_log_entries_from_lines(f)
@@ -0,0 +1,369 @@
+import json
+import logging
+import mmap
+import os
+import typing
+
+import networkx as nx
+import numpy as np
+
+from autofr.common.compression_utils import open_maybe_compressed, remove_compressed_ext
+from autofr.common.exceptions import MissingSnapshotException
+
+logger = logging.getLogger(__name__)
+
+# Binary site snapshot format, written next to the graphml file of a site snapshot.
+# Layout:
+#   magic (8 bytes), header length (uint64 little endian), JSON header, padding to 8 bytes, arrays.
+# The header describes every array (dtype, offset from the start of the arrays, length),
+# the graph attributes and the attribute columns. Arrays are 8 byte aligned so they can be used
+# straight from a memory map. Site snapshots are still used as networkx graphs, so loading one
+# decodes the arrays into a graph: the map saves reading and parsing the file, not building the graph.
+SITE_SNAPSHOT_BINARY_EXT = ".afrsnap"
+# site snapshot after the callstack was infused into it, see SiteSnapshot._infuse_call_stack_to_snapshot
+SITE_SNAPSHOT_INFUSED_EXT = ".infused" + SITE_SNAPSHOT_BINARY_EXT
+SITE_SNAPSHOT_BINARY_MAGIC = b"AFRSNAP\x01"
+SITE_SNAPSHOT_BINARY_VERSION = 1
+_ALIGNMENT = 8
+
+# type tags of attribute values
+ATTR_MISSING = 0
+ATTR_STR = 1
+ATTR_INT = 2
+ATTR_FLOAT = 3
+ATTR_BOOL = 4
+# ints that do not fit into int64 are kept as strings
+ATTR_BIG_INT = 5
+
+# flag columns, node attribute to column name
+FLAG_COLUMNS = {"flg-ad": "flag_ad", "flg-image": "flag_image", "flg-textnode": "flag_textnode"}
+
+_INT64_MIN = np.iinfo(np.int64).min
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+def get_binary_snapshot_path(graphml_file_path: str) -> str:
+    """
+    Path of the binary version of a graphml site snapshot (compressed or not).
+    Binary snapshots are never compressed, they are memory mapped.
+    """
+    graphml_file_path = remove_compressed_ext(graphml_file_path)
+    if graphml_file_path.endswith(".graphml"):
+        graphml_file_path = graphml_file_path[:-len(".graphml")]
+    return graphml_file_path + SITE_SNAPSHOT_BINARY_EXT
+
+
+def is_binary_snapshot_path(file_path: str) -> bool:
+    return file_path.endswith(SITE_SNAPSHOT_BINARY_EXT)
+
+
+def get_infused_snapshot_path(snapshot_file_path: str) -> str:
+    """
+    Path of the callstack infused version of a site snapshot (graphml or binary)
+    """
+    snapshot_file_path = remove_compressed_ext(snapshot_file_path)
+    for ext in (SITE_SNAPSHOT_INFUSED_EXT, SITE_SNAPSHOT_BINARY_EXT, ".graphml"):
+        if snapshot_file_path.endswith(ext):
+            snapshot_file_path = snapshot_file_path[:-len(ext)]
+            break
+    return snapshot_file_path + SITE_SNAPSHOT_INFUSED_EXT
+
+
+def get_files_fingerprint(file_paths: typing.List[str], base_dir: str) -> typing.List[list]:
+    """
+    Path (relative to base_dir), size and mtime of each file, sorted by path.
+    Raises OSError if a file does not exist.
+    """
+    fingerprint = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        fingerprint.append([os.path.relpath(file_path, base_dir), stat.st_size, stat.st_mtime_ns])
+    fingerprint.sort()
+    return fingerprint
+
+
+def has_up_to_date_binary_snapshot(graphml_file_path: str) -> bool:
+    """
+    Whether the binary version exists and is not older than the graphml file
+    """
+    binary_file_path = get_binary_snapshot_path(graphml_file_path)
+    if not os.path.isfile(binary_file_path):
+        return False
+    if not os.path.isfile(graphml_file_path):
+        return True
+    return os.path.getmtime(binary_file_path) >= os.path.getmtime(graphml_file_path)
+
+
+def read_graphml_snapshot(graphml_file_path: str) -> nx.DiGraph:
+    """
+    Reads a graphml site snapshot, which may be gzip compressed
+    """
+    with open_maybe_compressed(graphml_file_path, "rb") as f:
+        return nx.read_graphml(f)
+
+
+class _StringTable:
+    """
+    Interns strings, keeping the order in which they were first seen
+    """
+
+    def __init__(self):
+        self.strings: typing.List[str] = []
+        self._index: typing.Dict[str, int] = dict()
+
+    def add(self, value: str) -> int:
+        index = self._index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self._index[value] = index
+            self.strings.append(value)
+        return index
+
+    def to_arrays(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        encoded = [s.encode("utf-8") for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            offsets[1:] = np.cumsum([len(e) for e in encoded])
+        return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _encode_attribute_value(value: typing.Any, strings: _StringTable) -> typing.Tuple[int, int]:
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool):
+        return ATTR_BOOL, int(value)
+    if isinstance(value, int):
+        if _INT64_MIN <= value <= _INT64_MAX:
+            return ATTR_INT, value
+        return ATTR_BIG_INT, strings.add(str(value))
+    if isinstance(value, float):
+        return ATTR_FLOAT, int(np.array(value, dtype=np.float64).view(np.int64))
+    return ATTR_STR, strings.add(str(value))
+
+
+def _build_attribute_columns(items_data: typing.List[dict], strings: _StringTable) \
+        -> typing.List[typing.Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    One column per attribute name: a type tag and an int64 value per item
+    """
+    names = dict()
+    for data in items_data:
+        for name in data:
+            names.setdefault(name, None)
+
+    columns = []
+    for name in names:
+        tags = np.zeros(len(items_data), dtype=np.uint8)
+        values = np.zeros(len(items_data), dtype=np.int64)
+        for i, data in enumerate(items_data):
+            if name in data:
+                tags[i], values[i] = _encode_attribute_value(data[name], strings)
+        columns.append((name, tags, values))
+    return columns
+
+
+def write_binary_snapshot(g: nx.DiGraph, file_path: str, metadata: dict = None):
+    """
+    Writes the graph with its node, edge and graph attributes in the binary snapshot format.
+    Node and edge order are kept, so the graph read back has the same successor order.
+    Its predecessor order follows the edge order, like a graph read from graphml.
+    metadata: JSON serializable dict kept in the header, see BinarySnapshotReader.get_metadata
+    """
+    # imported here to avoid a circular import
+    from autofr.rl.controlled.site_snapshot import is_node_data_annotated
+
+    strings = _StringTable()
+    node_names = list(g.nodes())
+    node_index = {n: i for i, n in enumerate(node_names)}
+    node_ids = np.array([strings.add(str(n)) for n in node_names], dtype=np.int64)
+    nodes_data = [node_data for _, node_data in g.nodes(data=True)]
+
+    edges = list(g.edges(data=True))
+    edge_sources = np.array([node_index[u] for u, _, _ in edges], dtype=np.int32)
+    edge_targets = np.array([node_index[v] for _, v, _ in edges], dtype=np.int32)
+
+    arrays: typing.List[typing.Tuple[str, np.ndarray]] = [
+        ("node_ids", node_ids),
+        ("edge_sources", edge_sources),
+        ("edge_targets", edge_targets),
+    ]
+    for flag_name, column_name in FLAG_COLUMNS.items():
+        arrays.append((column_name, np.array([bool(is_node_data_annotated(d, flag_name)) for d in nodes_data],
+                                             dtype=np.uint8)))
+
+    attribute_columns = {"node": [], "edge": []}
+    for scope, items_data in (("node", nodes_data), ("edge", [d for _, _, d in edges])):
+        for column_index, (name, tags, values) in enumerate(_build_attribute_columns(items_data, strings)):
+            array_prefix = f"{scope}_attr_{column_index}"
+            attribute_columns[scope].append({"name": name,
+                                             "tags": array_prefix + "_tags",
+                                             "values": array_prefix + "_values"})
+            arrays.append((array_prefix + "_tags", tags))
+            arrays.append((array_prefix + "_values", values))
+
+    string_offsets, string_data = strings.to_arrays()
+    arrays.append(("string_offsets", string_offsets))
+    arrays.append(("string_data", string_data))
+
+    array_descriptions = dict()
+    offset = 0
+    for name, array in arrays:
+        array_descriptions[name] = {"dtype": array.dtype.str, "offset": offset, "length": int(array.shape[0])}
+        offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+    header = {"version": SITE_SNAPSHOT_BINARY_VERSION,
+              "number_of_nodes": len(node_names),
+              "number_of_edges": len(edges),
+              "graph": g.graph,
+              "arrays": array_descriptions,
+              "attribute_columns": attribute_columns,
+              "metadata": metadata or dict()}
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-(len(SITE_SNAPSHOT_BINARY_MAGIC) + 8 + len(header_bytes)) % _ALIGNMENT)
+
+    # write to a temporary file first so readers never see a partial file
+    tmp_file_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_file_path, "wb") as f:
+        f.write(SITE_SNAPSHOT_BINARY_MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for _, array in arrays:
+            data = np.ascontiguousarray(array).tobytes()
+            f.write(data)
+            f.write(b"\0" * (-len(data) % _ALIGNMENT))
+    os.replace(tmp_file_path, file_path)
+
+
+class BinarySnapshotReader:
+    """
+    Opens a binary snapshot through a memory map. Arrays are views over the map, nothing is copied
+    until the graph is built by to_networkx. Use as a context manager, arrays must not be used after closing.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._arrays: typing.Dict[str, np.ndarray] = dict()
+        self._file = open(file_path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            self._file.close()
+            raise MissingSnapshotException(f"Binary snapshot {file_path} is empty") from e
+
+        magic_length = len(SITE_SNAPSHOT_BINARY_MAGIC)
+        if self._mmap[:magic_length] != SITE_SNAPSHOT_BINARY_MAGIC:
+            self.close()
+            raise MissingSnapshotException(f"{file_path} is not a binary snapshot")
+        header_length = int(np.frombuffer(self._mmap, dtype=np.uint64, count=1, offset=magic_length)[0])
+        header_start = magic_length + 8
+        self.header: dict = json.loads(bytes(self._mmap[header_start:header_start + header_length]))
+        if self.header["version"] != SITE_SNAPSHOT_BINARY_VERSION:
+            self.close()
+            raise MissingSnapshotException(f"Binary snapshot {file_path} has unknown version {self.header['version']}")
+        self._arrays_start = header_start + header_length
+
+    def get_metadata(self) -> dict:
+        return self.header.get("metadata", dict())
+
+    def get_array(self, name: str) -> np.ndarray:
+        if name not in self._arrays:
+            description = self.header["arrays"][name]
+            self._arrays[name] = np.frombuffer(self._mmap, dtype=np.dtype(description["dtype"]),
+                                               count=description["length"],
+                                               offset=self._arrays_start + description["offset"])
+        return self._arrays[name]
+
+    def get_flag_column(self, flag_name: str) -> np.ndarray:
+        """
+        Whether each node is annotated with the flag (see FLAG_COLUMNS), in node order
+        """
+        return self.get_array(FLAG_COLUMNS[flag_name]).astype(bool)
+
+    def get_strings(self) -> typing.List[str]:
+        offsets = self.get_array("string_offsets").tolist()
+        data = memoryview(self._mmap)[self._arrays_start + self.header["arrays"]["string_data"]["offset"]:]
+        try:
+            return [str(data[offsets[i]:offsets[i + 1]], "utf-8") for i in range(len(offsets) - 1)]
+        finally:
+            data.release()
+
+    def _decode_columns(self, scope: str, strings: typing.List[str], length: int) -> typing.List[dict]:
+        items_data = [dict() for _ in range(length)]
+        for column in self.header["attribute_columns"][scope]:
+            name = column["name"]
+            tags = self.get_array(column["tags"])
+            values = self.get_array(column["values"])
+            present = np.flatnonzero(tags)
+            tags_list = tags[present].tolist()
+            values_list = values[present].tolist()
+            float_values_list = values[present].view(np.float64).tolist()
+            for i, tag, value, float_value in zip(present.tolist(), tags_list, values_list, float_values_list):
+                if tag == ATTR_STR:
+                    items_data[i][name] = strings[value]
+                elif tag == ATTR_INT:
+                    items_data[i][name] = value
+                elif tag == ATTR_FLOAT:
+                    items_data[i][name] = float_value
+                elif tag == ATTR_BOOL:
+                    items_data[i][name] = bool(value)
+                elif tag == ATTR_BIG_INT:
+                    items_data[i][name] = int(strings[value])
+        return items_data
+
+    def to_networkx(self) -> nx.DiGraph:
+        strings = self.get_strings()
+        node_names = [strings[i] for i in self.get_array("node_ids").tolist()]
+        nodes_data = self._decode_columns("node", strings, len(node_names))
+        edges_data = self._decode_columns("edge", strings, self.header["number_of_edges"])
+
+        g = nx.DiGraph()
+        g.graph.update(self.header["graph"])
+        g.add_nodes_from(zip(node_names, nodes_data))
+        g.add_edges_from((node_names[u], node_names[v], d) for u, v, d in
+                         zip(self.get_array("edge_sources").tolist(), self.get_array("edge_targets").tolist(),
+                             edges_data))
+        return g
+
+    def close(self):
+        # views over the map must be gone before it can be closed
+        self._arrays.clear()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "BinarySnapshotReader":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_binary_snapshot(file_path: str) -> nx.DiGraph:
+    with BinarySnapshotReader(file_path) as reader:
+        return reader.to_networkx()
+
+
+def get_graph_differences(g: nx.DiGraph, other: nx.DiGraph) -> typing.List[str]:
+    """
+    Differences between two graphs: graph attributes, node and edge order, and attributes with their types.
+    Empty if they are the same.
+    """
+    differences = []
+    if g.graph != other.graph:
+        differences.append(f"graph attributes differ: {g.graph} vs {other.graph}")
+    if list(g.nodes()) != list(other.nodes()):
+        differences.append("nodes or node order differ")
+    if list(g.edges()) != list(other.edges()):
+        differences.append("edges or edge order differ")
+    if [(n, list(p)) for n, p in g.pred.items()] != [(n, list(p)) for n, p in other.pred.items()]:
+        differences.append("predecessor order differs")
+
+    def _typed(data: dict) -> dict:
+        return {k: (type(v), v) for k, v in data.items()}
+
+    for n, node_data in g.nodes(data=True):
+        if n in other and _typed(node_data) != _typed(other.nodes[n]):
+            differences.append(f"node {n} attributes differ: {node_data} vs {other.nodes[n]}")
+    for u, v, edge_data in g.edges(data=True):
+        if other.has_edge(u, v) and _typed(edge_data) != _typed(other.edges[u, v]):
+            differences.append(f"edge {u}->{v} attributes differ: {edge_data} vs {other.edges[u, v]}")
+    return differences
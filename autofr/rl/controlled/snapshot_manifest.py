@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import typing
+
+from autofr.common.compression_utils import glob_maybe_compressed, remove_compressed_ext
+from autofr.rl.controlled.snapshot_format import SITE_SNAPSHOT_BINARY_EXT, get_files_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Small JSON file written next to a site snapshot when it is converted,
+# so that snapshots can be selected without loading their graphs
+SITE_SNAPSHOT_MANIFEST_EXT = ".manifest.json"
+SITE_SNAPSHOT_MANIFEST_VERSION = 1
+
+
+def get_manifest_path(snapshot_file_path: str) -> str:
+    """
+    Path of the manifest of a site snapshot (graphml, compressed or not, or binary)
+    """
+    snapshot_file_path = remove_compressed_ext(snapshot_file_path)
+    for ext in (SITE_SNAPSHOT_BINARY_EXT, ".graphml"):
+        if snapshot_file_path.endswith(ext):
+            snapshot_file_path = snapshot_file_path[:-len(ext)]
+            break
+    return snapshot_file_path + SITE_SNAPSHOT_MANIFEST_EXT
+
+
+class SnapshotManifest:
+    """
+    Summary of a site snapshot: sizes, annotation counters, content hash, the eSLDs and FQDNs of its urls
+    and where its related raw files are. Paths are kept relative to the directory of the manifest.
+    """
+
+    def __init__(self,
+                 manifest_file_path: str,
+                 snapshot_name: str = "",
+                 snapshot_fingerprint: typing.List[list] = None,
+                 number_of_nodes: int = 0,
+                 number_of_edges: int = 0,
+                 number_of_ads: int = 0,
+                 number_of_images: int = 0,
+                 number_of_textnodes: int = 0,
+                 content_hash: str = None,
+                 eslds: typing.List[str] = None,
+                 fqdns: typing.List[str] = None,
+                 raw_adgraph_file: str = None,
+                 init_adgraph_dir: str = None,
+                 callstack_files: typing.List[str] = None):
+        self.manifest_file_path = manifest_file_path
+        self.snapshot_name = snapshot_name
+        # see get_files_fingerprint, used to tell whether the snapshot file changed since
+        self.snapshot_fingerprint = snapshot_fingerprint or []
+        self.number_of_nodes = number_of_nodes
+        self.number_of_edges = number_of_edges
+        self.number_of_ads = number_of_ads
+        self.number_of_images = number_of_images
+        self.number_of_textnodes = number_of_textnodes
+        # see CompiledSiteSnapshot.get_content_hash
+        self.content_hash = content_hash
+        self.eslds = eslds or []
+        self.fqdns = fqdns or []
+        self.raw_adgraph_file = raw_adgraph_file
+        self.init_adgraph_dir = init_adgraph_dir
+        self.callstack_files = callstack_files or []
+
+    @staticmethod
+    def get_fingerprint(snapshot_file_path: str) -> typing.List[list]:
+        return get_files_fingerprint([snapshot_file_path], os.path.dirname(os.path.abspath(snapshot_file_path)))
+
+    def _get_base_dir(self) -> str:
+        return os.path.dirname(os.path.abspath(self.manifest_file_path))
+
+    def to_relative_path(self, file_path: typing.Optional[str]) -> typing.Optional[str]:
+        if file_path:
+            return os.path.relpath(file_path, self._get_base_dir())
+
+    def to_absolute_path(self, file_path: typing.Optional[str]) -> typing.Optional[str]:
+        if file_path:
+            return os.path.normpath(os.path.join(self._get_base_dir(), file_path))
+
+    def get_raw_adgraph_file_path(self) -> typing.Optional[str]:
+        return self.to_absolute_path(self.raw_adgraph_file)
+
+    def get_init_adgraph_dir(self) -> typing.Optional[str]:
+        return self.to_absolute_path(self.init_adgraph_dir)
+
+    def get_callstack_file_paths(self) -> typing.List[str]:
+        return [self.to_absolute_path(f) for f in self.callstack_files]
+
+    def is_up_to_date(self, snapshot_file_path: str) -> bool:
+        """
+        Whether the snapshot file has the same size and mtime as when the manifest was written
+        """
+        try:
+            return self.snapshot_fingerprint == self.get_fingerprint(snapshot_file_path)
+        except OSError:
+            return False
+
+    def has_ads(self) -> bool:
+        return self.number_of_ads > 0
+
+    def has_page_content(self) -> bool:
+        return self.number_of_images > 0 or self.number_of_textnodes > 0
+
+    def has_url_variation(self, url_variation: str) -> bool:
+        return url_variation in self.eslds or url_variation in self.fqdns
+
+    def to_json(self) -> dict:
+        return {"version": SITE_SNAPSHOT_MANIFEST_VERSION,
+                "snapshot_name": self.snapshot_name,
+                "snapshot_fingerprint": self.snapshot_fingerprint,
+                "number_of_nodes": self.number_of_nodes,
+                "number_of_edges": self.number_of_edges,
+                "number_of_ads": self.number_of_ads,
+                "number_of_images": self.number_of_images,
+                "number_of_textnodes": self.number_of_textnodes,
+                "content_hash": self.content_hash,
+                "eslds": self.eslds,
+                "fqdns": self.fqdns,
+                "raw_adgraph_file": self.raw_adgraph_file,
+                "init_adgraph_dir": self.init_adgraph_dir,
+                "callstack_files": self.callstack_files}
+
+    @staticmethod
+    def from_json(manifest_file_path: str, value: dict) -> "SnapshotManifest":
+        value = dict(value)
+        value.pop("version", None)
+        return SnapshotManifest(manifest_file_path, **value)
+
+    def save(self):
+        # write to a temporary file first so readers never see a partial file
+        tmp_file_path = f"{self.manifest_file_path}.{os.getpid()}.tmp"
+        with open(tmp_file_path, "w") as f:
+            json.dump(self.to_json(), f, indent=1)
+        os.replace(tmp_file_path, self.manifest_file_path)
+
+
+def read_snapshot_manifest(snapshot_file_path: str) -> typing.Optional[SnapshotManifest]:
+    """
+    Returns the manifest of the snapshot, None if there is none or the snapshot changed since it was written
+    """
+    manifest_file_path = get_manifest_path(snapshot_file_path)
+    if not os.path.isfile(manifest_file_path):
+        return None
+    try:
+        with open(manifest_file_path) as f:
+            value = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.debug(f"Could not read manifest {manifest_file_path}: {e}")
+        return None
+    if value.get("version") != SITE_SNAPSHOT_MANIFEST_VERSION:
+        return None
+
+    manifest = SnapshotManifest.from_json(manifest_file_path, value)
+    if not manifest.is_up_to_date(snapshot_file_path):
+        logger.debug(f"Manifest {manifest_file_path} is outdated")
+        return None
+    return manifest
+
+
+def read_snapshot_manifests(snapshot_dir: str) -> typing.Dict[str, typing.Optional[SnapshotManifest]]:
+    """
+    Graphml snapshot file path to its manifest (None if it has no up to date manifest), sorted by file path
+    """
+    graphml_files = sorted(glob_maybe_compressed(snapshot_dir + os.sep + "*.graphml"))
+    return {f: read_snapshot_manifest(f) for f in graphml_files}
@@ -11,6 +11,7 @@ from autofr.common.utils import clean_url_for_file, get_unique_str
 from autofr.rl.action_space import DEFAULT_Q_VALUE, ActionSpace
 from autofr.rl.controlled.bandits import DomainHierarchyMABControlled
 from autofr.rl.controlled.site_snapshot import SiteSnapshot
+from autofr.rl.controlled.snapshot_corpus import SnapshotCorpus, get_corpus_site_name
 from scripts.common.eval_utils import run_autofr_controlled_given_snapshots, W_VALUE, UCB_CONFIDENCE, GAMMA, \
     ITERATION_MULTIPLIER, REWARD_FUNC, INIT_ITERATIONS
 
@@ -27,6 +28,11 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
                         required=False,
                         default="temp_graphs",
                         help='output directory for saving agent')
+    parser.add_argument('--corpus_file',
+                        required=False,
+                        default=None,
+                        help='Snapshot corpus built from the zips with scripts/build_snapshot_corpus.py. '
+                             'Snapshots are read from it instead of unpacking the zips')
 
     parser.add_argument('--log_level', default="INFO", help='Log level')
 
@@ -52,8 +58,14 @@ def main():
 
     df = pd.read_csv(args.csv_file_path)
 
-    zips_found = glob.glob(args.snapshots_dir + os.sep + "AutoFRGEval*.zip")
-    print(f"Found {len(zips_found)} snapshot zips")
+    corpus = None
+    if args.corpus_file:
+        corpus = SnapshotCorpus(args.corpus_file)
+        zips_found = [args.snapshots_dir + os.sep + site_name + ".zip" for site_name in corpus.get_site_names()]
+        print(f"Found {len(zips_found)} snapshot zips in {args.corpus_file}")
+    else:
+        zips_found = glob.glob(args.snapshots_dir + os.sep + "AutoFRGEval*.zip")
+        print(f"Found {len(zips_found)} snapshot zips")
 
     output_rows = []
     for z in zips_found:
@@ -67,17 +79,25 @@ def main():
             logger.warning(f"Could not find matching row with zip name {zip_file_name}")
             continue
 
-        unpacked_zip_path = z.rstrip(".zip")
         snapshot_directory = None
-        # unzip if we have not and find the snapshot directory
-        if not os.path.isdir(unpacked_zip_path):
-            shutil.unpack_archive(z, args.snapshots_dir)
-        # note that the snapshot_directory is expected to be a subdirectory of the unpacked zip
-        for d in os.listdir(unpacked_zip_path):
-            if os.path.isdir(unpacked_zip_path + os.sep + d):
-                if SiteSnapshot.SNAPSHOT_DIRECTORY_PARTIAL in d:
-                    snapshot_directory = unpacked_zip_path + os.sep + d
-                    break
+        corpus_site_name = None
+        if corpus:
+            # only the small init state files are written to where the zip would be unpacked,
+            # the snapshots are read from the corpus
+            corpus_site_name = get_corpus_site_name(z)
+            snapshot_directory = args.snapshots_dir + os.sep + \
+                os.sep.join(corpus.get_snapshot_dir(corpus_site_name).split("/"))
+        else:
+            unpacked_zip_path = z.rstrip(".zip")
+            # unzip if we have not and find the snapshot directory
+            if not os.path.isdir(unpacked_zip_path):
+                shutil.unpack_archive(z, args.snapshots_dir)
+            # note that the snapshot_directory is expected to be a subdirectory of the unpacked zip
+            for d in os.listdir(unpacked_zip_path):
+                if os.path.isdir(unpacked_zip_path + os.sep + d):
+                    if SiteSnapshot.SNAPSHOT_DIRECTORY_PARTIAL in d:
+                        snapshot_directory = unpacked_zip_path + os.sep + d
+                        break
 
         if not snapshot_directory:
             logger.warning(f"Could not find snapshot directory for {zip_file_name}")
@@ -119,7 +139,9 @@ def main():
                                               default_q_value=DEFAULT_Q_VALUE,
                                               reward_func_name=REWARD_FUNC,
                                               bandit_klass=DomainHierarchyMABControlled,
-                                              action_space_klass=ActionSpace)
+                                              action_space_klass=ActionSpace,
+                                              snapshot_corpus_file=args.corpus_file,
+                                              corpus_site_name=corpus_site_name)
 
         #logger.info(
         #    f"Output dir: \n\t Filter rules saved at {env.output_directory}")
@@ -67,6 +67,13 @@ def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
                         type=str,
                         required=False,
                         help='Name of action space class')
+    parser.add_argument('--snapshot_load_workers',
+                        default=1,
+                        required=False,
+                        type=int,
+                        help='Number of processes used to read in the site snapshots')
+    parser.add_argument('--dedupe_site_snapshots', action='store_true',
+                        help='Keep one site snapshot per content, duplicates only weigh in when choosing snapshots')
     parser.add_argument('--log_level', default="INFO", help='Log level')
 
     return parser
@@ -126,7 +133,9 @@ def main():
                                           default_q_value=args.default_q_value,
                                           reward_func_name=args.reward_func_name,
                                           bandit_klass=bandit_klass,
-                                          action_space_klass=action_space_klass)
+                                          action_space_klass=action_space_klass,
+                                          snapshot_load_workers=args.snapshot_load_workers,
+                                          dedupe_site_snapshots=args.dedupe_site_snapshots)
 
 
     logger.info(
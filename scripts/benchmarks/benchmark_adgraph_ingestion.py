@@ -0,0 +1,520 @@
+#!/usr/bin/python
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+import typing
+
+import networkx as nx
+
+logger = logging.getLogger(__name__)
+
+SITE = "example.com"
+SITE_URL = f"https://www.{SITE}/"
+TAGS = ["DIV", "SPAN", "IMG", "A", "P", "SCRIPT"]
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # OPTIONAL
+    parser.add_argument('--main_events', default=200000, type=int,
+                        help='Number of timeline events of the main frame')
+    parser.add_argument('--iframe_events', default=5000, type=int,
+                        help='Number of timeline events of each iframe')
+    parser.add_argument('--iframes', default=60, type=int,
+                        help='Max number of iframes (nested iframes included)')
+    parser.add_argument('--nodes', default=300000, type=int,
+                        help='Number of nodes of the parsed adgraph to convert into a site snapshot')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic adgraphs')
+    parser.add_argument('--output_directory', default=None,
+                        help='Where the synthetic adgraphs are written, defaults to a temporary directory')
+    parser.add_argument('--log_level', default="INFO", help='Log level')
+
+    return parser
+
+
+def _create_insertion_event(r: random.Random, node_id: int, parent_id: str, tag_name: str,
+                            is_ad: bool = False) -> dict:
+    event = {"node_id": str(node_id), "actor_id": str(r.randint(0, 50)), "node_type": 1, "tag_name": tag_name,
+             "event_type": "NodeInsertion", "node_parent_id": parent_id, "node_previous_sibling_id": "0",
+             "parent_node_type": 1, "timestamp": r.random() * 1e4,
+             "node_attributes": [{"event_type": "NodeAttribute", "attr_name": "id",
+                                  "attr_value": f"n{node_id}-é"}]}
+    if is_ad:
+        event["node_attributes"].append({"event_type": "NodeAttribute", "attr_name": "class",
+                                         "attr_value": "CITP_adBlockerCover ByURL CITP_isAnAd"})
+    return event
+
+
+def _create_timeline(r: random.Random, number_of_events: int, first_node_id: int, first_parent_id: str,
+                     iframe_probability: float, ad_probability: float, next_iframe_id: list,
+                     max_iframes: int) -> tuple:
+    """
+    Returns the timeline and the iframe node ids inserted within it
+    """
+    timeline = []
+    iframe_node_ids = []
+    node_ids = [first_node_id]
+    timeline.append(_create_insertion_event(r, first_node_id, first_parent_id, "HTML"))
+    while len(timeline) < number_of_events:
+        k = r.random()
+        parent_id = str(r.choice(node_ids[-200:]))
+        if k < iframe_probability and next_iframe_id[0] < max_iframes:
+            node_id = first_node_id + len(node_ids)
+            node_ids.append(node_id)
+            timeline.append(_create_insertion_event(r, node_id, parent_id, "IFRAME"))
+            iframe_node_ids.append(str(node_id))
+            next_iframe_id[0] += 1
+        elif k < 0.6:
+            node_id = first_node_id + len(node_ids)
+            node_ids.append(node_id)
+            timeline.append(_create_insertion_event(r, node_id, parent_id, r.choice(TAGS),
+                                                    is_ad=r.random() < ad_probability))
+        elif k < 0.65 and iframe_node_ids:
+            # iframes are sometimes removed again, stitching replaces that event
+            timeline.append({"node_id": r.choice(iframe_node_ids), "actor_id": "0", "event_type": "NodeRemoval",
+                             "node_parent_id": parent_id})
+        else:
+            timeline.append({"actor_id": str(r.randint(0, 50)), "node_id": str(r.choice(node_ids)),
+                             "event_type": "AttrAddition",
+                             "node_attribute": {"event_type": "NodeAttribute", "attr_name": "style",
+                                                "attr_value": "x" * r.randint(0, 80)}})
+    return timeline, iframe_node_ids
+
+
+def generate_raw_adgraphs(input_directory: str, main_events: int, iframe_events: int, max_iframes: int,
+                          seed: int = 0) -> str:
+    """
+    Writes a synthetic main frame adgraph with its (nested) iframe adgraphs, as AdGraph outputs them.
+    Returns the path of the main frame adgraph
+    """
+    r = random.Random(seed)
+    os.makedirs(input_directory, exist_ok=True)
+    next_iframe_id = [0]
+    iframe_probability = min(0.3, 2 * max_iframes / max(1, main_events))
+    timeline, iframe_queue = _create_timeline(r, main_events, 1, "0", iframe_probability, 0.0, next_iframe_id,
+                                              max_iframes)
+    main_file_path = os.path.join(input_directory, f"log_{SITE}_main.json")
+    with open(main_file_path, "w") as f:
+        json.dump({"url": SITE_URL, "is_in_main_frame": True, "frame_owner_id": "0", "timeline": timeline,
+                   "version": 1.5}, f)
+
+    iframe_number = 0
+    while iframe_queue:
+        iframe_node_id = iframe_queue.pop(0)
+        iframe_number += 1
+        # a few iframes have the url of the main frame, they are stitched depending on their first html node
+        url = SITE_URL if r.random() < 0.1 else f"https://ads{iframe_number}.net/frame.html"
+        first_node_id = (iframe_number + 1) * 10 ** 7 if r.random() < 0.9 else 0
+        timeline, nested_iframes = _create_timeline(r, max(1, iframe_events + r.randint(-100, 100)),
+                                                    first_node_id, str(r.randint(1, 5)), 0.01, 0.01,
+                                                    next_iframe_id, max_iframes)
+        iframe_queue.extend(nested_iframes)
+        with open(os.path.join(input_directory, f"log_frameowner{iframe_node_id}_{iframe_number}.json"), "w") as f:
+            json.dump({"url": url, "is_in_main_frame": False, "frame_owner_id": iframe_node_id,
+                       "timeline": timeline}, f)
+    return main_file_path
+
+
+def generate_parsed_adgraph(file_path: str, number_of_nodes: int, seed: int = 0):
+    """
+    Writes a synthetic adgraph as parsed by adgraph-buildgraph (networkx node link format)
+    """
+    r = random.Random(seed)
+    nodes = [{"id": "NODE_1", "info": "HTML"}]
+    links = []
+    for i in range(2, number_of_nodes + 1):
+        k = r.random()
+        if k < 0.3:
+            node = {"id": f"URL_{i}", "info": f"https://cdn{r.randint(0, 500)}.ads{r.randint(0, 50)}.net/p/{i}.js"}
+        elif k < 0.4:
+            node = {"id": f"SCRIPT_{i}", "info": f"https://s{r.randint(0, 100)}.{SITE}/s{i}.js"}
+        else:
+            node = {"id": f"NODE_{i}", "info": r.choice(TAGS)}
+            for flag in ["flg-ad", "flg-image", "flg-textnode"]:
+                if r.random() < 0.05:
+                    node[flag] = "true"
+        nodes.append(node)
+        links.append({"source": nodes[r.randint(0, i - 2)]["id"], "target": node["id"],
+                      "edge_type": r.choice(["dom", "actor", "requestor", "node_to_script"])})
+    with open(file_path, "w") as f:
+        json.dump({"directed": True, "multigraph": False, "graph": {}, "nodes": nodes, "links": links}, f)
+
+
+def stitch_adgraphs_in_memory(site_snapshot, input_directory: str, site_url: str) -> str:
+    """
+    Since each iframe will be outputted as its own adgraph JSON file, we need to stitch together
+    all raw adgraphs in rendering_stream by using the frameowner of each JSON file to map with node ids in the main JSON.
+    How SiteSnapshot.stitch_adgraphs worked before it was streamed: all raw adgraphs are held in memory.
+    Kept to measure the streaming version against and to check that both write the same stitched file.
+    input_directory: is already the directory that holds all raw adgraph files for a given site
+    Returns: the file path of the new stitched together adgraph file
+    """
+    from autofr.common.compression_utils import open_maybe_compressed, remove_compressed_ext
+    from autofr.common.exceptions import BuildingSnapshotException, MissingSnapshotException, \
+        SiteSnapshotException
+    from autofr.common.utils import get_file_from_path_by_key
+    from autofr.rl.controlled.site_snapshot import FLG_AD, IS_IN_MAIN_FRAME, get_main_raw_adgraph_file_path
+
+    def _get_first_html_node_id(json_obj) -> int:
+        main_node_id = -1
+        for event in json_obj["timeline"]:
+            if "tag_name" in event and event["tag_name"].lower() == "html":
+                if "node_id" in event:
+                    main_node_id = int(event["node_id"])
+                    break
+        return main_node_id
+
+    def _should_stitch(main_json, other_json, double_check_main_node_id: int = -1) -> bool:
+        main_url = main_json["url"]
+        other_url = other_json["url"]
+        if main_url != other_url:
+            return True
+
+        main_node_id = _get_first_html_node_id(main_json)
+        other_node_id = _get_first_html_node_id(other_json)
+
+        if double_check_main_node_id != -1 and main_node_id != double_check_main_node_id:
+            raise SiteSnapshotException(
+                f"Could not stitch adgraphs, first HTML node id is wrong. Expected {double_check_main_node_id} vs. Got {main_node_id}")
+
+        # don't stitch if the doc URLs are the same and the node_ids overlap. This is due to a bug
+        #logger.info(f"Should stitch: {main_node_id} vs. {other_node_id}")
+        return main_node_id < other_node_id
+
+    def _get_iframe_node_id(timeline_event: typing.Any) \
+            -> typing.Optional[str]:
+
+        if "event_type" in timeline_event and timeline_event["event_type"] == "NodeInsertion":
+            if "tag_name" in timeline_event and timeline_event["tag_name"].lower() == "iframe":
+                node_id = timeline_event["node_id"]
+                return node_id
+
+        return None
+
+    def _event_has_ad(timeline_event: typing.Any) -> bool:
+        """ Example:
+            "node_id": "20979",
+            "actor_id": "0",
+            "node_type": 1,
+            "tag_name": "DIV",
+            "event_type": "NodeInsertion",
+            "node_parent_id": "20978",
+            "node_previous_sibling_id": "0",
+            "parent_node_type": 11,
+            "node_attributes": [
+                {
+                "event_type": "NodeAttribute",
+                "attr_name": "class",
+                "attr_value": "CITP_adBlockerCover ByURL CITP_isAnAd"
+                },
+            ]
+        """
+        if "event_type" in timeline_event and timeline_event["event_type"] == "NodeInsertion":
+            if "node_attributes" in timeline_event and len(timeline_event["node_attributes"]) > 0:
+                for node_attr in timeline_event["node_attributes"]:
+                    if node_attr["attr_name"] == "class" and "CITP_isAnAd" in node_attr["attr_value"]:
+                        return True
+
+        return False
+
+    def _create_annotate_flg_ad_event(_node_id: str, _actor_id: str = "0") -> dict:
+        """
+            {
+            "actor_id": "107",
+            "node_id": "18380",
+            "node_attribute": {
+                "event_type": "NodeAttribute",
+                "attr_name": "flg-ad",
+                "attr_value": "true"
+            },
+            "event_type": "AttrAddition"
+            },
+        """
+        _event = dict()
+        _event["actor_id"] = _actor_id
+        _event["node_id"] = _node_id
+        _event["event_type"] = "AttrAddition"
+        _event["node_attribute"] = dict()
+        _event["node_attribute"]["event_type"] = "NodeAttribute"
+        _event["node_attribute"]["attr_name"] = FLG_AD
+        _event["node_attribute"]["attr_value"] = "true"
+        return _event
+
+    # logger.debug(f"Finding largest raw adgraph file from {input_directory}")
+    main_file_path = get_main_raw_adgraph_file_path(input_directory, site_url)
+
+    if main_file_path is None:
+        raise MissingSnapshotException(f"A main raw file needs to be found in {input_directory}")
+
+    #logger.debug(f"Found main_file_path {main_file_path}")
+
+    main_file_html_node_id = -1
+    with open_maybe_compressed(main_file_path, "r") as f:
+        main_file_json = json.load(f)
+        if IS_IN_MAIN_FRAME in main_file_json and main_file_json[IS_IN_MAIN_FRAME] != True:
+            raise SiteSnapshotException(
+                f"Did not find correct main file json {main_file_path} , is in main frame: {main_file_json[IS_IN_MAIN_FRAME]}")
+        main_file_html_node_id = _get_first_html_node_id(main_file_json)
+        if site_snapshot.FRAMEOWNER_ID not in main_file_json:
+            logger.debug(f"{site_snapshot.FRAMEOWNER_ID} keyword not there, using old stitching strategy")
+            return site_snapshot.stitch_adgraphs_old(input_directory, site_url)
+
+    # keep hierarchy of iframe nodes
+    iframe_node_g = nx.DiGraph()
+
+    flg_iframe_ids = set()
+    flg_iframe_id_queue = collections.deque()
+    for event in main_file_json["timeline"]:
+        node_id = _get_iframe_node_id(event)
+        if node_id is not None and node_id not in flg_iframe_ids:
+            #logger.debug(f"found flg-frame-id to parse  {node_id}")
+            flg_iframe_id_queue.append(node_id)
+            flg_iframe_ids.add(node_id)
+            iframe_node_g.add_node(node_id)
+
+    #logger.info(f"Iframes found in main JSON: {flg_iframe_ids}")
+
+    # find the file that matches each flg_iframe_id
+    ad_nodes = []
+    while  flg_iframe_id_queue:
+        node_id_curr = flg_iframe_id_queue.popleft()
+
+        # find the file
+        match_file = get_file_from_path_by_key(input_directory, f"log*{site_snapshot.FRAMEOWNER}{node_id_curr}*.json",
+                                               include_compressed=True)
+
+        if not match_file:
+            logger.debug(f"Cannot find adgraph corresponding to {node_id_curr}")
+            continue
+
+        # get the first node parent id, and replace all instances of that with the current node_id
+        timeline_to_add = None
+        with open_maybe_compressed(match_file) as f:
+            match_file_json = json.load(f)
+            # check to see if the match file is a valid file to stitch
+            should_stitch_with_match_file = _should_stitch(main_file_json, match_file_json,
+                                                           double_check_main_node_id=main_file_html_node_id)
+
+            if not should_stitch_with_match_file:
+                logger.debug(f"Skipping stitching of {match_file}")
+
+            if should_stitch_with_match_file:
+                #logger.debug(f"Stitching of {match_file} into {main_file_path}")
+                wrong_node_parent_id = None
+
+                # update the match_file_json because it will have the wrong node_parent_id
+                for tmp_event in match_file_json["timeline"]:
+                    if not wrong_node_parent_id and "node_parent_id" in tmp_event:
+                        wrong_node_parent_id = tmp_event["node_parent_id"]
+                        #logger.debug(
+                        #    f"wrong node parent id found: {wrong_node_parent_id}, will replace with {node_id_curr}")
+
+                    # for every event that has the wrong_node_parent_id, replace it with the node_id_curr
+                    if wrong_node_parent_id and "node_parent_id" in tmp_event \
+                            and tmp_event["node_parent_id"] == wrong_node_parent_id:
+                        tmp_event["node_parent_id"] = node_id_curr
+
+                    tmp_event_has_ads = _event_has_ad(tmp_event)
+                    if tmp_event_has_ads:
+                        ad_nodes.append(node_id_curr)
+
+                    # add more if this file also has flg_iframe_id to deal with nested iframes
+                    node_id_tmp = _get_iframe_node_id(tmp_event)
+                    if node_id_tmp is not None and node_id_tmp not in flg_iframe_ids:
+                        #logger.debug(f"found iframe node to parse {node_id_tmp}")
+                        flg_iframe_id_queue.append(node_id_tmp)
+                        flg_iframe_ids.add(node_id_tmp)
+                        iframe_node_g.add_node(node_id_tmp)
+                        iframe_node_g.add_edge(node_id_curr, node_id_tmp)
+
+                timeline_to_add = match_file_json["timeline"]
+
+        if timeline_to_add:
+            # find the last occurrence of node_id in the main_file_json
+            index_found = None
+            remove_event_at_index = False
+            for index, tmp_event in enumerate(reversed(main_file_json["timeline"]), start=0):
+                if "node_id" in tmp_event and tmp_event["node_id"] == node_id_curr:
+                    index_found = index
+                    # if the last event is a NodeRemoval event, then remove it, since we want to ignore it
+                    if "event_type" in tmp_event and tmp_event["event_type"] == "NodeRemoval":
+                        remove_event_at_index = True
+                    break
+
+            if index_found is None:
+                raise BuildingSnapshotException(
+                    f"Index to add cannot be None for {node_id_curr}")
+
+            if remove_event_at_index:
+                remove_at_index = (-1 * index_found) - 1
+                del main_file_json["timeline"][remove_at_index]
+                #logger.debug(f"removing event from main file at index: {remove_at_index}")
+                # replace it at the node we just deleted
+                replace_at_index = (-1 * index_found)
+            else:
+                # replace it at the node+1 of index_found
+                replace_at_index = (-1 * index_found) + 1
+
+            #logger.debug(f"inserting new timeline into index: {replace_at_index}")
+            if replace_at_index < 0:
+                # update the main_file_json
+                main_file_json["timeline"][replace_at_index:replace_at_index] = timeline_to_add
+            else:
+                main_file_json["timeline"] += timeline_to_add
+
+    # annotate the found ad_nodes in the main_file_json
+    #logger.debug(f"Number of ad nodes found {set(ad_nodes)}")
+    top_most_ad_nodes = []
+    for ad_node in set(ad_nodes):
+        found_anc = False
+        for anc in nx.ancestors(iframe_node_g, ad_node):
+            if iframe_node_g.in_degree(anc) == 0:
+                top_most_ad_nodes.append(anc)
+                found_anc = True
+                break
+        if not found_anc:
+            top_most_ad_nodes.append(ad_node)
+
+    # must be sorted because we are going through the timeline once
+    top_most_ad_nodes = list(set(top_most_ad_nodes))
+    top_most_ad_nodes.sort(key=lambda x: int(x))
+    #logger.debug(f"Number of top ad nodes found {top_most_ad_nodes}")
+
+    curr_index = 0
+    curr_len = len(main_file_json["timeline"])
+    for node_id in top_most_ad_nodes:
+        # main_file_json["timeline"].append(_create_annotate_flg_ad_event(node_id))
+        while (curr_index < curr_len):
+            event = main_file_json["timeline"][curr_index]
+            found_match = False
+            if "event_type" in event and event["event_type"] == "NodeInsertion" and event["node_id"] == node_id:
+                #logger.debug(f"Found location {curr_index + 1} to add flg-ad=true event")
+                main_file_json["timeline"].insert(curr_index + 1, _create_annotate_flg_ad_event(node_id))
+                curr_index += 1
+                curr_len += 1
+                found_match = True
+            curr_index += 1
+            if found_match:
+                break
+
+    # output a new json with everything stitched together
+    # the stitched file is read by adgraph-buildgraph, it is never compressed
+    new_main_file_path = remove_compressed_ext(main_file_path)[:-len(".json")] + "_all.json"
+    with open(new_main_file_path, "w") as f:
+        json.dump(main_file_json, f)
+        #logger.debug(f"outputted new stitched raw adgraph at {new_main_file_path}")
+
+    return new_main_file_path
+
+
+def _stitch_in_memory(input_directory: str) -> str:
+    from autofr.rl.controlled.site_snapshot import SiteSnapshot
+    return stitch_adgraphs_in_memory(object.__new__(SiteSnapshot), input_directory, SITE_URL)
+
+
+def _stitch_streaming(input_directory: str) -> str:
+    from autofr.rl.controlled.site_snapshot import SiteSnapshot
+    return SiteSnapshot.stitch_adgraphs(object.__new__(SiteSnapshot), input_directory, SITE_URL)
+
+
+def _json_load(file_path: str):
+    # what converting a parsed adgraph needed at least before it was streamed
+    with open(file_path) as f:
+        json.load(f)
+
+
+def _convert_streaming(file_path: str, output_directory: str):
+    from autofr.rl.controlled.site_snapshot import convert_adgrahph_to_site_snapshot
+    convert_adgrahph_to_site_snapshot(file_path, SITE, output_directory)
+
+
+def _run_measured(target, args: tuple, queue: multiprocessing.Queue):
+    # import everything first, so that only the peak of the target itself is measured on top of it
+    import autofr.rl.controlled.site_snapshot
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    before = time.time()
+    result = target(*args)
+    elapsed = time.time() - before
+    queue.put((elapsed, rss_before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, result))
+
+
+def run_measured(target, *args) -> tuple:
+    """
+    Runs target in a new process. Returns seconds, peak RSS in MB, peak RSS increase in MB and what target returned
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_measured, args=(target, args, queue))
+    process.start()
+    elapsed, rss_before, rss_after, result = queue.get()
+    process.join()
+    # ru_maxrss is in KB on linux
+    return elapsed, rss_after / 1024, (rss_after - rss_before) / 1024, result
+
+
+def get_file_hash(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures time and peak RSS of stitching raw adgraphs and converting a parsed adgraph, '
+                    'in memory vs. streamed, using synthetic adgraphs.')
+
+    parser = add_arguments(parser)
+
+    args = parser.parse_args()
+    print(args)
+
+    numeric_level = getattr(logging, args.log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.log_level)
+    logging.basicConfig(format='%(asctime)s %(module)s - %(message)s', level=numeric_level)
+
+    output_directory = args.output_directory or tempfile.mkdtemp(prefix="adgraph_ingestion_")
+    input_directory = os.path.join(output_directory, "raw")
+    main_file_path = generate_raw_adgraphs(input_directory, args.main_events, args.iframe_events, args.iframes,
+                                           seed=args.seed)
+    raw_size = sum(os.path.getsize(os.path.join(input_directory, f)) for f in os.listdir(input_directory))
+    logger.info(f"Raw adgraphs: {len(os.listdir(input_directory))} files, {raw_size / 2 ** 20:.1f} MB")
+
+    parsed_file_path = os.path.join(output_directory, "parsed_adgraph.json")
+    generate_parsed_adgraph(parsed_file_path, args.nodes, seed=args.seed)
+    logger.info(f"Parsed adgraph: {args.nodes} nodes, {os.path.getsize(parsed_file_path) / 2 ** 20:.1f} MB")
+
+    rows = []
+    stitched_hashes = dict()
+    for name, target in (("stitch in memory", _stitch_in_memory), ("stitch streaming", _stitch_streaming)):
+        elapsed, peak_rss, peak_rss_increase, stitched_file_path = run_measured(target, input_directory)
+        stitched_hashes[name] = get_file_hash(stitched_file_path)
+        os.remove(stitched_file_path)
+        rows.append((name, elapsed, peak_rss, peak_rss_increase))
+
+    rows.append(("json.load parsed adgraph", *run_measured(_json_load, parsed_file_path)[:3]))
+    snapshot_directory = os.path.join(output_directory, "snapshots")
+    rows.append(("convert streaming", *run_measured(_convert_streaming, parsed_file_path, snapshot_directory)[:3]))
+
+    print(f"{'':28}{'seconds':>10}{'peak RSS MB':>14}{'increase MB':>14}")
+    for name, elapsed, peak_rss, peak_rss_increase in rows:
+        print(f"{name:28}{elapsed:10.2f}{peak_rss:14.1f}{peak_rss_increase:14.1f}")
+
+    same_output = len(set(stitched_hashes.values())) == 1
+    print(f"Stitched files are the same: {same_output}")
+
+    if not args.output_directory:
+        shutil.rmtree(output_directory)
+    if not same_output:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmark_adgraph_ingestion import SITE, SITE_URL, generate_parsed_adgraph, generate_raw_adgraphs
+
+from autofr.common.action_space_utils import get_initiator_chain_log_entries
+from autofr.common.compression_utils import COMPRESS_LEVEL, compress_file
+from autofr.rl.controlled.site_snapshot import AdgraphTimelineIndex, convert_adgrahph_to_site_snapshot
+from autofr.rl.controlled.snapshot_format import read_graphml_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # OPTIONAL
+    parser.add_argument('--perf_log_entries', default=100000, type=int,
+                        help='Number of Network.requestWillBeSent entries of the perf log')
+    parser.add_argument('--main_events', default=200000, type=int,
+                        help='Number of timeline events of the main frame raw adgraph')
+    parser.add_argument('--nodes', default=100000, type=int,
+                        help='Number of nodes of the site snapshot')
+    parser.add_argument('--compress_level', default=COMPRESS_LEVEL, type=int, help='gzip compression level')
+    parser.add_argument('--repeat', default=3, type=int, help='Loads per file, the fastest one is reported')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic files')
+    parser.add_argument('--output_directory', default=None,
+                        help='Where the synthetic files are written, defaults to a temporary directory')
+    parser.add_argument('--log_level', default="INFO", help='Log level')
+
+    return parser
+
+
+def generate_perf_log(file_path: str, number_of_entries: int, seed: int = 0):
+    """
+    Writes a synthetic chrome performance log, as selenium_utils.output_performance_logs does
+    """
+    r = random.Random(seed)
+    with open(file_path, "w") as f:
+        for i in range(number_of_entries):
+            params = {"documentURL": SITE_URL, "timestamp": r.random() * 1e4, "requestId": str(i),
+                      "request": {"url": f"https://cdn{r.randint(0, 500)}.ads{r.randint(0, 50)}.net/p/{i}.js",
+                                  "method": "GET", "headers": {"User-Agent": "Mozilla/5.0"}},
+                      "initiator": {"type": "script",
+                                    "stack": {"callFrames": [{"scriptId": str(r.randint(0, 1000)),
+                                                              "url": f"https://s{r.randint(0, 100)}.{SITE}/s.js",
+                                                              "functionName": "f", "lineNumber": r.randint(0, 500),
+                                                              "columnNumber": r.randint(0, 80)}]}}}
+            message = {"message": {"method": "Network.requestWillBeSent", "params": params}}
+            f.write(json.dumps({"level": "INFO", "message": json.dumps(message), "timestamp": i}) + "\n")
+
+
+def measure_load(load, file_path: str, repeat: int) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        before = time.time()
+        load(file_path)
+        elapsed.append(time.time() - before)
+    return min(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures size and load time of perf logs, raw adgraphs and graphml site snapshots, '
+                    'uncompressed vs. gzip compressed, using synthetic files.')
+
+    parser = add_arguments(parser)
+
+    args = parser.parse_args()
+    print(args)
+
+    numeric_level = getattr(logging, args.log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.log_level)
+    logging.basicConfig(format='%(asctime)s %(module)s - %(message)s', level=numeric_level)
+
+    output_directory = args.output_directory or tempfile.mkdtemp(prefix="compressed_storage_")
+    os.makedirs(output_directory, exist_ok=True)
+
+    perf_log_file_path = os.path.join(output_directory, "benchmark--cvwebrequests.json")
+    generate_perf_log(perf_log_file_path, args.perf_log_entries, seed=args.seed)
+
+    raw_file_path = generate_raw_adgraphs(os.path.join(output_directory, "raw"), args.main_events, 0, 0,
+                                          seed=args.seed)
+
+    parsed_file_path = os.path.join(output_directory, "parsed_adgraph.json")
+    generate_parsed_adgraph(parsed_file_path, args.nodes, seed=args.seed)
+    snapshot_directory = os.path.join(output_directory, "snapshots")
+    _, graphml_name = convert_adgrahph_to_site_snapshot(parsed_file_path, SITE, snapshot_directory, compress=False)
+    graphml_file_path = os.path.join(snapshot_directory, graphml_name)
+
+    targets = [("perf log", perf_log_file_path, get_initiator_chain_log_entries),
+               ("raw adgraph", raw_file_path, AdgraphTimelineIndex),
+               ("graphml snapshot", graphml_file_path, read_graphml_snapshot)]
+
+    print(f"{'':20}{'plain MB':>10}{'gzip MB':>10}{'ratio':>8}{'plain s':>10}{'gzip s':>10}{'slowdown':>10}")
+    for name, file_path, load in targets:
+        before = time.time()
+        compressed_file_path = compress_file(file_path, remove_original=False, compresslevel=args.compress_level)
+        compress_elapsed = time.time() - before
+        logger.info(f"Compressed {name} in {compress_elapsed:.2f}s")
+
+        plain_size = os.path.getsize(file_path)
+        compressed_size = os.path.getsize(compressed_file_path)
+        plain_elapsed = measure_load(load, file_path, args.repeat)
+        compressed_elapsed = measure_load(load, compressed_file_path, args.repeat)
+        print(f"{name:20}{plain_size / 2 ** 20:10.1f}{compressed_size / 2 ** 20:10.1f}"
+              f"{plain_size / compressed_size:8.1f}{plain_elapsed:10.2f}{compressed_elapsed:10.2f}"
+              f"{compressed_elapsed / plain_elapsed:10.2f}")
+
+    if not args.output_directory:
+        shutil.rmtree(output_directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmark_adgraph_ingestion import SITE, SITE_URL
+
+from autofr.common.action_space_utils import TYPE_ESLD, find_duplicate_nodes, \
+    find_duplicate_nodes_by_simple_paths, get_initiator_chain_graph_by_type, get_initiator_chain_graph_raw, \
+    remove_node_and_connect
+
+logger = logging.getLogger(__name__)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # OPTIONAL
+    parser.add_argument('--depths', default="4,6,8,10,12,16,32",
+                        help='Comma separated depths of the initiator chains, one synthetic perf log each')
+    parser.add_argument('--width', default=8, type=int, help='Number of scripts per level of the chains')
+    parser.add_argument('--initiators', default=3, type=int,
+                        help='Number of scripts of the level above that request each script')
+    parser.add_argument('--domains', default=40, type=int,
+                        help='Number of eSLDs the scripts are spread over, fewer means more duplicates')
+    parser.add_argument('--simple_paths_timeout', default=60, type=int,
+                        help='Seconds after which going over all simple paths is given up')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic perf logs')
+    parser.add_argument('--output_directory', default=None,
+                        help='Where the synthetic perf logs are written, defaults to a temporary directory')
+    parser.add_argument('--log_level', default="INFO", help='Log level')
+
+    return parser
+
+
+def generate_initiator_chain_perf_log(file_path: str, depth: int, width: int, initiators: int, domains: int,
+                                      seed: int = 0):
+    """
+    Writes a synthetic chrome performance log whose scripts are requested level by level, each script by
+    several scripts of the level above, so the number of paths through the chains grows exponentially with depth
+    """
+    r = random.Random(seed)
+    levels = [[f"https://cdn.ads{r.randrange(domains)}.net/l{level}/s{i}.js" for i in range(width)]
+              for level in range(depth)]
+    timestamp = 0
+    with open(file_path, "w") as f:
+        for level, urls in enumerate(levels):
+            for url in urls:
+                parent_urls = r.sample(levels[level - 1], min(initiators, width)) if level > 0 else [SITE_URL]
+                for parent_url in parent_urls:
+                    timestamp += 1
+                    params = {"documentURL": SITE_URL, "timestamp": timestamp, "requestId": str(timestamp),
+                              "request": {"url": url, "method": "GET"},
+                              "initiator": {"type": "script",
+                                            "stack": {"callFrames": [{"url": parent_url, "functionName": "f",
+                                                                      "lineNumber": 1, "columnNumber": 1}]}}}
+                    message = {"message": {"method": "Network.requestWillBeSent", "params": params}}
+                    f.write(json.dumps({"level": "INFO", "message": json.dumps(message),
+                                        "timestamp": timestamp}) + "\n")
+
+
+def _find_duplicate_nodes_by_simple_paths(g, root: str, url_type: str) -> tuple:
+    before = time.time()
+    rounds = find_duplicate_nodes_by_simple_paths(g, root, url_type)
+    return rounds, time.time() - before
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures removing duplicate nodes of initiator chain graphs, topological vs. going over '
+                    'all simple paths, as the chains of synthetic perf logs get deeper.')
+
+    parser = add_arguments(parser)
+
+    args = parser.parse_args()
+    print(args)
+
+    numeric_level = getattr(logging, args.log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.log_level)
+    logging.basicConfig(format='%(asctime)s %(module)s - %(message)s', level=numeric_level)
+
+    output_directory = args.output_directory or tempfile.mkdtemp(prefix="initiator_chain_graph_")
+    os.makedirs(output_directory, exist_ok=True)
+
+    print(f"{'depth':>6}{'nodes':>8}{'edges':>8}{'removed':>9}{'topological s':>15}{'graph s':>9}"
+          f"{'simple paths s':>16}{'same':>6}")
+    for depth in [int(d) for d in args.depths.split(",")]:
+        perf_log_file_path = os.path.join(output_directory, f"depth{depth}--cvwebrequests.json")
+        generate_initiator_chain_perf_log(perf_log_file_path, depth, args.width, args.initiators, args.domains,
+                                          seed=args.seed)
+        g_raw = get_initiator_chain_graph_raw(perf_log_file_path, SITE, save_raw_initiator_chain=False)
+
+        # same graph that get_initiator_chain_graph_by_type removes duplicates from
+        g = g_raw.copy()
+        for n in [n for n in g.nodes if g.nodes[n].get(TYPE_ESLD) == SITE]:
+            remove_node_and_connect(g, n)
+
+        before = time.time()
+        rounds = find_duplicate_nodes(g, SITE, TYPE_ESLD)
+        topological_elapsed = time.time() - before
+
+        before = time.time()
+        get_initiator_chain_graph_by_type(TYPE_ESLD, perf_log_file_path, SITE, g_raw_initiator_chain=g_raw,
+                                          save_raw_initiator_chain=False)
+        graph_elapsed = time.time() - before
+
+        # the simple paths run in a process of their own, so they can be given up on
+        with multiprocessing.Pool(1) as pool:
+            result = pool.apply_async(_find_duplicate_nodes_by_simple_paths, (g, SITE, TYPE_ESLD))
+            try:
+                simple_paths_rounds, simple_paths_elapsed = result.get(timeout=args.simple_paths_timeout)
+                same = [set(r) for r in rounds] == [set(r) for r in simple_paths_rounds]
+                simple_paths = f"{simple_paths_elapsed:16.2f}{str(same):>6}"
+            except multiprocessing.TimeoutError:
+                pool.terminate()
+                simple_paths = f"{'> ' + str(args.simple_paths_timeout):>16}{'-':>6}"
+
+        print(f"{depth:6}{g.number_of_nodes():8}{g.number_of_edges():8}{sum(len(r) for r in rounds):9}"
+              f"{topological_elapsed:15.3f}{graph_elapsed:9.3f}{simple_paths}")
+
+    if not args.output_directory:
+        shutil.rmtree(output_directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from benchmark_adgraph_ingestion import SITE, SITE_URL
+
+from autofr.common import perf_log_utils
+from autofr.common.compression_utils import glob_maybe_compressed, open_maybe_compressed
+from autofr.common.perf_log_utils import ParsedPerfLog, iter_initiator_chain_log_entries, \
+    iter_request_will_be_sent_params
+from autofr.common.utils import should_skip_perf_url
+
+logger = logging.getLogger(__name__)
+
+# events that chrome logs next to Network.requestWillBeSent
+OTHER_METHODS = ["Network.requestWillBeSentExtraInfo", "Network.responseReceived",
+                 "Network.responseReceivedExtraInfo", "Network.dataReceived", "Network.loadingFinished",
+                 "Page.frameStartedLoading", "Page.frameNavigated", "Page.lifecycleEvent"]
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # OPTIONAL
+    parser.add_argument('--perf_log_pattern', default=None,
+                        help='Glob of real perf logs (*--cvwebrequests.json), the largest ones are used. '
+                             'Defaults to a synthetic perf log')
+    parser.add_argument('--largest', default=3, type=int, help='Number of the largest perf logs to use')
+    parser.add_argument('--lines', default=500000, type=int, help='Number of lines of the synthetic perf log')
+    parser.add_argument('--request_fraction', default=0.15, type=float,
+                        help='Fraction of the synthetic lines that are Network.requestWillBeSent events')
+    parser.add_argument('--chunk_size', default=perf_log_utils.PERF_LOG_SORT_CHUNK_SIZE, type=int,
+                        help='Entries kept in memory by the streaming reader')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic perf log')
+    parser.add_argument('--output_directory', default=None,
+                        help='Where the synthetic perf log is written, defaults to a temporary directory')
+    parser.add_argument('--log_level', default="INFO", help='Log level')
+
+    return parser
+
+
+def generate_mixed_perf_log(file_path: str, number_of_lines: int, request_fraction: float, seed: int = 0):
+    """
+    Writes a synthetic chrome performance log where only request_fraction of the lines are
+    Network.requestWillBeSent events, with timestamps slightly out of order like real logs
+    """
+    r = random.Random(seed)
+    with open(file_path, "w") as f:
+        for i in range(number_of_lines):
+            timestamp = i / 100 + r.random()
+            if r.random() < request_fraction:
+                params = {"documentURL": SITE_URL, "timestamp": timestamp, "requestId": str(i),
+                          "request": {"url": f"https://cdn{r.randint(0, 500)}.ads{r.randint(0, 50)}.net/p/{i}.js",
+                                      "method": "GET", "headers": {"User-Agent": "Mozilla/5.0"}},
+                          "initiator": {"type": "script",
+                                        "stack": {"callFrames": [{"scriptId": str(r.randint(0, 1000)),
+                                                                  "url": f"https://s{r.randint(0, 100)}.{SITE}/s.js",
+                                                                  "functionName": "f",
+                                                                  "lineNumber": r.randint(0, 500),
+                                                                  "columnNumber": r.randint(0, 80)}]}}}
+                message = {"message": {"method": "Network.requestWillBeSent", "params": params}}
+            else:
+                params = {"requestId": str(r.randint(0, i + 1)), "timestamp": timestamp,
+                          "encodedDataLength": r.randint(0, 1 << 16),
+                          "headers": {"content-type": "text/html", "cache-control": "max-age=0"}}
+                message = {"message": {"method": r.choice(OTHER_METHODS), "params": params}}
+            f.write(json.dumps({"level": "INFO", "message": json.dumps(message, separators=(",", ":")),
+                                "timestamp": i}) + "\n")
+
+
+def read_without_prefilter(file_path: str) -> list:
+    """
+    How initiator chain entries were read before: both json levels of every line are decoded, then sorted
+    """
+    log_entries = []
+    with open_maybe_compressed(file_path) as f:
+        for line in f:
+            try:
+                line_json = json.loads(line.strip())
+                message_json = json.loads(line_json["message"])
+                if "Network.requestWillBeSent" == message_json["message"]["method"]:
+                    if not should_skip_perf_url(message_json["message"]["params"]["documentURL"]):
+                        log_entries.append(message_json["message"]["params"])
+            except Exception as e:
+                logger.warning("Could not parse json of perf log %s", str(e))
+    return sorted(log_entries, key=lambda x: x["timestamp"])
+
+
+def read_with_prefilter(file_path: str, loads=json.loads) -> list:
+    with open_maybe_compressed(file_path) as f:
+        log_entries = [params for params in iter_request_will_be_sent_params(f, loads=loads)
+                       if not should_skip_perf_url(params["documentURL"])]
+    return sorted(log_entries, key=lambda x: x["timestamp"])
+
+
+def read_parsed_perf_log(file_path: str) -> list:
+    with open_maybe_compressed(file_path) as f:
+        return ParsedPerfLog(f, file_path=file_path).log_entries
+
+
+def measure(read, iterate, file_path: str) -> tuple:
+    """
+    Returns the entries read, the seconds it took and the peak MB traced while going over them with iterate
+    """
+    before = time.time()
+    entries = read(file_path)
+    elapsed = time.time() - before
+
+    tracemalloc.start()
+    for _ in iterate(file_path):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return entries, elapsed, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures reading the initiator chain entries of perf logs: decoding every line vs. '
+                    'prefiltering lines, json vs. orjson, and streaming with bounded memory.')
+
+    parser = add_arguments(parser)
+
+    args = parser.parse_args()
+    print(args)
+
+    numeric_level = getattr(logging, args.log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.log_level)
+    logging.basicConfig(format='%(asctime)s %(module)s - %(message)s', level=numeric_level)
+
+    output_directory = None
+    if args.perf_log_pattern:
+        perf_log_files = sorted(glob_maybe_compressed(args.perf_log_pattern, recursive=True),
+                                key=os.path.getsize, reverse=True)[:args.largest]
+    else:
+        output_directory = args.output_directory or tempfile.mkdtemp(prefix="perf_log_reader_")
+        os.makedirs(output_directory, exist_ok=True)
+        perf_log_file_path = os.path.join(output_directory, "benchmark--cvwebrequests.json")
+        generate_mixed_perf_log(perf_log_file_path, args.lines, args.request_fraction, seed=args.seed)
+        perf_log_files = [perf_log_file_path]
+
+    def iter_streaming(f):
+        return iter_initiator_chain_log_entries(f, chunk_size=args.chunk_size)
+
+    # name, how to read all entries, how to go over them for the peak memory
+    readers = [("no prefilter, json", read_without_prefilter, read_without_prefilter),
+               ("prefilter, json", read_with_prefilter, read_with_prefilter)]
+    if perf_log_utils.orjson is not None:
+        def read_with_orjson(f):
+            return read_with_prefilter(f, loads=perf_log_utils.orjson.loads)
+        readers.append(("prefilter, orjson", read_with_orjson, read_with_orjson))
+    else:
+        logger.info("orjson is not installed, skipping it")
+    readers += [("ParsedPerfLog", read_parsed_perf_log, read_parsed_perf_log),
+                (f"streaming, {args.chunk_size} in memory", lambda f: list(iter_streaming(f)), iter_streaming)]
+
+    for file_path in perf_log_files:
+        print(f"{file_path} ({os.path.getsize(file_path) / 2 ** 20:.1f} MB)")
+        print(f"{'':34}{'entries':>10}{'s':>8}{'speedup':>9}{'peak MB':>9}")
+        expected_entries, baseline_elapsed = None, None
+        for name, read, iterate in readers:
+            entries, elapsed, peak = measure(read, iterate, file_path)
+            if expected_entries is None:
+                expected_entries, baseline_elapsed = entries, elapsed
+            elif entries != expected_entries:
+                logger.error(f"{name} read different entries than the reader without prefilter")
+            print(f"{name:34}{len(entries):10}{elapsed:8.2f}{baseline_elapsed / elapsed:9.1f}{peak:9.1f}")
+
+    if output_directory and not args.output_directory:
+        shutil.rmtree(output_directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+import zipfile
+
+from autofr.common.exceptions import MissingSnapshotException
+from autofr.rl.controlled.snapshot_corpus import SnapshotCorpus
+
+logger = logging.getLogger(__name__)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # REQUIRED
+    parser.add_argument('--snapshots_dir', required=True,
+                        help='Path to a directory that holds the original zips from the AutoFR dataset')
+    # OPTIONAL
+    parser.add_argument('--corpus_file', default=None,
+                        help='Snapshot corpus to add the zips to, defaults to a corpus file within snapshots_dir')
+    parser.add_argument('--zip_pattern', default="AutoFRGEval*.zip", help='Pattern of the zips within snapshots_dir')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Ingest zips again even if they have not changed since they were ingested')
+    parser.add_argument('--log_level', default="INFO", help='Log level')
+
+    return parser
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Ingests the zips of the AutoFR dataset once into a snapshot corpus, '
+                    'which site snapshots are then read from without unpacking the zips.')
+
+    parser = add_arguments(parser)
+
+    args = parser.parse_args()
+    print(args)
+
+    numeric_level = getattr(logging, args.log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.log_level)
+    logging.basicConfig(format='%(asctime)s %(module)s - %(message)s', level=numeric_level)
+
+    corpus_file = args.corpus_file or SnapshotCorpus.get_corpus_file(args.snapshots_dir)
+    zips_found = sorted(glob.glob(args.snapshots_dir + os.sep + args.zip_pattern))
+    logger.info(f"Found {len(zips_found)} snapshot zips in {args.snapshots_dir}")
+
+    failed = []
+    ingested = 0
+    before = time.time()
+    with SnapshotCorpus(corpus_file) as corpus:
+        for z in zips_found:
+            try:
+                ingested += corpus.ingest_zip(z, overwrite=args.overwrite)
+            except (MissingSnapshotException, zipfile.BadZipFile) as e:
+                logger.error(f"Could not ingest {z}: {e}")
+                failed.append(z)
+        sites = len(corpus.get_site_names())
+
+    logger.info(f"Ingested {ingested} zips in {time.time() - before:.3f}s, "
+                f"{corpus_file} has {sites} sites ({os.path.getsize(corpus_file) / 2 ** 20:.1f} MB)")
+    if failed:
+        logger.error(f"{len(failed)} zips could not be ingested: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -107,6 +107,10 @@ def run_autofr_controlled_given_snapshots(site_url: str,
                                           autofrg_env_klass: typing.Callable = AutoFRControlledEnvironment,
                                           bandit_klass: typing.Callable = DomainHierarchyMABControlled,
                                           action_space_klass: typing.Callable = ActionSpace,
+                                          snapshot_load_workers: int = 1,
+                                          snapshot_corpus_file: str = None,
+                                          corpus_site_name: str = None,
+                                          dedupe_site_snapshots: bool = False,
                                           ) \
         -> typing.Tuple[AutoFRControlledEnvironment, AutoFRResults]:
     base_name = os.path.basename(output_directory)
@@ -116,7 +120,11 @@ def run_autofr_controlled_given_snapshots(site_url: str,
                           base_name=base_name,
                           reward_func_name=reward_func_name,
                           choose_snapshot_random=choose_snapshot_random,
-                          use_snapshot_cache=use_snapshot_cache)
+                          use_snapshot_cache=use_snapshot_cache,
+                          snapshot_load_workers=snapshot_load_workers,
+                          snapshot_corpus_file=snapshot_corpus_file,
+                          corpus_site_name=corpus_site_name,
+                          dedupe_site_snapshots=dedupe_site_snapshots)
 
     policy = DomainHierarchyUCBPolicy(confidence_level=confidence_ucb)
     agent = agent_klass(bandit,
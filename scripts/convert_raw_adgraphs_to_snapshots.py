@@ -0,0 +1,114 @@
+#!/usr/bin/python
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+
+from autofr.common.compression_utils import glob_maybe_compressed
+from autofr.rl.browser_env.browser_adgraph_env import ADGRAPH_DIR
+from autofr.rl.controlled.site_snapshot import ADGRAPH_NETWORKX, INIT_ADGRAPH, convert_raw_adgraph_files, \
+    convert_raw_adgraph_files_in_batch, get_main_raw_adgraph_file_path
+
+logger = logging.getLogger(__name__)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # REQUIRED
+    parser.add_argument('--adgraph_snapshots_dir', required=True,
+                        help=f'Directory that is searched recursively for {INIT_ADGRAPH} directories with raw adgraphs')
+    parser.add_argument('--url', required=True, help='Site that the raw adgraphs are from')
+    # OPTIONAL
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of processes that convert raw adgraphs at the same time')
+    parser.add_argument('--batch_size', default=0, type=int,
+                        help='Number of stitched adgraphs parsed by one adgraph-buildgraph run, '
+                             '0 runs it once per raw adgraph')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Convert even if the directory already has site snapshots')
+    parser.add_argument('--log_level', default="INFO", help='Log level')
+
+    return parser
+
+
+def find_raw_adgraph_files(adgraph_snapshots_dir: str, url: str, overwrite: bool = False) -> list:
+    """
+    The main raw adgraph of every INIT_ADGRAPH directory, skipping the ones with site snapshots already
+    """
+    adgraph_raw_file_paths = []
+    init_dirs = sorted(glob.glob(adgraph_snapshots_dir + os.sep + "**" + os.sep + f"{INIT_ADGRAPH}*", recursive=True))
+    for init_dir in init_dirs:
+        adgraph_dir = init_dir + os.sep + ADGRAPH_DIR
+        if not os.path.isdir(adgraph_dir):
+            continue
+        if not overwrite and glob_maybe_compressed(init_dir + os.sep + ADGRAPH_NETWORKX + os.sep + "*.graphml"):
+            logger.info(f"Skipping {init_dir}, it has site snapshots already")
+            continue
+        main_file_path = get_main_raw_adgraph_file_path(adgraph_dir, url)
+        if main_file_path:
+            adgraph_raw_file_paths.append(main_file_path)
+        else:
+            logger.warning(f"Could not find main raw adgraph in {adgraph_dir}")
+    return adgraph_raw_file_paths
+
+
+def _get_init_dir(adgraph_raw_file_path: str) -> str:
+    init_dir = adgraph_raw_file_path
+    while os.path.basename(init_dir) and INIT_ADGRAPH not in os.path.basename(init_dir):
+        init_dir = os.path.dirname(init_dir)
+    return init_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Converts the raw adgraphs of a directory into site snapshots, in parallel.')
+
+    parser = add_arguments(parser)
+
+    args = parser.parse_args()
+    print(args)
+
+    numeric_level = getattr(logging, args.log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.log_level)
+    logging.basicConfig(format='%(asctime)s %(module)s - %(message)s', level=numeric_level)
+
+    adgraph_raw_file_paths = find_raw_adgraph_files(args.adgraph_snapshots_dir, args.url, overwrite=args.overwrite)
+    logger.info(f"Found {len(adgraph_raw_file_paths)} raw adgraphs to convert in {args.adgraph_snapshots_dir}")
+
+    # site snapshots are written within their INIT_ADGRAPH directory, where AdgraphBrowserEnvRunner looks for them
+    init_dirs = [_get_init_dir(f) for f in adgraph_raw_file_paths]
+    file_kwargs = [{"base_name": os.path.basename(init_dir), "output_directory": init_dir} for init_dir in init_dirs]
+    before = time.time()
+    if args.batch_size > 0:
+        site_snapshots = convert_raw_adgraph_files_in_batch(args.url,
+                                                            adgraph_raw_file_paths,
+                                                            batch_size=args.batch_size,
+                                                            workers=args.workers,
+                                                            raise_errors=False,
+                                                            file_kwargs=file_kwargs)
+    else:
+        site_snapshots = convert_raw_adgraph_files(args.url,
+                                                   adgraph_raw_file_paths,
+                                                   workers=args.workers,
+                                                   raise_errors=False,
+                                                   file_kwargs=file_kwargs)
+    failed = []
+    for f, site_snapshot in zip(adgraph_raw_file_paths, site_snapshots):
+        if site_snapshot is None:
+            failed.append(f)
+        else:
+            logger.info(f"Converted {f} into {site_snapshot.get_snapshot_file_path()}")
+
+    elapsed = time.time() - before
+    logger.info(f"Converted {len(site_snapshots) - len(failed)} raw adgraphs with {args.workers} worker(s) "
+                f"in {elapsed:.3f}s ({(len(site_snapshots) - len(failed)) / elapsed if elapsed > 0 else 0:.2f} "
+                f"snapshots/s)")
+    if failed:
+        logger.error(f"{len(failed)} raw adgraphs could not be converted: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
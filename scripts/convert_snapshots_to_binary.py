@@ -0,0 +1,122 @@
+#!/usr/bin/python
+import argparse
+import logging
+import os
+import sys
+import time
+
+from autofr.common.compression_utils import glob_maybe_compressed
+from autofr.common.exceptions import SiteSnapshotException
+from autofr.rl.controlled.site_snapshot import SiteSnapshot
+from autofr.rl.controlled.snapshot_format import get_binary_snapshot_path, has_up_to_date_binary_snapshot, \
+    read_binary_snapshot, write_binary_snapshot, get_graph_differences, read_graphml_snapshot
+from autofr.rl.controlled.snapshot_manifest import read_snapshot_manifest
+
+logger = logging.getLogger(__name__)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # REQUIRED
+    parser.add_argument('--snapshot_dir', required=True,
+                        help='Directory that is searched recursively for graphml site snapshots')
+    # OPTIONAL
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Convert even if an up to date binary snapshot exists')
+    parser.add_argument('--verify', action='store_true',
+                        help='Read back every binary snapshot and compare it with its graphml snapshot')
+    parser.add_argument('--write_manifests', action='store_true',
+                        help='Also write the manifest of every snapshot that has no up to date manifest')
+    parser.add_argument('--log_level', default="INFO", help='Log level')
+
+    return parser
+
+
+def convert_snapshot(graphml_file_path: str, overwrite: bool = False, verify: bool = False) -> bool:
+    """
+    Returns False if the binary snapshot read back differs from the graphml snapshot
+    """
+    binary_file_path = get_binary_snapshot_path(graphml_file_path)
+    if not overwrite and not verify and has_up_to_date_binary_snapshot(graphml_file_path):
+        logger.info(f"Skipping {graphml_file_path}, binary snapshot is up to date")
+        return True
+
+    before = time.time()
+    g = read_graphml_snapshot(graphml_file_path)
+    graphml_time = time.time() - before
+
+    if overwrite or not has_up_to_date_binary_snapshot(graphml_file_path):
+        write_binary_snapshot(g, binary_file_path)
+
+    if not verify:
+        logger.info(f"Converted {graphml_file_path} (graphml read in {graphml_time:.3f}s)")
+        return True
+
+    before = time.time()
+    g_binary = read_binary_snapshot(binary_file_path)
+    binary_time = time.time() - before
+
+    differences = get_graph_differences(g, g_binary)
+    for difference in differences:
+        logger.error(f"{binary_file_path}: {difference}")
+    logger.info(f"Verified {binary_file_path}: {'OK' if not differences else 'DIFFERENT'}, "
+                f"nodes {g.number_of_nodes()}, edges {g.number_of_edges()}, "
+                f"graphml read in {graphml_time:.3f}s, binary read in {binary_time:.3f}s")
+    return len(differences) == 0
+
+
+def write_manifest(graphml_file_path: str) -> bool:
+    """
+    Loads the site snapshot and writes its manifest next to it.
+    Returns False if the snapshot could not be loaded or its manifest could not be written
+    """
+    if read_snapshot_manifest(graphml_file_path):
+        logger.info(f"Skipping {graphml_file_path}, manifest is up to date")
+        return True
+    try:
+        site_snapshot = SiteSnapshot("", snapshot_nx_file_path=graphml_file_path)
+    except SiteSnapshotException as e:
+        logger.error(f"Could not load {graphml_file_path}: {e}")
+        return False
+    manifest = site_snapshot.write_manifest()
+    if manifest is None:
+        logger.error(f"Could not write manifest for {graphml_file_path}")
+        return False
+    logger.info(f"Wrote manifest {manifest.manifest_file_path}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Converts graphml site snapshots into the binary snapshot format that SiteSnapshot reads faster.')
+
+    parser = add_arguments(parser)
+
+    args = parser.parse_args()
+    print(args)
+
+    numeric_level = getattr(logging, args.log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError('Invalid log level: %s' % args.log_level)
+    logging.basicConfig(format='%(asctime)s %(module)s - %(message)s', level=numeric_level)
+
+    graphml_files = sorted(glob_maybe_compressed(args.snapshot_dir + os.sep + "**" + os.sep + "*.graphml",
+                                                 recursive=True))
+    logger.info(f"Found {len(graphml_files)} graphml snapshots in {args.snapshot_dir}")
+
+    failed = []
+    failed_manifests = []
+    for graphml_file_path in graphml_files:
+        if not convert_snapshot(graphml_file_path, overwrite=args.overwrite, verify=args.verify):
+            failed.append(graphml_file_path)
+        if args.write_manifests and not write_manifest(graphml_file_path):
+            failed_manifests.append(graphml_file_path)
+
+    if failed_manifests:
+        logger.error(f"{len(failed_manifests)} snapshots have no manifest: {failed_manifests}")
+    if failed:
+        logger.error(f"{len(failed)} binary snapshots differ from their graphml snapshot: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import json
+import random
+
+import networkx as nx
+import pytest
+
+from autofr.common import action_space_utils
+from autofr.common.action_space_utils import TYPE_ESLD, TYPE_FQDN, TYPE_FQDN_PATH, find_duplicate_nodes, \
+    find_duplicate_nodes_by_simple_paths, get_initiator_chain_graph_by_type, get_initiator_chain_graph_raw, \
+    remove_node_and_connect
+
+SITE = "example.com"
+SITE_URL = f"https://www.{SITE}/"
+URL_TYPES = [TYPE_ESLD, TYPE_FQDN, TYPE_FQDN_PATH]
+
+
+def write_perf_log(file_path, requests: list):
+    """
+    Writes a chrome performance log with a Network.requestWillBeSent event for each (url, initiator url)
+    """
+    with open(file_path, "w") as f:
+        for timestamp, (url, parent_url) in enumerate(requests):
+            params = {"documentURL": SITE_URL, "timestamp": timestamp, "requestId": str(timestamp),
+                      "request": {"url": url, "method": "GET"},
+                      "initiator": {"type": "script",
+                                    "stack": {"callFrames": [{"url": parent_url, "functionName": "f",
+                                                              "lineNumber": 1, "columnNumber": 1}]}}}
+            message = {"message": {"method": "Network.requestWillBeSent", "params": params}}
+            f.write(json.dumps({"level": "INFO", "message": json.dumps(message), "timestamp": timestamp}) + "\n")
+
+
+def generate_requests(r: random.Random, depth: int, width: int, domains: int) -> list:
+    """
+    Scripts requested level by level, each by one to three scripts of the level above,
+    spread over few domains and paths so that they repeat along the chains
+    """
+    levels = [[f"https://{r.choice(['cdn', 'www'])}.ads{r.randrange(domains)}.net/s{r.randrange(2)}.js"
+               f"?l={level}&i={i}" for i in range(width)] for level in range(depth)]
+    requests = []
+    for level, urls in enumerate(levels):
+        for url in urls:
+            parent_urls = r.sample(levels[level - 1], r.randint(1, 3)) if level > 0 else [SITE_URL]
+            requests += [(url, parent_url) for parent_url in parent_urls]
+    return requests
+
+
+def remove_site_nodes(g: nx.DiGraph, url_type: str) -> nx.DiGraph:
+    """
+    Step (2) of get_initiator_chain_graph_by_type
+    """
+    g = g.copy()
+    for n in [n for n in g.nodes if g.nodes[n].get(url_type) == SITE]:
+        g = remove_node_and_connect(g, n)
+    return g
+
+
+def as_sets(rounds: list) -> list:
+    return [set(nodes) for nodes in rounds]
+
+
+def assert_same_graph(g1: nx.DiGraph, g2: nx.DiGraph):
+    assert dict(g1.nodes(data=True)) == dict(g2.nodes(data=True))
+    assert set(g1.edges()) == set(g2.edges())
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("url_type", URL_TYPES)
+def test_find_duplicate_nodes_of_perf_log(tmp_path, seed, url_type):
+    file_path = str(tmp_path / "test--cvwebrequests.json")
+    write_perf_log(file_path, generate_requests(random.Random(seed), depth=5, width=4, domains=3))
+    g = remove_site_nodes(get_initiator_chain_graph_raw(file_path, SITE, save_raw_initiator_chain=False), url_type)
+
+    rounds = find_duplicate_nodes(g, SITE, url_type)
+
+    assert as_sets(rounds) == as_sets(find_duplicate_nodes_by_simple_paths(g, SITE, url_type))
+
+
+def test_find_duplicate_nodes_of_perf_log_removes_repeated_domain(tmp_path):
+    file_path = str(tmp_path / "test--cvwebrequests.json")
+    # root -> a.net -> b.net -> a.net
+    write_perf_log(file_path, [("https://a.net/1.js", SITE_URL),
+                               ("https://b.net/2.js", "https://a.net/1.js"),
+                               ("https://a.net/3.js", "https://b.net/2.js")])
+    g = remove_site_nodes(get_initiator_chain_graph_raw(file_path, SITE, save_raw_initiator_chain=False),
+                          TYPE_ESLD)
+
+    rounds = find_duplicate_nodes(g, SITE, TYPE_ESLD)
+
+    assert rounds == find_duplicate_nodes_by_simple_paths(g, SITE, TYPE_ESLD)
+    assert {n for nodes in rounds for n in nodes} == {"https://a.net/3.js"}
+
+
+@pytest.mark.parametrize("url_type", URL_TYPES)
+def test_get_initiator_chain_graph_by_type_matches_simple_paths(tmp_path, monkeypatch, url_type):
+    file_path = str(tmp_path / "test--cvwebrequests.json")
+    write_perf_log(file_path, generate_requests(random.Random(7), depth=6, width=4, domains=3))
+    g_raw = get_initiator_chain_graph_raw(file_path, SITE, save_raw_initiator_chain=False)
+
+    g = get_initiator_chain_graph_by_type(url_type, file_path, SITE, g_raw_initiator_chain=g_raw,
+                                          save_raw_initiator_chain=False)
+    monkeypatch.setattr(action_space_utils, "find_duplicate_nodes", find_duplicate_nodes_by_simple_paths)
+    g_simple_paths = get_initiator_chain_graph_by_type(url_type, file_path, SITE, g_raw_initiator_chain=g_raw,
+                                                       save_raw_initiator_chain=False)
+
+    assert_same_graph(g, g_simple_paths)
+
+
+def random_graph(r: random.Random, number_of_nodes: int, values: int, cycles: bool) -> nx.DiGraph:
+    g = nx.DiGraph()
+    g.add_node(SITE, url=SITE)
+    nodes = [f"https://n{i}.net/" for i in range(number_of_nodes)]
+    for i, n in enumerate(nodes):
+        g.add_node(n, url=n, sld=f"v{r.randrange(values)}")
+        parents = [p for p in [SITE] + nodes[:i] if r.random() < 0.3] or [r.choice([SITE] + nodes[:i])]
+        for p in parents:
+            g.add_edge(p, n)
+    if cycles and number_of_nodes > 1:
+        a, b = r.sample(nodes, 2)
+        g.add_edge(a, b)
+        g.add_edge(b, a)
+    return g
+
+
+@pytest.mark.parametrize("cycles", [False, True])
+def test_find_duplicate_nodes_of_random_graphs(cycles):
+    r = random.Random(0)
+    for _ in range(200):
+        g = random_graph(r, r.randint(1, 12), r.randint(1, 4), cycles)
+
+        rounds = find_duplicate_nodes(g, SITE, TYPE_ESLD)
+
+        assert as_sets(rounds) == as_sets(find_duplicate_nodes_by_simple_paths(g, SITE, TYPE_ESLD))
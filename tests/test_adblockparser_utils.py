@@ -0,0 +1,141 @@
+import itertools
+import random
+
+import pytest
+
+from autofr.common.adblockparser_utils import AutoFRAdblockRules, AutoFRDomainAnchorRules, \
+    AutoFRTokenIndexedAdblockRules, get_adblock_rules
+
+DOMAINS = ["example.com", "ads.example.com", "cdn.ads.example.com", "example.co", "xample.com",
+           "ads-example.com", "tracker.net", "Tracker.NET", "a.b.tracker.net", "localhost"]
+PATHS = ["", "/", "/ads", "/ads/", "/ads/banner.js", "/adsbygoogle.js", "/ADS/banner.js", "/img/ad_300x250.png",
+         "/ads.", "/x%20y"]
+URL_PREFIXES = ["https://", "http://", "//", "", "https://www.", "wss://user@"]
+PORTS = ["", ":443", ":8080"]
+URL_ENDS = ["", "?ads=1", "#ads", "/more", ".js", "^"]
+
+
+def get_rules() -> list:
+    rules = [f"||{domain}^" for domain in DOMAINS]
+    rules += [f"||{domain}{path}" for domain, path in itertools.product(DOMAINS, PATHS) if path]
+    return rules
+
+
+def get_urls() -> list:
+    urls = []
+    domains = DOMAINS + ["EXAMPLE.COM", "sub.Example.com"]
+    for prefix, domain, port, path, end in itertools.product(URL_PREFIXES, domains, PORTS, PATHS, URL_ENDS):
+        urls.append(f"{prefix}{domain}{port}{path}{end}")
+    return urls
+
+
+def should_block_2_texts(adblock_rules, url: str, options: dict = None) -> tuple:
+    blocked, matched_rules = adblock_rules.should_block_2(url, options)
+    return blocked, [rule.raw_rule_text for rule in matched_rules]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_domain_anchor_rules_match_adblock_rules(seed):
+    r = random.Random(seed)
+    rules = r.sample(get_rules(), 30)
+    urls = r.sample(get_urls(), 3000)
+    domain_anchor_rules = AutoFRDomainAnchorRules(rules)
+    adblock_rules = AutoFRAdblockRules(rules)
+
+    for url in urls:
+        assert should_block_2_texts(domain_anchor_rules, url) == should_block_2_texts(adblock_rules, url), url
+
+
+@pytest.mark.parametrize("rule, url, expected_blocked", [
+    ("||example.com^", "https://example.com/", True),
+    ("||example.com^", "https://example.com", True),
+    ("||example.com^", "https://example.com:8080/ads", True),
+    ("||example.com^", "https://ads.example.com/", True),
+    ("||example.com^", "https://badexample.com/", False),
+    ("||example.com^", "https://example.com.evil.net/", False),
+    ("||example.com^", "https://example.co/", False),
+    ("||example.com^", "https://EXAMPLE.COM/", False),
+    ("||Example.com^", "https://example.com/", False),
+    ("||example.com/ads", "https://example.com/ads", True),
+    ("||example.com/ads", "https://example.com/adsbygoogle.js", True),
+    ("||example.com/ads", "https://example.com/ADS", False),
+    ("||example.com/ads", "https://example.com:443/ads", False),
+    ("||example.com/ads", "https://ads.example.com/ads/banner.js", True),
+    ("||example.com/ads/", "https://example.com/ads", False),
+    ("||example.com/ads", "https://example.com/img?u=https://example.com/ads", False),
+])
+def test_domain_anchor_rules_boundaries(rule, url, expected_blocked):
+    blocked, matched_rules = should_block_2_texts(AutoFRDomainAnchorRules([rule]), url)
+
+    assert (blocked, matched_rules) == should_block_2_texts(AutoFRAdblockRules([rule]), url)
+    assert blocked == expected_blocked
+
+
+def test_get_adblock_rules():
+    assert isinstance(get_adblock_rules(["||example.com^", "||example.com/ads"]), AutoFRDomainAnchorRules)
+    assert isinstance(get_adblock_rules(["||example.com^", "/banner/*"]), AutoFRTokenIndexedAdblockRules)
+    assert isinstance(get_adblock_rules(["||example.com^$third-party"]), AutoFRTokenIndexedAdblockRules)
+    assert isinstance(get_adblock_rules(["@@||example.com^"]), AutoFRTokenIndexedAdblockRules)
+
+
+TOKEN_INDEXED_RULES = [
+    # blocking rules, with and without keywords
+    "||ads.example.com^", "||tracker.net^", "/ads/banner.js", "/adsbygoogle.", "ad_300x250", "/ads/*.js",
+    "||example.com/*/banner", "banner*.js|", "|https://ads.", "/img/", "^ads^", "*", "ads", "/x%20y",
+    # regex rules
+    r"/banner\.[a-z]+$/", r"/ad_[0-9]+x[0-9]+/",
+    # rules with options
+    "||tracker.net^$third-party", "/ads/$~third-party", "||example.co^$domain=example.com",
+    "banner$domain=example.com|~ads.example.com", "||localhost^$domain=~tracker.net",
+    "/more$third-party,domain=xample.com",
+    # whitelist rules
+    "@@||cdn.ads.example.com^", "@@/ads/banner.js$domain=example.com", "@@||tracker.net/ads$third-party",
+    "@@banner*", r"@@/adsbygoogle\.js/",
+]
+OPTIONS = [None, {}, {"third-party": True}, {"third-party": False}, {"domain": "example.com"},
+           {"domain": "ads.example.com", "third-party": True}, {"domain": "tracker.net", "third-party": False},
+           {"domain": "sub.xample.com", "third-party": True}]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_token_indexed_rules_match_adblock_rules(seed):
+    r = random.Random(seed)
+    rules = r.sample(TOKEN_INDEXED_RULES, 15)
+    urls = r.sample(get_urls(), 1000)
+    token_indexed_rules = AutoFRTokenIndexedAdblockRules(rules)
+    adblock_rules = AutoFRAdblockRules(rules)
+
+    for url in urls:
+        options = r.choice(OPTIONS)
+        assert should_block_2_texts(token_indexed_rules, url, options) == \
+               should_block_2_texts(adblock_rules, url, options), (url, options)
+
+
+@pytest.mark.parametrize("rule, url, options, expected_blocked", [
+    ("||tracker.net^$third-party", "https://tracker.net/ads", {"third-party": True}, True),
+    ("||tracker.net^$third-party", "https://tracker.net/ads", {"third-party": False}, False),
+    ("banner$domain=example.com|~ads.example.com", "https://x.net/banner.js", {"domain": "www.example.com"}, True),
+    ("banner$domain=example.com|~ads.example.com", "https://x.net/banner.js", {"domain": "ads.example.com"}, False),
+    ("/ads/*.js", "https://example.com/ads/x/banner.js", None, True),
+    (r"/ad_[0-9]+x[0-9]+/", "https://example.com/img/ad_300x250.png", None, True),
+    ("*", "https://example.com/", None, True),
+    ("^ads^", "https://example.com/ads/", None, True),
+])
+def test_token_indexed_rules_cases(rule, url, options, expected_blocked):
+    blocked, matched_rules = should_block_2_texts(AutoFRTokenIndexedAdblockRules([rule]), url, options)
+
+    assert (blocked, matched_rules) == should_block_2_texts(AutoFRAdblockRules([rule]), url, options)
+    assert blocked == expected_blocked
+
+
+def test_token_indexed_rules_whitelist_takes_precedence():
+    rules = ["||ads.example.com^", "/ads/banner.js", "@@/ads/banner.js$domain=example.com", "@@banner*"]
+    url = "https://ads.example.com/ads/banner.js"
+
+    for options in [None, {"domain": "example.com"}]:
+        expected = should_block_2_texts(AutoFRAdblockRules(rules), url, options)
+
+        assert should_block_2_texts(AutoFRTokenIndexedAdblockRules(rules), url, options) == expected
+        assert expected[0] is False
+    assert should_block_2_texts(AutoFRTokenIndexedAdblockRules(rules), url, {"domain": "example.com"}) == \
+           (False, ["@@banner*", "@@/ads/banner.js$domain=example.com"])
@@ -0,0 +1,40 @@
+import importlib.util
+import os
+
+import pytest
+
+from autofr.rl.controlled.site_snapshot import SiteSnapshot
+
+BENCHMARK_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "scripts", "benchmarks",
+                              "benchmark_adgraph_ingestion.py")
+
+
+@pytest.fixture(scope="module")
+def benchmark():
+    spec = importlib.util.spec_from_file_location("benchmark_adgraph_ingestion", BENCHMARK_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_and_remove(file_path: str) -> bytes:
+    with open(file_path, "rb") as f:
+        content = f.read()
+    os.remove(file_path)
+    return content
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("main_events, iframe_events, max_iframes", [(50, 20, 3), (400, 120, 15)])
+def test_stitch_adgraphs_matches_in_memory(tmp_path, benchmark, seed, main_events, iframe_events, max_iframes):
+    input_directory = str(tmp_path / "rendering_stream")
+    benchmark.generate_raw_adgraphs(input_directory, main_events, iframe_events, max_iframes, seed=seed)
+    # stitching only depends on class level constants
+    site_snapshot = object.__new__(SiteSnapshot)
+
+    in_memory = read_and_remove(benchmark.stitch_adgraphs_in_memory(site_snapshot, input_directory,
+                                                                    benchmark.SITE_URL))
+    streamed = read_and_remove(SiteSnapshot.stitch_adgraphs(site_snapshot, input_directory, benchmark.SITE_URL))
+
+    assert streamed == in_memory
+    assert len(os.listdir(input_directory)) > 1
@@ -0,0 +1,122 @@
+import random
+
+import networkx as nx
+import pytest
+
+from autofr.common.action_space_utils import ROOT_NODE_ID
+from autofr.common.adblockparser_utils import AutoFRAdblockRules, get_adblock_rules
+from autofr.common.filter_rules_utils import RULES_DELIMITER, create_rule_simple
+from autofr.rl.action_space import EDGE_TYPE
+from autofr.rl.controlled.bandits import DomainHierarchyMABControlled
+from autofr.rl.controlled.compiled_snapshot import CompiledSiteSnapshot
+from autofr.rl.controlled.site_snapshot import FLG_AD, FLG_IMAGE, FLG_TEXTNODE, INFO, NODE_TYPE, REQUESTED_URL, \
+    SNAPSHOT_EDGE__ACTOR, SNAPSHOT_EDGE__DOM, SNAPSHOT_EDGE__REQUESTOR, SNAPSHOT_EDGE__VIRTUAL, \
+    has_non_dom_predecessor_edges
+
+URLS = ["https://ads.net/ads.js", "https://cdn.ads.net/lib.js", "https://ads.net/banner.png",
+        "https://tracker.org/pixel.gif", "https://www.example.com/img/logo.png", "https://www.example.com/app.js",
+        "https://cdn.ads.net/frame.html"]
+DOMAINS = ["ads.net", "cdn.ads.net", "tracker.org", "example.com", "www.example.com/img", "nothing.net"]
+RULES = ["||ads.net^", "||cdn.ads.net^", "||tracker.org^", "||example.com/img", "||example.com^", "||nothing.net^"]
+EDGE_TYPES = [SNAPSHOT_EDGE__DOM, SNAPSHOT_EDGE__DOM, SNAPSHOT_EDGE__ACTOR, SNAPSHOT_EDGE__REQUESTOR,
+              SNAPSHOT_EDGE__VIRTUAL, None]
+
+
+class BaselineSiteSnapshot:
+    """
+    Site snapshot graph with the has_non_dom_predecessor_edges rule of the baseline, which finds cycles with nx.has_path
+    """
+
+    def __init__(self, g: nx.DiGraph):
+        self.g = g
+
+    def get_graph(self) -> nx.DiGraph:
+        return self.g
+
+    def has_non_dom_predecessor_edges(self, node_str: str) -> bool:
+        return has_non_dom_predecessor_edges(self.g, node_str)
+
+
+def random_snapshot(r: random.Random, number_of_nodes: int) -> nx.DiGraph:
+    """
+    Nodes hang off earlier nodes with any edge type, some extra edges point back and create cycles.
+    Urls are found in URL nodes and in requested_url attributes, drawn from few urls so that they repeat.
+    """
+    g = nx.DiGraph(**{ROOT_NODE_ID: "0"})
+    g.add_node("0", **{INFO: "document", NODE_TYPE: "NODE"})
+    for i in range(1, number_of_nodes):
+        if r.random() < 0.3:
+            node_data = {INFO: r.choice(URLS), NODE_TYPE: "URL"}
+        else:
+            node_data = {INFO: r.choice(["div", "img", "iframe", "IFRAME", "#text", "script"]),
+                         NODE_TYPE: r.choice(["NODE", "NODE", "SCRIPT"])}
+            if r.random() < 0.3:
+                node_data[REQUESTED_URL] = r.choice(URLS)
+        for flag in (FLG_AD, FLG_IMAGE, FLG_TEXTNODE):
+            if r.random() < 0.3:
+                node_data[flag] = r.choice(["true", "True", "false"])
+        g.add_node(str(i), **node_data)
+
+    def add_edge(u: str, v: str):
+        edge_type = r.choice(EDGE_TYPES)
+        g.add_edge(u, v, **({EDGE_TYPE: edge_type} if edge_type else {}))
+
+    for i in range(1, number_of_nodes):
+        for parent in r.sample(range(i), min(i, r.randint(1, 2))):
+            add_edge(str(parent), str(i))
+    for _ in range(r.randint(0, number_of_nodes // 3)):
+        u, v = r.sample(range(1, number_of_nodes), 2) if number_of_nodes > 2 else ("0", "1")
+        add_edge(str(u), str(v))
+    return g
+
+
+def pull_result_as_tuple(pull_result) -> tuple:
+    block_items_and_match = {rule: [record.url_blocked for record in records]
+                             for rule, records in pull_result.block_items_and_match.items()}
+    return (pull_result.ad_counter, pull_result.image_counter, pull_result.textnode_counter, block_items_and_match,
+            pull_result.ads_blocked, pull_result.images_blocked, pull_result.textnodes_blocked)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_simulate_pull_matches_networkx(seed, monkeypatch):
+    r = random.Random(seed)
+    # only uses the static helpers of the bandit
+    bandit = object.__new__(DomainHierarchyMABControlled)
+    bfs_pulls = []
+    simulate_pull_bfs = CompiledSiteSnapshot._simulate_pull_bfs
+    monkeypatch.setattr(CompiledSiteSnapshot, "_simulate_pull_bfs",
+                        lambda self, url_to_rules: bfs_pulls.append(1) or simulate_pull_bfs(self, url_to_rules))
+
+    number_of_pulls = 0
+    for _ in range(100):
+        g = random_snapshot(r, r.randint(2, 25))
+        compiled_snapshot = CompiledSiteSnapshot(g)
+        for _ in range(3):
+            parser = AutoFRAdblockRules(r.sample(RULES, r.randint(1, 3)))
+
+            pull_result = compiled_snapshot.simulate_pull(parser.should_block_2)
+
+            expected = bandit._simulate_pull_with_networkx(BaselineSiteSnapshot(g), parser)
+            assert pull_result_as_tuple(pull_result) == pull_result_as_tuple(expected), nx.to_dict_of_dicts(g)
+            number_of_pulls += 1
+
+    # both the composed closures and the breadth first search fallback are covered
+    assert 0 < len(bfs_pulls) < number_of_pulls
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_simulate_pull_for_rules_reuses_rule_matches(seed):
+    r = random.Random(seed)
+    for _ in range(30):
+        g = random_snapshot(r, r.randint(2, 25))
+        compiled_snapshot = CompiledSiteSnapshot(g)
+        # single rules and combined actions, overlapping and in any order, all pulled from the same memoized matches
+        actions = r.sample(DOMAINS, 3) + \
+            [RULES_DELIMITER.join(r.sample(DOMAINS, r.randint(2, 4))) for _ in range(6)]
+        for action in actions:
+            filter_rules = [create_rule_simple(x) for x in action.split(RULES_DELIMITER)]
+
+            pull_result = compiled_snapshot.simulate_pull_for_rules(filter_rules)
+
+            expected = CompiledSiteSnapshot(g).simulate_pull(get_adblock_rules(filter_rules).should_block_2)
+            assert pull_result_as_tuple(pull_result) == pull_result_as_tuple(expected), (action, nx.to_dict_of_dicts(g))
@@ -0,0 +1,101 @@
+import multiprocessing
+
+import networkx as nx
+import pytest
+
+import autofr.rl.bandits
+from autofr.common.action_space_utils import ROOT_NODE_ID
+from autofr.rl.action_space import EDGE_TYPE
+from autofr.rl.browser_env.reward import SiteFeedback
+from autofr.rl.controlled.bandits import DomainHierarchyMABControlled, PULL_EXECUTOR_PROCESS
+from autofr.rl.controlled.site_snapshot import FLG_AD, FLG_IMAGE, FLG_TEXTNODE, INFO, NODE_TYPE, REQUESTED_URL, \
+    SNAPSHOT_EDGE__ACTOR, SNAPSHOT_EDGE__DOM, SNAPSHOT_EDGE__REQUESTOR, SiteSnapshot
+
+SITE_URL = "https://www.example.com/"
+ACTIONS = [["ads.net"], ["tracker.org"], ["cdn.ads.net"], ["ads.net", "tracker.org"], ["example.com"],
+           ["ads.net"], ["cdn.ads.net", "ads.net"], ["nothing.net"]]
+
+
+class InMemorySiteSnapshot(SiteSnapshot):
+    """
+    SiteSnapshot of a graph that already has its callstack infused, without any files
+    """
+
+    def __init__(self, url: str, g: nx.DiGraph, snapshot_name: str):
+        self._g = g
+        super(InMemorySiteSnapshot, self).__init__(url, snapshot_name=snapshot_name)
+
+    def _has_snapshot_source(self) -> bool:
+        return True
+
+    def _read_snapshot(self):
+        self._snapshot = self._g
+
+    def _infuse_call_stack_to_snapshot(self):
+        pass
+
+
+def create_snapshot(with_tracker_image: bool) -> nx.DiGraph:
+    g = nx.DiGraph(**{ROOT_NODE_ID: "root"})
+    g.add_node("root", **{INFO: "document", NODE_TYPE: "NODE"})
+    g.add_node("ads_js", **{INFO: "https://ads.net/ads.js", NODE_TYPE: "URL"})
+    g.add_node("ads_script", **{INFO: "script", NODE_TYPE: "SCRIPT"})
+    g.add_node("cdn_js", **{INFO: "https://cdn.ads.net/lib.js", NODE_TYPE: "URL"})
+    g.add_node("iframe", **{INFO: "iframe", NODE_TYPE: "NODE", FLG_AD: "true",
+                            REQUESTED_URL: "https://cdn.ads.net/frame.html"})
+    g.add_node("ad_img", **{INFO: "img", NODE_TYPE: "NODE", FLG_AD: "true", FLG_IMAGE: "true",
+                            REQUESTED_URL: "https://ads.net/banner.png"})
+    g.add_node("img", **{INFO: "img", NODE_TYPE: "NODE", FLG_IMAGE: "true",
+                         REQUESTED_URL: "https://www.example.com/logo.png"})
+    g.add_node("text", **{INFO: "#text", NODE_TYPE: "NODE", FLG_TEXTNODE: "true"})
+    g.add_edge("root", "ads_js", **{EDGE_TYPE: SNAPSHOT_EDGE__REQUESTOR})
+    g.add_edge("ads_js", "ads_script", **{EDGE_TYPE: SNAPSHOT_EDGE__ACTOR})
+    g.add_edge("ads_script", "cdn_js", **{EDGE_TYPE: SNAPSHOT_EDGE__ACTOR})
+    g.add_edge("cdn_js", "iframe", **{EDGE_TYPE: SNAPSHOT_EDGE__ACTOR})
+    g.add_edge("root", "iframe", **{EDGE_TYPE: SNAPSHOT_EDGE__DOM})
+    g.add_edge("ads_script", "ad_img", **{EDGE_TYPE: SNAPSHOT_EDGE__ACTOR})
+    g.add_edge("root", "img", **{EDGE_TYPE: SNAPSHOT_EDGE__DOM})
+    g.add_edge("root", "text", **{EDGE_TYPE: SNAPSHOT_EDGE__DOM})
+    if with_tracker_image:
+        g.add_node("tracker_img", **{INFO: "img", NODE_TYPE: "NODE", FLG_IMAGE: "true",
+                                     REQUESTED_URL: "https://tracker.org/pixel.png"})
+        g.add_edge("root", "tracker_img", **{EDGE_TYPE: SNAPSHOT_EDGE__DOM})
+    return g
+
+
+def create_bandit(tmp_path, monkeypatch, **kwargs) -> DomainHierarchyMABControlled:
+    monkeypatch.setattr(autofr.rl.bandits, "HOST_MACHINE_OUTPUT_PATH", str(tmp_path))
+    bandit = DomainHierarchyMABControlled(None, "", 0.9, base_name="test",
+                                          init_site_feedback=SiteFeedback(ad_counter=2, image_counter=3,
+                                                                          textnode_counter=1),
+                                          **kwargs)
+    bandit.site_snapshots = [(InMemorySiteSnapshot(SITE_URL, create_snapshot(i == 1), f"snapshot_{i}"),
+                              f"snapshot_{i}") for i in range(2)]
+    return bandit
+
+
+def response_as_tuple(response) -> tuple:
+    block_items_and_match = {rule: [record.url_blocked for record in records]
+                             for rule, records in response.block_items_and_match.items()}
+    return (response.action, response.filter_rules, vars(response.site_feedback), block_items_and_match,
+            vars(response.reward), response.is_optimal)
+
+
+def cache_as_dict(bandit: DomainHierarchyMABControlled) -> dict:
+    return {key: vars(entry) for key, entry in bandit.site_feedback_cache.items()}
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_pull_each_arm_in_processes_matches_serial_pulls(tmp_path, monkeypatch):
+    bandit = create_bandit(tmp_path, monkeypatch)
+    # pull_each_arm_parallel pulls the actions in sorted order
+    serial_responses = [bandit.pull(SITE_URL, action) for action in sorted(ACTIONS)]
+    serial_snapshot_choices = list(bandit.snapshot_choice_history)
+
+    bandit_in_processes = create_bandit(tmp_path, monkeypatch, pull_executor=PULL_EXECUTOR_PROCESS, pull_workers=2)
+    responses = bandit_in_processes.pull_each_arm_parallel(SITE_URL, list(ACTIONS))
+
+    assert bandit_in_processes.snapshot_choice_history == serial_snapshot_choices
+    assert [response_as_tuple(r) for r in responses] == [response_as_tuple(r) for r in serial_responses]
+    assert cache_as_dict(bandit_in_processes) == cache_as_dict(bandit)
+    assert len(bandit.site_feedback_cache) > 1
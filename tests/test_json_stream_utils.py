@@ -0,0 +1,99 @@
+import gzip
+import json
+
+import pytest
+
+from autofr.common.json_stream_utils import JSONStreamReader, iter_json_array_of_key
+
+DOCUMENT = {
+    "url": "https://www.example.com/?q=a%20b&é=é",
+    "escapes": "quote \" backslash \\ slash / tab \t newline \n unicode ☃ surrogate \U0001F600",
+    "numbers": [0, -7, 12345678901234567890, 1.5, -0.25, 1e-7, 6.02e23, 123456, -1E+5],
+    "literals": [True, False, None, True],
+    "timeline": [{"event_type": "NodeInsertion", "node_id": str(i), "actor_id": i * 1000,
+                  "attrs": {"width": i * 3.25, "visible": i % 2 == 0, "style": "x" * (i % 7)}}
+                 for i in range(25)],
+    "empty": {"array": [], "object": {}, "string": ""},
+    "nested": [[[]], [{}], [[1, [2, [3]]]], {"a": {"b": {"c": [None]}}}],
+    "version": 1.5,
+    "last": 10,
+}
+CHUNK_SIZES = [1, 2, 3, 5, 7, 16]
+
+
+def write_document(file_path, document: dict = DOCUMENT, indent=None):
+    with open(file_path, "w") as f:
+        json.dump(document, f, indent=indent)
+
+
+def read_document(file_path, chunk_size: int, stream_keys=()) -> dict:
+    document = dict()
+    with JSONStreamReader(str(file_path), chunk_size=chunk_size) as reader:
+        for key, value in reader.iter_object(stream_keys=stream_keys):
+            # stream keys whose value is not an array are read as usual
+            document[key] = list(value) if hasattr(value, "__next__") else value
+    return document
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("indent", [None, 2])
+def test_values_split_across_chunks(tmp_path, chunk_size, indent):
+    file_path = tmp_path / "adgraph.json"
+    write_document(file_path, indent=indent)
+
+    assert read_document(file_path, chunk_size) == DOCUMENT
+    assert read_document(file_path, chunk_size, stream_keys=["timeline", "numbers", "url"]) == DOCUMENT
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_numbers_at_chunk_boundaries(tmp_path, chunk_size):
+    file_path = tmp_path / "numbers.json"
+    # numbers of every length, so that each chunk size ends within some of them
+    numbers = [int("9" * n) for n in range(1, 20)] + [float("1." + "5" * n) for n in range(1, 12)] + \
+              [float(f"2.5e{n}") for n in range(-12, 12)]
+    file_path.write_text("{" + ",".join(f'"n{i}":{json.dumps(n)}' for i, n in enumerate(numbers)) + "}")
+
+    assert list(read_document(file_path, chunk_size).values()) == numbers
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_partially_used_array_is_skipped(tmp_path, chunk_size):
+    file_path = tmp_path / "adgraph.json"
+    write_document(file_path)
+
+    found = dict()
+    with JSONStreamReader(str(file_path), chunk_size=chunk_size) as reader:
+        for key, value in reader.iter_object(stream_keys=["timeline", "numbers"]):
+            found[key] = next(value) if key in ("timeline", "numbers") else value
+
+    assert found["timeline"] == DOCUMENT["timeline"][0]
+    assert found["numbers"] == DOCUMENT["numbers"][0]
+    assert found["last"] == DOCUMENT["last"]
+    assert list(found) == list(DOCUMENT)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3])
+def test_compressed_file(tmp_path, chunk_size):
+    file_path = tmp_path / "adgraph.json.gz"
+    with gzip.open(file_path, "wt") as f:
+        json.dump(DOCUMENT, f)
+
+    assert read_document(file_path, chunk_size, stream_keys=["timeline"]) == DOCUMENT
+
+
+def test_iter_json_array_of_key(tmp_path):
+    file_path = tmp_path / "adgraph.json"
+    write_document(file_path)
+
+    assert list(iter_json_array_of_key(str(file_path), "timeline")) == DOCUMENT["timeline"]
+    assert list(iter_json_array_of_key(str(file_path), "missing")) == []
+
+
+@pytest.mark.parametrize("content", ['{"a": [1, 2', '{"a": tru}', '{"a" 1}', '[1, 2]', '{"a": "b'])
+@pytest.mark.parametrize("chunk_size", [1, 4])
+def test_invalid_json(tmp_path, content, chunk_size):
+    file_path = tmp_path / "invalid.json"
+    file_path.write_text(content)
+
+    with pytest.raises(json.JSONDecodeError):
+        read_document(file_path, chunk_size, stream_keys=["a"])
@@ -0,0 +1,97 @@
+import json
+
+import networkx as nx
+import pytest
+
+from autofr.common.action_space_utils import ROOT_NODE_ID
+from autofr.rl.action_space import EDGE_TYPE
+from autofr.rl.controlled.site_snapshot import FLG_AD, FLG_IMAGE, INFO, NODE_TYPE, REQUESTED_URL, \
+    SNAPSHOT_EDGE__DOM, SiteSnapshot
+from autofr.rl.controlled.snapshot_manifest import read_snapshot_manifest
+
+SITE_URL = "https://www.example.com/"
+SNAPSHOT_KEY = "1655747065.993929"
+
+
+def write_callstack_file(file_path):
+    params = {"documentURL": SITE_URL, "timestamp": 1, "requestId": "1",
+              "request": {"url": "https://ads.net/ads.js", "method": "GET"}, "initiator": {"type": "parser"}}
+    message = {"message": {"method": "Network.requestWillBeSent", "params": params}}
+    file_path.write_text(json.dumps({"level": "INFO", "message": json.dumps(message), "timestamp": 1}) + "\n")
+
+
+@pytest.fixture
+def snapshot_file_path(tmp_path):
+    """
+    Site snapshot within an AdGraph_Snapshots directory, with its raw adgraph and callstack file in init_adgraph
+    """
+    snapshots_dir = tmp_path / f"example.com_{SiteSnapshot.SNAPSHOT_DIRECTORY_PARTIAL}"
+    init_adgraph_dir = snapshots_dir / "init_adgraph_1"
+    (init_adgraph_dir / "rendering_stream").mkdir(parents=True)
+    (init_adgraph_dir / "rendering_stream" / f"log_{SNAPSHOT_KEY}.json").write_text("{}")
+    write_callstack_file(init_adgraph_dir / "example.com--cvwebrequests.json")
+
+    g = nx.DiGraph(**{ROOT_NODE_ID: "root"})
+    g.add_node("root", **{INFO: "document", NODE_TYPE: "NODE"})
+    g.add_node("ad", **{INFO: "img", NODE_TYPE: "NODE", FLG_AD: "true", REQUESTED_URL: "https://ads.net/ad.png"})
+    g.add_node("img", **{INFO: "img", NODE_TYPE: "NODE", FLG_IMAGE: "true"})
+    g.add_edge("root", "ad", **{EDGE_TYPE: SNAPSHOT_EDGE__DOM})
+    g.add_edge("root", "img", **{EDGE_TYPE: SNAPSHOT_EDGE__DOM})
+    (snapshots_dir / "adgraph_networkx").mkdir()
+    file_path = snapshots_dir / "adgraph_networkx" / f"example.com_{SNAPSHOT_KEY}.graphml"
+    nx.write_graphml(g, str(file_path))
+    return file_path
+
+
+def test_infused_snapshot_is_kept_in_its_own_directory(tmp_path, monkeypatch, snapshot_file_path):
+    callstack_files_read = []
+    get_callstack_entries = SiteSnapshot._get_callstack_entries
+    monkeypatch.setattr(SiteSnapshot, "_get_callstack_entries",
+                        lambda self, f: callstack_files_read.append(f) or get_callstack_entries(self, f))
+    infused_snapshot_dir = tmp_path / "cache"
+    files_before = sorted(p.name for p in snapshot_file_path.parent.iterdir())
+
+    site_snapshot = SiteSnapshot(SITE_URL, snapshot_nx_file_path=str(snapshot_file_path),
+                                 infused_snapshot_dir=str(infused_snapshot_dir))
+
+    assert len(callstack_files_read) == 1
+    assert [p.name for p in infused_snapshot_dir.iterdir()] == [f"example.com_{SNAPSHOT_KEY}.infused.afrsnap"]
+    assert site_snapshot.get_infused_snapshot_file_path().startswith(str(infused_snapshot_dir))
+    assert sorted(p.name for p in snapshot_file_path.parent.iterdir()) == files_before
+
+    # read back without parsing the callstack file
+    site_snapshot_cached = SiteSnapshot(SITE_URL, snapshot_nx_file_path=str(snapshot_file_path),
+                                        infused_snapshot_dir=str(infused_snapshot_dir))
+
+    assert len(callstack_files_read) == 1
+    assert site_snapshot_cached.get_compiled_snapshot().get_content_hash() == \
+           site_snapshot.get_compiled_snapshot().get_content_hash()
+
+    # a callstack file added later is found, so the snapshot is infused again
+    new_callstack_file = snapshot_file_path.parent.parent / "init_adgraph_1" / "sub" / "frame--cvwebrequests.json"
+    new_callstack_file.parent.mkdir()
+    write_callstack_file(new_callstack_file)
+
+    SiteSnapshot(SITE_URL, snapshot_nx_file_path=str(snapshot_file_path),
+                 infused_snapshot_dir=str(infused_snapshot_dir))
+
+    assert len(callstack_files_read) == 3
+    assert str(new_callstack_file) in callstack_files_read
+
+
+def test_manifest_is_only_written_on_request(tmp_path, snapshot_file_path):
+    files_before = sorted(p.name for p in snapshot_file_path.parent.iterdir())
+
+    site_snapshot = SiteSnapshot(SITE_URL, snapshot_nx_file_path=str(snapshot_file_path),
+                                 infused_snapshot_dir=str(tmp_path / "cache"))
+    manifest = site_snapshot.get_manifest()
+
+    assert sorted(p.name for p in snapshot_file_path.parent.iterdir()) == files_before
+    assert read_snapshot_manifest(str(snapshot_file_path)) is None
+    assert (manifest.number_of_nodes, manifest.number_of_ads, manifest.number_of_images) == (3, 1, 1)
+    assert manifest.content_hash == site_snapshot.get_compiled_snapshot().get_content_hash()
+    assert manifest.callstack_files == ["../init_adgraph_1/example.com--cvwebrequests.json"]
+
+    written_manifest = site_snapshot.write_manifest()
+
+    assert vars(read_snapshot_manifest(str(snapshot_file_path))) == vars(written_manifest) == vars(manifest)
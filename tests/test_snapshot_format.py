@@ -0,0 +1,127 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from autofr.common.exceptions import MissingSnapshotException
+from autofr.rl.controlled.snapshot_format import BinarySnapshotReader, get_graph_differences, \
+    read_binary_snapshot, read_graphml_snapshot, write_binary_snapshot
+
+
+def create_snapshot() -> nx.DiGraph:
+    """
+    Small site snapshot with attribute values of every type and missing attributes
+    """
+    g = nx.DiGraph(root_node_id="1", site="example.com", version=2)
+    g.add_node("1", info="document", url="https://example.com/")
+    g.add_node("2", info="iframe", url="https://ads.example.net/frame?a=1&b=é", **{"flg-ad": "true"})
+    g.add_node("3", info="img", **{"flg-image": "True", "flg-ad": "false"}, width=300, ratio=0.5)
+    g.add_node("4", info="#text", **{"flg-textnode": "true"}, visible=True, depth=3)
+    g.add_node("5", big=2 ** 70, negative=-7, score=1.5, empty="")
+    g.add_edge("1", "3", edge_type="dom")
+    g.add_edge("1", "2", edge_type="dom", weight=1.25)
+    g.add_edge("2", "4", edge_type="dom")
+    g.add_edge("2", "5")
+    g.add_edge("3", "5", edge_type="network", blocked=False, count=2)
+    return g
+
+
+def test_round_trip(tmp_path):
+    g = create_snapshot()
+    file_path = str(tmp_path / "snapshot.afrsnap")
+
+    write_binary_snapshot(g, file_path)
+    g_binary = read_binary_snapshot(file_path)
+
+    assert get_graph_differences(g, g_binary) == []
+    assert g_binary.graph == {"root_node_id": "1", "site": "example.com", "version": 2}
+    assert g_binary.nodes["2"]["url"] == "https://ads.example.net/frame?a=1&b=é"
+    assert "width" not in g_binary.nodes["2"]
+    assert g_binary.nodes["5"]["empty"] == ""
+    assert g_binary.edges["2", "5"] == {}
+
+    for (n, name), (value_type, value) in {("3", "width"): (int, 300),
+                                          ("3", "ratio"): (float, 0.5),
+                                          ("4", "visible"): (bool, True),
+                                          ("4", "depth"): (int, 3),
+                                          ("5", "big"): (int, 2 ** 70),
+                                          ("5", "negative"): (int, -7),
+                                          ("5", "score"): (float, 1.5),
+                                          ("3", "flg-image"): (str, "True")}.items():
+        assert type(g_binary.nodes[n][name]) is value_type
+        assert g_binary.nodes[n][name] == value
+    for (u, v, name), (value_type, value) in {("1", "2", "weight"): (float, 1.25),
+                                             ("3", "5", "blocked"): (bool, False),
+                                             ("3", "5", "count"): (int, 2),
+                                             ("1", "3", "edge_type"): (str, "dom")}.items():
+        assert type(g_binary.edges[u, v][name]) is value_type
+        assert g_binary.edges[u, v][name] == value
+
+
+def test_numpy_values(tmp_path):
+    g = nx.DiGraph()
+    g.add_node("a", depth=np.int64(3), score=np.float32(1.5), visible=np.bool_(True))
+    file_path = str(tmp_path / "snapshot.afrsnap")
+
+    write_binary_snapshot(g, file_path)
+    node_data = read_binary_snapshot(file_path).nodes["a"]
+
+    # numpy values come back as the python values they hold
+    assert {k: (type(v), v) for k, v in node_data.items()} == {"depth": (int, 3), "score": (float, 1.5),
+                                                                "visible": (bool, True)}
+
+
+def test_round_trip_of_graphml(tmp_path):
+    graphml_file_path = str(tmp_path / "snapshot.graphml")
+    nx.write_graphml(create_snapshot(), graphml_file_path)
+    g = read_graphml_snapshot(graphml_file_path)
+    file_path = str(tmp_path / "snapshot.afrsnap")
+
+    write_binary_snapshot(g, file_path)
+
+    assert get_graph_differences(g, read_binary_snapshot(file_path)) == []
+
+
+def test_reader(tmp_path):
+    file_path = str(tmp_path / "snapshot.afrsnap")
+    write_binary_snapshot(create_snapshot(), file_path, metadata={"callstack_files": ["a.json"]})
+
+    with BinarySnapshotReader(file_path) as reader:
+        assert reader.get_metadata() == {"callstack_files": ["a.json"]}
+        assert reader.get_flag_column("flg-ad").tolist() == [False, True, False, False, False]
+        assert reader.get_flag_column("flg-image").tolist() == [False, False, True, False, False]
+        assert reader.get_flag_column("flg-textnode").tolist() == [False, False, False, True, False]
+        assert reader.get_array("edge_sources").tolist() == [0, 0, 1, 1, 2]
+        assert reader.get_array("edge_targets").tolist() == [2, 1, 3, 4, 4]
+
+
+def test_predecessor_order_follows_edge_order(tmp_path):
+    g = nx.DiGraph()
+    g.add_nodes_from(["b", "a", "c"])
+    g.add_edges_from([("a", "c"), ("b", "c")])
+    graphml_file_path = str(tmp_path / "snapshot.graphml")
+    nx.write_graphml(g, graphml_file_path)
+    file_path = str(tmp_path / "snapshot.afrsnap")
+
+    write_binary_snapshot(g, file_path)
+    g_binary = read_binary_snapshot(file_path)
+
+    assert list(g.pred["c"]) == ["a", "b"]
+    assert list(g_binary.pred["c"]) == list(read_graphml_snapshot(graphml_file_path).pred["c"]) == ["b", "a"]
+    assert get_graph_differences(g, g_binary) == ["predecessor order differs"]
+
+
+def test_empty_graph(tmp_path):
+    file_path = str(tmp_path / "snapshot.afrsnap")
+
+    write_binary_snapshot(nx.DiGraph(), file_path)
+
+    assert get_graph_differences(nx.DiGraph(), read_binary_snapshot(file_path)) == []
+
+
+@pytest.mark.parametrize("content", [b"", b"<graphml></graphml>"])
+def test_not_a_binary_snapshot(tmp_path, content):
+    file_path = tmp_path / "snapshot.afrsnap"
+    file_path.write_bytes(content)
+
+    with pytest.raises(MissingSnapshotException):
+        read_binary_snapshot(str(file_path))